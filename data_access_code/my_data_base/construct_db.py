@@ -1,6 +1,14 @@
+import argparse
+import csv
+import hashlib
+import io
+import os
 import sqlite3
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
 import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 import json
 
 
@@ -76,7 +84,8 @@ def get_us_state_list(url_to_get_states):
         print('fetching for us states!')
         response = requests.get(url_to_get_states)
         text_to_parse = response.text
-        soup = BeautifulSoup(text_to_parse, 'html.parser')
+        # only the table bodies are parsed, not the whole page
+        soup = BeautifulSoup(text_to_parse, 'html.parser', parse_only=SoupStrainer('tbody'))
         all_states = soup.find('tbody').find_all('tr')
         us_states_list = []
         for i in range(len(all_states)):
@@ -120,7 +129,8 @@ def get_us_airports_list(url_to_get_airports):
         print("fetching for us airports!")
         response = requests.get(url_to_get_airports)
         text_to_parse = response.text
-        soup = BeautifulSoup(text_to_parse, 'html.parser')
+        soup = BeautifulSoup(text_to_parse, 'html.parser',
+                             parse_only=SoupStrainer('table', border='1'))
         my_list_for_airports = soup.find('table', border=1).find_all('tr')[15:]
         airport_list = []
         for element in my_list_for_airports:
@@ -162,7 +172,8 @@ def get_us_city_area_list(url_to_get_city_area):
         print('fetching for us city areas!')
         response = requests.get(url_to_get_city_area)
         text_to_parse = response.text
-        soup = BeautifulSoup(text_to_parse, 'html.parser')
+        soup = BeautifulSoup(text_to_parse, 'html.parser',
+                             parse_only=SoupStrainer(id='mw-content-text'))
         result = soup.find(id="mw-content-text")
         result1 = result.find_all('tbody')
         result2 = result1[1].find_all('tr')
@@ -180,101 +191,501 @@ def get_us_city_area_list(url_to_get_city_area):
         return city_area_list
 
 
-if __name__ == "__main__":
-    ############################
-    # get the data by scraping #
-    ############################
-    # the states in the US, in list form
-    url_for_us_states = "https://www.englisch-hilfen.de/en/texte/states.htm"
-    us_states_list_to_store = get_us_state_list(url_for_us_states)
+def get_us_airport_locations(url_to_get_locations):
+    ''' get the coordinates of the airports by a csv file url
 
-    # the airports in the US, in list form
-    url_for_us_airports = 'https://www.airportcodes.us/us-airports.htm'
-    us_airports_list_to_store = get_us_airports_list(url_for_us_airports)
+    the file lists the airports of the world (from OurAirports), and in this
+    function we keep the latitude and longitude of the US airports with an
+    IATA code, which are saved in database later and used by the app to find
+    the nearest airports of a city.
 
-    # the largest cities in the US, in list form
-    url_for_us_cities = 'http://en.volupedia.org/wiki/List_of_United_States_cities_by_area'
-    us_cities_list_to_store = get_us_city_area_list(url_for_us_cities)
+    Parameters
+    ----------
+    url_to_get_locations: str
+        the url of the csv file of the airports
+    Returns
+    -------
+    list
+    '''
 
-    ############################
-    # start to create database #
-    ############################
-    print('with all the data, create the database...')
-    # open a connection to the database
-    conn = sqlite3.connect("airport_database.sqlite")
+    file_name = 'airport_locations_cache.json'
+    cache_dict = open_cache(file_name)
+    if url_to_get_locations in cache_dict:
+        print('using cache for us airport locations!')
+        return cache_dict[url_to_get_locations]
+    else:
+        print('fetching for us airport locations!')
+        response = requests.get(url_to_get_locations)
+        response.raise_for_status()
+        location_list = []
+        seen_codes = set()
+        for row in csv.DictReader(io.StringIO(response.text)):
+            airport_code = row['iata_code'].strip()
+            if row['iso_country'] != 'US' or not airport_code or row['type'] == 'closed' \
+                    or airport_code in seen_codes:
+                continue
+            seen_codes.add(airport_code)
+            temp_dict = {}
+            temp_dict['airport_code'] = airport_code
+            temp_dict['latitude'] = float(row['latitude_deg'])
+            temp_dict['longitude'] = float(row['longitude_deg'])
+            location_list.append(temp_dict)
+        cache_dict[url_to_get_locations] = location_list
+        save_cache(cache_dict, file_name)
+        return location_list
+
+
+# the states in the US, the airports in the US and the largest cities in the US
+URL_FOR_US_STATES = "https://www.englisch-hilfen.de/en/texte/states.htm"
+URL_FOR_US_AIRPORTS = 'https://www.airportcodes.us/us-airports.htm'
+URL_FOR_US_CITIES = 'http://en.volupedia.org/wiki/List_of_United_States_cities_by_area'
+# the coordinates of the airports
+URL_FOR_AIRPORT_LOCATIONS = 'https://davidmegginson.github.io/ourairports-data/airports.csv'
+
+CREATE_STATES = '''
+CREATE TABLE IF NOT EXISTS "states"(
+"Id" INTEGER PRIMARY KEY AUTOINCREMENT UNIQUE,
+"StateName" TEXT NOT NULL,
+"StateCode" TEXT NOT NULL
+);
+'''
+
+CREATE_AIRPORTS = '''
+CREATE TABLE IF NOT EXISTS "airports"(
+"Number" INTEGER PRIMARY KEY AUTOINCREMENT UNIQUE,
+"AirportCode" TEXT NOT NULL,
+"AirportName" TEXT NOT NULL,
+"AirportCity" TEXT NOT NULL,
+"AirportState" TEXT NOT NULL,
+FOREIGN KEY(AirportState) REFERENCES states(StateCode)
+);
+'''
+
+CREATE_CITIES = '''
+CREATE TABLE IF NOT EXISTS "cities_by_area"(
+"Orders" INTEGER PRIMARY KEY AUTOINCREMENT UNIQUE,
+"CityName" TEXT NOT NULL,
+"CityState" TEXT NOT NULL,
+"CityArea" INTEGER NOT NULL,
+FOREIGN KEY(CityState) REFERENCES states(StateName)
+);
+'''
+
+# the coordinates of the airports, by the code of the airports table
+CREATE_AIRPORT_LOCATIONS = '''
+CREATE TABLE IF NOT EXISTS "airport_locations"(
+"AirportCode" TEXT PRIMARY KEY,
+"Latitude" REAL NOT NULL,
+"Longitude" REAL NOT NULL
+);
+'''
+
+# the hash of each source dataset the tables were last loaded from
+CREATE_SOURCE_VERSIONS = '''
+CREATE TABLE IF NOT EXISTS "source_versions"(
+"Source" TEXT PRIMARY KEY,
+"Hash" TEXT NOT NULL,
+"RowCount" INTEGER NOT NULL,
+"UpdatedAt" REAL NOT NULL
+);
+'''
+
+# the names the two forms of the app suggest as the user types, see
+# /api/v1/suggest in app_main.py: every airport (by city, name and code) and
+# every city of cities_by_area, with the value to put in the form
+CREATE_PLACE_SUGGESTIONS = '''
+CREATE VIRTUAL TABLE IF NOT EXISTS "place_suggestions" USING fts5(
+"CityName", "AirportName", "AirportCode",
+"Kind" UNINDEXED, "Label" UNINDEXED, "Value" UNINDEXED,
+tokenize="unicode61 remove_diacritics 2", prefix="1 2 3"
+);
+'''
+FILL_PLACE_SUGGESTIONS = '''
+INSERT INTO "place_suggestions" ("CityName", "AirportName", "AirportCode", "Kind", "Label", "Value")
+SELECT AirportCity, AirportName, AirportCode, 'airport',
+       AirportCity || ', ' || AirportState || ' (' || AirportCode || ') ' || AirportName,
+       AirportCity
+FROM airports
+UNION ALL
+SELECT CityName, '', '', 'city',
+       CityName || ', ' || COALESCE(StateCode, CityState),
+       CityName || ', ' || COALESCE(StateCode, CityState)
+FROM cities_by_area LEFT JOIN states ON cities_by_area.CityState=states.StateName
+'''
+
+# the natural key of each table, which the upserts match rows on, and the
+# city of the airports, which the ticket routes of the app look airports up by
+CREATE_INDEXES = [
+    'CREATE UNIQUE INDEX IF NOT EXISTS "states_code" ON "states"("StateCode")',
+    'CREATE UNIQUE INDEX IF NOT EXISTS "airports_code" ON "airports"("AirportCode")',
+    'CREATE UNIQUE INDEX IF NOT EXISTS "cities_name_state" ON "cities_by_area"("CityName", "CityState")',
+    'CREATE INDEX IF NOT EXISTS "airports_city" ON "airports"("AirportCity")',
+]
+
+
+def state_row(each_state):
+    return (each_state['state_code'],), (each_state['state'],)
+
+
+def airport_row(each_airport):
+    return ((each_airport['airport_code'],),
+            (each_airport['airport_name'], each_airport['airport_city'],
+             each_airport['airport_state_code']))
+
+
+def city_row(each_city):
+    return (each_city['city_name'], each_city['city_state']), (each_city['city_area'],)
+
+
+def airport_location_row(each_location):
+    return (each_location['airport_code'],), (each_location['latitude'], each_location['longitude'])
+
+
+# table -> (source cache file, key columns, value columns, function turning a
+# scraped item into its (key, values) pair)
+TABLE_SOURCES = {
+    'states': ('states_cache.json', ('StateCode',), ('StateName',), state_row),
+    'airports': ('ariports_cache.json', ('AirportCode',),
+                 ('AirportName', 'AirportCity', 'AirportState'), airport_row),
+    'cities_by_area': ('cityareas_cache.json', ('CityName', 'CityState'), ('CityArea',), city_row),
+    'airport_locations': ('airport_locations_cache.json', ('AirportCode',),
+                          ('Latitude', 'Longitude'), airport_location_row),
+}
+
+
+def timed_call(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def get_all_sources():
+    ''' get the states, airports, cities and airport locations at the same
+    time, each from its cache file or by scraping its page
+
+    The airport locations are optional: when they cannot be fetched, the
+    airport_locations table is left as it is.
 
-    # create an instance of cursor
-    cur = conn.cursor()
+    Returns
+    -------
+    tuple
+        table name -> the list of scraped items for that table, and the
+        seconds taken by each source
+    '''
 
-    # create table "states"
-    drop_states = '''DROP TABLE IF EXISTS "states"'''
-    create_states = '''
-    CREATE TABLE IF NOT EXISTS "states"(
-    "Id" INTEGER PRIMARY KEY AUTOINCREMENT UNIQUE,
-    "StateName" TEXT NOT NULL,
-    "StateCode" TEXT NOT NULL
-    );
+    # each source has its own cache file, so the threads never write the
+    # same file
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        states_future = executor.submit(timed_call, get_us_state_list, URL_FOR_US_STATES)
+        airports_future = executor.submit(timed_call, get_us_airports_list, URL_FOR_US_AIRPORTS)
+        cities_future = executor.submit(timed_call, get_us_city_area_list, URL_FOR_US_CITIES)
+        locations_future = executor.submit(timed_call, get_us_airport_locations,
+                                           URL_FOR_AIRPORT_LOCATIONS)
+        us_states_list, states_seconds = states_future.result()
+        us_airports_list, airports_seconds = airports_future.result()
+        us_cities_list, cities_seconds = cities_future.result()
+        try:
+            airport_locations_list, locations_seconds = locations_future.result()
+        except requests.RequestException as error:
+            print(f'could not fetch the airport locations, keeping the ones in the database: {error}')
+            airport_locations_list, locations_seconds = None, 0.0
+    sources = {'states': us_states_list, 'airports': us_airports_list,
+               'cities_by_area': us_cities_list}
+    if airport_locations_list is not None:
+        sources['airport_locations'] = airport_locations_list
+    timings = {'states': states_seconds, 'airports': airports_seconds, 'cities': cities_seconds,
+               'airport_locations': locations_seconds}
+    return sources, timings
+
+
+def hash_source(items):
+    ''' the hash of a scraped dataset, which changes when any item changes
     '''
-    insert_states = '''
-    INSERT INTO states ("StateName", "StateCode") VALUES (?, ?)
+
+    return hashlib.sha256(json.dumps(items, sort_keys=True).encode()).hexdigest()
+
+
+def create_tables(cur):
+    for create_table in (CREATE_STATES, CREATE_AIRPORTS, CREATE_CITIES, CREATE_AIRPORT_LOCATIONS,
+                         CREATE_SOURCE_VERSIONS, CREATE_PLACE_SUGGESTIONS):
+        cur.execute(create_table)
+    for create_index in CREATE_INDEXES:
+        cur.execute(create_index)
+
+
+def sync_table(cur, table, items):
+    ''' make the rows of a table match the scraped items, writing only the
+    rows that differ
+
+    Parameters
+    ----------
+    cur: Cursor
+        a cursor of the database, in the transaction of the refresh
+
+    table: str
+        a key of TABLE_SOURCES
+
+    items: list
+        the scraped items of the table
+
+    Returns
+    -------
+    dict
+        the number of rows inserted, updated and deleted
+    '''
+
+    _, key_columns, value_columns, make_row = TABLE_SOURCES[table]
+    rows = dict(make_row(item) for item in items)
+    columns = ', '.join(f'"{column}"' for column in key_columns + value_columns)
+    cur.execute(f'SELECT {columns} FROM "{table}"')
+    existing = {row[:len(key_columns)]: row[len(key_columns):] for row in cur.fetchall()}
+
+    changed = [key + values for key, values in rows.items() if existing.get(key) != values]
+    deleted = [key for key in existing if key not in rows]
+    upsert = (f'INSERT INTO "{table}" ({columns}) '
+              f'VALUES ({", ".join("?" * len(key_columns + value_columns))}) '
+              f'ON CONFLICT({", ".join(key_columns)}) DO UPDATE SET '
+              + ', '.join(f'"{column}"=excluded."{column}"' for column in value_columns))
+    cur.executemany(upsert, changed)
+    cur.executemany(f'DELETE FROM "{table}" WHERE '
+                    + ' AND '.join(f'"{column}"=?' for column in key_columns), deleted)
+    inserted = sum(1 for row in changed if row[:len(key_columns)] not in existing)
+    return {'inserted': inserted, 'updated': len(changed) - inserted, 'deleted': len(deleted)}
+
+
+def store_sources(cur, sources, force=False):
+    ''' sync the tables whose source changed since the last run, and record
+    the new hashes
+
+    Parameters
+    ----------
+    cur: Cursor
+        a cursor of the database, in a transaction
+
+    sources: dict
+        table name -> the list of scraped items, see get_all_sources
+
+    force: bool
+        sync every table, even if its source did not change
+
+    Returns
+    -------
+    dict
+        table name -> the rows inserted, updated and deleted, or None if the
+        source did not change, and the same for the place_suggestions index
     '''
-    cur.execute(drop_states)
-    cur.execute(create_states)
-    for each_state in us_states_list_to_store:
-        data_to_insert = [each_state['state'], each_state['state_code']]
-        cur.execute(insert_states, data_to_insert)
-
-    # create table "airports"
-    drop_airports = '''DROP TABLE IF EXISTS "airports"'''
-    create_airports = '''
-    CREATE TABLE IF NOT EXISTS "airports"(
-    "Number" INTEGER PRIMARY KEY AUTOINCREMENT UNIQUE,
-    "AirportCode" TEXT NOT NULL,
-    "AirportName" TEXT NOT NULL,
-    "AirportCity" TEXT NOT NULL,
-    "AirportState" TEXT NOT NULL,
-    FOREIGN KEY(AirportState) REFERENCES states(StateCode)
-    );
+
+    cur.execute('SELECT "Source", "Hash" FROM "source_versions"')
+    stored_hashes = dict(cur.fetchall())
+    report = {}
+    for table, items in sources.items():
+        source_filename = TABLE_SOURCES[table][0]
+        source_hash = hash_source(items)
+        if not force and stored_hashes.get(source_filename) == source_hash:
+            report[table] = None
+            continue
+        report[table] = sync_table(cur, table, items)
+        cur.execute('INSERT OR REPLACE INTO "source_versions" VALUES (?, ?, ?, ?)',
+                    (source_filename, source_hash, len(items), time.time()))
+    report['place_suggestions'] = None
+    if report['airports'] or report['cities_by_area'] or cur.execute('SELECT 1 FROM "place_suggestions" LIMIT 1').fetchone() is None:
+        report['place_suggestions'] = fill_place_suggestions(cur)
+    return report
+
+
+def fill_place_suggestions(cur):
+    ''' rebuild the place_suggestions index from the airports and
+    cities_by_area tables
+
+    The index is derived from both tables and has a few hundred rows, so it
+    is rebuilt as a whole whenever one of them changes.
+
+    Parameters
+    ----------
+    cur: Cursor
+        a cursor of the database, in a transaction
+
+    Returns
+    -------
+    dict
+        the rows inserted and deleted
     '''
-    insert_airports = '''
-    INSERT INTO airports ("AirportCode", "AirportName", "AirportCity", "AirportState")
-    VALUES (?, ?, ?, ?)
+
+    deleted = cur.execute('SELECT COUNT(*) FROM "place_suggestions"').fetchone()[0]
+    cur.execute('DELETE FROM "place_suggestions"')
+    cur.execute(FILL_PLACE_SUGGESTIONS)
+    inserted = cur.execute('SELECT COUNT(*) FROM "place_suggestions"').fetchone()[0]
+    # merge the index into one b-tree, the fastest for queries
+    cur.execute('INSERT INTO "place_suggestions" ("place_suggestions") VALUES (\'optimize\')')
+    return {'inserted': inserted, 'updated': 0, 'deleted': deleted}
+
+
+def build_database(database_filename, sources):
+    ''' create the database in a temporary file next to database_filename,
+    then rename it over database_filename
+
+    The rename is atomic, so the app reading database_filename sees either
+    the old database or the new one, never empty tables. Connections opened
+    before the rename keep reading the old file until they close.
+
+    Parameters
+    ----------
+    database_filename: str
+        the database to replace
+
+    sources: dict
+        table name -> the list of scraped items, see get_all_sources
+
+    Returns
+    -------
+    dict
+        the rows loaded into each table, and the seconds taken to load the
+        rows and to swap the file in
     '''
-    cur.execute(drop_airports)
-    cur.execute(create_airports)
-    for each_airport in us_airports_list_to_store:
-        data_to_insert = [each_airport['airport_code'],
-                          each_airport['airport_name'],
-                          each_airport['airport_city'],
-                          each_airport['airport_state_code']]
-        cur.execute(insert_airports, data_to_insert)
-
-    # create table "cities_by_area"
-    drop_cities_by_area = '''DROP TABLE IF EXISTS "cities_by_area"'''
-    create_cities = '''
-    CREATE TABLE IF NOT EXISTS "cities_by_area"(
-    "Orders" INTEGER PRIMARY KEY AUTOINCREMENT UNIQUE,
-    "CityName" TEXT NOT NULL,
-    "CityState" TEXT NOT NULL,
-    "CityArea" INTEGER NOT NULL,
-    FOREIGN KEY(CityState) REFERENCES states(StateName)
-    );
+
+    database_directory = os.path.dirname(os.path.abspath(database_filename))
+    file_descriptor, temporary_filename = tempfile.mkstemp(
+        prefix='.airport_database.', suffix='.sqlite', dir=database_directory)
+    os.close(file_descriptor)
+    try:
+        start = time.perf_counter()
+        conn = sqlite3.connect(temporary_filename)
+        cur = conn.cursor()
+        # one transaction for all the rows, committed at the end of "with"
+        with conn:
+            create_tables(cur)
+            report = store_sources(cur, sources, force=True)
+        conn.close()
+        load_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        # mkstemp makes the file readable by its owner only
+        os.chmod(temporary_filename, 0o644)
+        os.replace(temporary_filename, database_filename)
+        swap_seconds = time.perf_counter() - start
+    except BaseException:
+        if os.path.exists(temporary_filename):
+            os.remove(temporary_filename)
+        raise
+    return report, {'load': load_seconds, 'swap': swap_seconds}
+
+
+def refresh_database(database_filename, sources):
+    ''' update the database in place, only the rows of the sources that
+    changed since the last run
+
+    All the changes are made in one transaction, so the app sees either the
+    old rows or the new ones; the file gets a new modification time, which
+    makes the app reload what it read from the database (see
+    database_version in app_main.py). The first refresh of a database built before
+    the source_versions table existed compares every row, then records the
+    hashes.
+
+    Parameters
+    ----------
+    database_filename: str
+        the database to update
+
+    sources: dict
+        table name -> the list of scraped items, see get_all_sources
+
+    Returns
+    -------
+    tuple
+        the rows changed in each table (see store_sources), and the seconds
+        taken
     '''
-    insert_cities = '''
-    INSERT INTO cities_by_area ("CityName", "CityState", "CityArea")
-    VALUES (?, ?, ?)
+
+    start = time.perf_counter()
+    conn = sqlite3.connect(database_filename)
+    cur = conn.cursor()
+    with conn:
+        create_tables(cur)
+        report = store_sources(cur, sources)
+    conn.close()
+    return report, {'load': time.perf_counter() - start}
+
+
+def has_tables(database_filename):
+    if not os.path.exists(database_filename):
+        return False
+    conn = sqlite3.connect(database_filename)
+    cur = conn.cursor()
+    cur.execute("SELECT COUNT(*) FROM sqlite_master WHERE type='table' AND name IN (?, ?, ?)",
+                ('states', 'airports', 'cities_by_area'))
+    count = cur.fetchone()[0]
+    conn.close()
+    return count == 3
+
+
+def read_airport_locations(database_filename):
+    ''' the airport locations stored in a database, to carry them over to a
+    rebuilt database when they cannot be fetched
+
+    Returns
+    -------
+    list
+        the airport locations, as get_us_airport_locations returns them, or
+        None if the database has none
     '''
-    cur.execute(drop_cities_by_area)
-    cur.execute(create_cities)
-    for each_city in us_cities_list_to_store:
-        data_to_insert = [each_city['city_name'],
-                          each_city['city_state'],
-                          each_city['city_area']]
-        cur.execute(insert_cities, data_to_insert)
-
-    # commit the changes
-    conn.commit()
-
-    # close
+
+    if not os.path.exists(database_filename):
+        return None
+    conn = sqlite3.connect(database_filename)
+    try:
+        rows = conn.execute('SELECT AirportCode, Latitude, Longitude FROM airport_locations').fetchall()
+    except sqlite3.OperationalError:
+        rows = []
     conn.close()
-    print('DONE!')
\ No newline at end of file
+    if not rows:
+        return None
+    return [{'airport_code': airport_code, 'latitude': latitude, 'longitude': longitude}
+            for airport_code, latitude, longitude in rows]
+
+
+if __name__ == "__main__":
+    # run from the data_access_code/my_data_base directory, eg.
+    #     python construct_db.py
+    #     python construct_db.py --database ../../proj_flask/database/airport_database.sqlite
+    #     python construct_db.py --rebuild
+    parser = argparse.ArgumentParser(description='build or refresh the airport database')
+    parser.add_argument('--database', default='airport_database.sqlite',
+                        help='the database file to update')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='build a new database and swap it in, instead of '
+                             'updating the changed rows')
+    args = parser.parse_args()
+
+    ############################
+    # get the data by scraping #
+    ############################
+    start = time.perf_counter()
+    sources_to_store, timings = get_all_sources()
+    timings['fetch'] = time.perf_counter() - start
+
+    ############################
+    # start to create database #
+    ############################
+    if args.rebuild or not has_tables(args.database):
+        print('with all the data, create the database...')
+        if 'airport_locations' not in sources_to_store:
+            stored_locations = read_airport_locations(args.database)
+            if stored_locations is not None:
+                sources_to_store['airport_locations'] = stored_locations
+        report, load_timings = build_database(args.database, sources_to_store)
+    else:
+        print('with all the data, update the changed rows of the database...')
+        report, load_timings = refresh_database(args.database, sources_to_store)
+    timings.update(load_timings)
+    timings['total'] = time.perf_counter() - start
+    for table, changes in report.items():
+        if changes is None:
+            print(f'    {table:<18}unchanged')
+        else:
+            print(f"    {table:<18}{changes['inserted']} inserted, {changes['updated']} updated, "
+                  f"{changes['deleted']} deleted")
+    for step in ('states', 'airports', 'cities', 'airport_locations', 'fetch', 'load', 'swap',
+                 'total'):
+        if step in timings:
+            print(f'    {step:<18}{timings[step] * 1000:10.1f} ms')
+    print('DONE!')
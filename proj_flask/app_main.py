@@ -1,11 +1,35 @@
-from flask import Flask, request, render_template
-import requests
+from flask import Flask, Response, request, render_template, jsonify
 import plotly.graph_objects as go
 import json
 import sqlite3
 import pandas as pd
-import secrets
 import re
+import os
+import sys
+import hmac
+import tempfile
+import time
+import threading
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from binary_cache import open_binary_cache, build_binary_cache
+from background_refresh import BackgroundRefresher
+import metrics
+import profiling
+import upstream
+from upstream import UpstreamError, get_json, api_key
+from nearest_airports import load_airport_tree
+from itinerary import order_attractions
+from city_names import normalize_city_name, build_city_alias_index, split_state_suffix
+from projection import project_hotels_response, project_attractions_response, \
+    attractions_from_entry
+try:
+    import fcntl
+except ImportError:
+    # windows, see locked_cache_file
+    fcntl = None
+    import msvcrt
 
 
 class CityAttrInfo:
@@ -113,223 +137,1282 @@ class Hotel:
         return f"{self.name}---price: {self.price}, rating: {self.rating}"
 
 
+# in offline mode (see upstream.py) the cache files are a fixed data set:
+# what would be saved to them is kept here instead, per process.
+# cache file name -> the cache dictionary
+offline_caches = {}
+offline_caches_lock = threading.Lock()
+# cache file name -> the number of times it was saved in offline mode, see
+# cache_file_version
+offline_cache_saves = Counter()
+
+
+@metrics.timed('cache_load')
 def open_cache(cache_filename):
     ''' opens the cache file if it exists and loads the JSON into
         a dictionary, which it then returns.
         if the cache file doesn't exist, creates a new cache dictionary
 
-    Parameters
-    ----------
-    cache_filename: str
-        the name of the json file to open
+    Parameters
+    ----------
+    cache_filename: str
+        the name of the json file to open
+
+    Returns
+    -------
+    The opened cache
+    '''
+
+    if cache_filename in offline_caches:
+        return dict(offline_caches[cache_filename])
+    try:
+        cache_file = open(cache_filename, 'r')
+        cache_contents = cache_file.read()
+        cache_dict = json.loads(cache_contents)
+        cache_file.close()
+    except (OSError, ValueError):
+        cache_dict = {}
+    return cache_dict
+
+
+def save_cache(cache_dict, cache_filename):
+    ''' saves the current state of the cache to disk
+
+    The cache is written to a temporary file in the same directory which is
+    then renamed over the cache file, so readers see either the old or the
+    new file, never a half-written one. To add entries to a cache file that
+    other processes may be writing, use update_cache instead.
+
+    Parameters
+    ----------
+    cache_dict: dict
+        The dictionary to save
+    cache_filename: str
+        The name of the cache file
+
+    Returns
+    -------
+    None
+    '''
+
+    if upstream.OFFLINE:
+        offline_caches[cache_filename] = dict(cache_dict)
+        offline_cache_saves[cache_filename] += 1
+        return
+    dumped_json_cache = json.dumps(cache_dict)
+    fd, temp_filename = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(cache_filename)),
+        prefix=os.path.basename(cache_filename) + '.', suffix='.tmp')
+    try:
+        # mkstemp creates the file readable by the owner only
+        os.chmod(temp_filename, 0o644)
+        with os.fdopen(fd, 'w') as fw:
+            fw.write(dumped_json_cache)
+            fw.flush()
+            os.fsync(fw.fileno())
+        os.replace(temp_filename, cache_filename)
+    except BaseException:
+        os.unlink(temp_filename)
+        raise
+
+
+@contextmanager
+def locked_cache_file(cache_filename):
+    ''' hold the exclusive write lock of a cache file
+
+    The lock is an advisory lock on <cache_filename>.lock, shared by every
+    process and thread that writes the cache through update_cache. Readers do
+    not take it, the atomic rename in save_cache keeps them safe.
+
+    Parameters
+    ----------
+    cache_filename: str
+        The name of the cache file
+    '''
+
+    lock_file = open(cache_filename + '.lock', 'a+')
+    try:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        else:
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+        yield
+    finally:
+        # closing the file releases the lock
+        lock_file.close()
+
+
+def update_cache(cache_filename, new_entries, with_snapshot=False):
+    ''' add entries to a cache file without losing concurrent writes
+
+    Under the write lock, the current file is re-read, the new entries are
+    merged into it and the result is saved, so entries added by other
+    processes since this one read the cache are kept. A cache file that
+    exists but cannot be parsed raises instead of being overwritten.
+
+    Parameters
+    ----------
+    cache_filename: str
+        The name of the cache file
+    new_entries: dict
+        The entries to add or replace
+    with_snapshot: bool
+        whether to rebuild the binary snapshot of the file as well
+
+    Returns
+    -------
+    dict
+        the merged cache
+    '''
+
+    if upstream.OFFLINE:
+        with offline_caches_lock:
+            cache_dict = open_cache(cache_filename)
+            cache_dict.update(new_entries)
+            save_cache(cache_dict, cache_filename)
+        return cache_dict
+    with locked_cache_file(cache_filename):
+        try:
+            with open(cache_filename, 'r') as fr:
+                cache_dict = json.load(fr)
+        except FileNotFoundError:
+            cache_dict = {}
+        cache_dict.update(new_entries)
+        save_cache(cache_dict, cache_filename)
+        if with_snapshot:
+            build_binary_cache(cache_dict, cache_filename)
+    return cache_dict
+
+
+# the database with the airports, states and city areas
+DATABASE_FILENAME = './database/airport_database.sqlite'
+
+
+def database_version():
+    ''' a value that changes whenever the database is rebuilt or refreshed
+
+    construct_db.py either renames a new file over the database (a new inode)
+    or updates its rows in place (a new modification time), so the tables
+    read from it are reloaded by every worker without a restart.
+
+    Returns
+    -------
+    tuple
+    '''
+
+    stat = os.stat(DATABASE_FILENAME)
+    return stat.st_ino, stat.st_mtime_ns
+
+# the cache files that are read through their binary snapshots
+SNAPSHOT_CACHE_FILENAMES = ['city_location_attraction.json', 'hotels_cache.json']
+
+
+def preload_caches():
+    ''' get the database and the caches ready before serving requests
+
+    Called once in the server process before the workers are forked (see
+    wsgi.py), so the mapped snapshots are shared by all the workers, and again
+    in each new worker to pick up snapshots rebuilt in the meantime. Stale or
+    missing snapshots are rebuilt from the json files.
+
+    Returns
+    -------
+    dict
+        the number of entries in each preloaded cache, and of airports
+    '''
+
+    summary = {'rekeyed_city_entries': rekey_city_caches()}
+    for cache_filename in SNAPSHOT_CACHE_FILENAMES:
+        binary_cache = open_binary_cache(cache_filename)
+        if binary_cache is None and os.path.exists(cache_filename):
+            with locked_cache_file(cache_filename):
+                build_binary_cache(open_cache(cache_filename), cache_filename)
+            binary_cache = open_binary_cache(cache_filename)
+        if binary_cache is None:
+            summary[cache_filename] = 0
+        else:
+            binary_cache.warm()
+            summary[cache_filename] = len(binary_cache)
+    summary['city_location.json'] = len(open_cache('city_location.json'))
+    summary['city_aliases'] = len(get_city_alias_index())
+    summary['search_radius_table'] = len(get_search_radius_table())
+    summary['nearest_airports'] = len(get_airport_tree())
+    conn = sqlite3.connect(DATABASE_FILENAME)
+    cur = conn.cursor()
+    cur.execute('SELECT COUNT(*) FROM airports')
+    summary['airports'] = cur.fetchone()[0]
+    conn.close()
+    app.config['PRELOADED_CACHES'] = summary
+    return summary
+
+
+# its own stage, as it calls open_cache when there is no snapshot
+@metrics.timed('cache_lookup')
+def lookup_cache(cache_filename, key):
+    ''' look up one entry of a cache file
+
+    When the cache file has an up-to-date binary snapshot (see
+    binary_cache.py), only the requested entry is read from the mapped file;
+    otherwise the json file is loaded as before.
+
+    Parameters
+    ----------
+    cache_filename: str
+        the name of the json cache file
+
+    key: str
+        the key of the entry
+
+    Returns
+    -------
+    the cached value, or None if the key is not cached
+    '''
+
+    if cache_filename in offline_caches:
+        return offline_caches[cache_filename].get(key)
+    binary_cache = open_binary_cache(cache_filename)
+    if binary_cache is not None:
+        return binary_cache.get(key)
+    return open_cache(cache_filename).get(key)
+
+
+
+# soft and hard expiry of the entries of each cache namespace, in seconds.
+# An entry older than its soft expiry is still served, and refreshed in the
+# background; one older than its hard expiry is fetched again before serving.
+# Entries cached before the fetch time was recorded count as soft-expired.
+DAY = 24 * 60 * 60
+CACHE_EXPIRY = {'city_location': (30 * DAY, 365 * DAY),
+                'city_attractions': (7 * DAY, 90 * DAY),
+                'hotels': (3 * DAY, 30 * DAY),
+                'weather': (30 * 60, 3 * 60 * 60)}
+
+# the weather forecasts, which only stay valid for a few hours
+WEATHER_CACHE_FILENAME = 'weather_cache.json'
+
+background_refresher = BackgroundRefresher()
+
+
+def stamp_fetch_time(entry):
+    ''' record when a cache entry was fetched, under '_fetched_at'
+
+    Parameters
+    ----------
+    entry: dict
+        the entry about to be cached
+
+    Returns
+    -------
+    the entry
+    '''
+
+    if isinstance(entry, dict):
+        entry['_fetched_at'] = time.time()
+    return entry
+
+
+def cache_entry_freshness(namespace, entry):
+    ''' tell whether a cache entry is fresh, stale or expired
+
+    Parameters
+    ----------
+    namespace: str
+        the cache namespace, see CACHE_EXPIRY
+
+    entry:
+        the cached entry
+
+    Returns
+    -------
+    str
+        'fresh', 'stale' (to be refreshed in the background) or 'expired'
+        (to be fetched again before serving)
+    '''
+
+    if upstream.OFFLINE:
+        # the cache files are the data set of offline runs, they are not
+        # refreshed from the stub servers
+        return 'fresh'
+    soft_expiry, hard_expiry = CACHE_EXPIRY[namespace]
+    fetched_at = entry.get('_fetched_at') if isinstance(entry, dict) else None
+    if fetched_at is None:
+        return 'stale'
+    age = time.time() - fetched_at
+    if age > hard_expiry:
+        return 'expired'
+    if age > soft_expiry:
+        return 'stale'
+    return 'fresh'
+
+
+def schedule_refresh(namespace, cache_filename, key, refresh_function):
+    ''' refresh a stale cache entry in the background
+
+    The refresh is skipped if the entry was refreshed in the meantime, eg. by
+    another worker process.
+
+    Parameters
+    ----------
+    namespace: str
+        the cache namespace, see CACHE_EXPIRY
+
+    cache_filename: str
+        the name of the cache file holding the entry
+
+    key: str
+        the key of the entry
+
+    refresh_function: function
+        fetches and caches the entry again, called without arguments
+
+    Returns
+    -------
+    None
+    '''
+
+    def refresh_if_still_stale():
+        entry = lookup_cache(cache_filename, key)
+        if entry is None or cache_entry_freshness(namespace, entry) != 'fresh':
+            count_cache_event(namespace, 'refresh')
+            refresh_function()
+
+    count_cache_event(namespace, 'stale_hit')
+    background_refresher.schedule((namespace, key), refresh_if_still_stale)
+
+
+# negative results (unknown cities, non-US cities, cities without a given kind
+# of attraction) are kept in their own file, and expire after a shorter time
+# than the positive results, which are kept for good
+NEGATIVE_CACHE_FILENAME = 'negative_results_cache.json'
+NEGATIVE_RESULT_TTL = {'not_found': 6 * 60 * 60,
+                       'not_us': 7 * 24 * 60 * 60,
+                       'no_attractions': 24 * 60 * 60}
+
+# hit/miss counters of this process, by cache namespace, eg.
+# cache_counters['city_location']['negative_hit']
+cache_counters = {}
+cache_counters_lock = threading.Lock()
+
+
+def count_cache_event(namespace, event, count=1):
+    ''' count a cache event ('hit', 'miss', 'negative_hit', 'negative_store',
+    'evicted'...)
+
+    Parameters
+    ----------
+    namespace: str
+        the cache namespace, eg. 'city_location'
+
+    event: str
+        the name of the event
+
+    count: int
+        the number of events
+
+    Returns
+    -------
+    None
+    '''
+
+    with cache_counters_lock:
+        cache_counters.setdefault(namespace, Counter())[event] += count
+
+
+def lookup_negative_result(namespace, key):
+    ''' check whether a lookup is known to have no result
+
+    Parameters
+    ----------
+    namespace: str
+        the cache namespace, eg. 'city_location'
+
+    key: str
+        the key within the namespace
+
+    Returns
+    -------
+    str
+        the reason of the unexpired negative result, or None
+    '''
+
+    entry = open_cache(NEGATIVE_CACHE_FILENAME).get(f'{namespace}:{key}')
+    if entry is None:
+        return None
+    if time.time() - entry['cached_at'] > NEGATIVE_RESULT_TTL[entry['reason']]:
+        return None
+    count_cache_event(namespace, 'negative_hit')
+    return entry['reason']
+
+
+def store_negative_result(namespace, key, reason):
+    ''' remember that a lookup has no result, see NEGATIVE_RESULT_TTL
+
+    Parameters
+    ----------
+    namespace: str
+        the cache namespace, eg. 'city_location'
+
+    key: str
+        the key within the namespace
+
+    reason: str
+        'not_found', 'not_us' or 'no_attractions'
+
+    Returns
+    -------
+    None
+    '''
+
+    now = time.time()
+    with locked_cache_file(NEGATIVE_CACHE_FILENAME):
+        cache_dict = open_cache(NEGATIVE_CACHE_FILENAME)
+        # drop the expired entries while the file is being rewritten anyway
+        unexpired = {name: entry for name, entry in cache_dict.items()
+                     if now - entry['cached_at'] <= NEGATIVE_RESULT_TTL[entry['reason']]}
+        evicted = len(cache_dict) - len(unexpired)
+        unexpired[f'{namespace}:{key}'] = {'reason': reason, 'cached_at': now}
+        save_cache(unexpired, NEGATIVE_CACHE_FILENAME)
+    count_cache_event(namespace, 'negative_store')
+    if evicted:
+        count_cache_event('negative_results', 'evicted', evicted)
+
+
+# aliases learned from OpenTripMap, eg. a misspelled name -> the name the api
+# resolved it to, see city_names.py for the other sources of aliases
+CITY_ALIASES_FILENAME = 'city_aliases.json'
+
+_city_alias_index = None
+_city_alias_index_version = None
+_city_alias_index_lock = threading.Lock()
+
+
+def cache_file_version(cache_filename):
+    ''' a value that changes whenever a cache file is saved
+
+    In offline mode the saves only change the copy in offline_caches, not
+    the file, so their number is the version.
+
+    Parameters
+    ----------
+    cache_filename: str
+        the name of the json cache file
+
+    Returns
+    -------
+    tuple
+    '''
+
+    if cache_filename in offline_caches:
+        return 'offline', offline_cache_saves[cache_filename]
+    if not os.path.exists(cache_filename):
+        return 'missing', None
+    return 'file', os.stat(cache_filename).st_mtime_ns
+
+
+def get_city_alias_index():
+    ''' get the city alias index, rebuilt when one of its sources changes
+
+    Returns
+    -------
+    CityAliasIndex
+    '''
+
+    global _city_alias_index, _city_alias_index_version
+    version = (database_version(),) + tuple(
+        cache_file_version(name) for name in ('city_location.json', CITY_ALIASES_FILENAME))
+    with _city_alias_index_lock:
+        if _city_alias_index is None or version != _city_alias_index_version:
+            _city_alias_index = build_city_alias_index(DATABASE_FILENAME,
+                                                       open_cache('city_location.json'),
+                                                       open_cache(CITY_ALIASES_FILENAME))
+            _city_alias_index_version = version
+        return _city_alias_index
+
+
+def canonical_city_id(city_name):
+    ''' get the canonical ID of a city name, which all the caches key on
+
+    "New York", "new  york", "NYC" and "New York City" all give the same ID.
+
+    Parameters
+    ----------
+    city_name: str
+        the name of the city, in any spelling
+
+    Returns
+    -------
+    str
+    '''
+
+    return get_city_alias_index().resolve(city_name)
+
+
+def rekey_city_caches():
+    ''' move the entries cached under raw city names to canonical city IDs
+
+    Entries cached before the city names were canonicalized are keyed on the
+    lowercased input. They are moved to the canonical ID of the name they were
+    resolved to, and the raw names are kept as aliases. Does nothing when the
+    caches are already keyed on canonical IDs. The entries whose key or value
+    does not have the expected shape are kept as they are, and listed on
+    stderr; cache_stats.py reports the invalid entries.
+
+    Returns
+    -------
+    int
+        the number of entries moved
+    '''
+
+    moved = 0
+    index = get_city_alias_index()
+    with locked_cache_file('city_location.json'):
+        locations = open_cache('city_location.json')
+        rekeyed_locations = {}
+        learned_aliases = {}
+        for key, entry in locations.items():
+            if not isinstance(entry, dict) or not isinstance(entry.get('name'), str):
+                print(f'city_location.json: not rekeying {key!r}, it has no name',
+                      file=sys.stderr)
+                rekeyed_locations.setdefault(key, entry)
+                continue
+            city_id = index.resolve(entry['name'])
+            if key != city_id:
+                moved += 1
+                learned_aliases[key] = entry['name']
+            if key == city_id or city_id not in rekeyed_locations:
+                rekeyed_locations[city_id] = entry
+        if learned_aliases:
+            update_cache(CITY_ALIASES_FILENAME, learned_aliases)
+            save_cache(rekeyed_locations, 'city_location.json')
+
+    index = get_city_alias_index()
+    file_name = 'city_location_attraction.json'
+    with locked_cache_file(file_name):
+        attractions = open_cache(file_name)
+        rekeyed_attractions = {}
+        for key, entry in attractions.items():
+            if '_' not in key:
+                print(f'{file_name}: not rekeying {key!r}, it has no attraction type',
+                      file=sys.stderr)
+                rekeyed_attractions.setdefault(key, entry)
+                continue
+            # city names have no '_', attraction types do
+            city_name, attraction_type = key.split('_', 1)
+            unique_name = generate_unique_city_attraction_name(index.resolve(city_name),
+                                                               attraction_type)
+            if key != unique_name:
+                moved += 1
+            if key == unique_name or unique_name not in rekeyed_attractions:
+                rekeyed_attractions[unique_name] = entry
+        if rekeyed_attractions.keys() != attractions.keys():
+            save_cache(rekeyed_attractions, file_name)
+            if not upstream.OFFLINE:
+                build_binary_cache(rekeyed_attractions, file_name)
+    return moved
+
+
+# the search radius for the cities that are not in cities_by_area
+DEFAULT_SEARCH_RADIUS = 14 * 1000
+
+_search_radius_table = None
+_search_radius_table_version = None
+_search_radius_table_lock = threading.Lock()
+
+
+def load_search_radius_table():
+    ''' read the attraction search radius of every city in cities_by_area
+
+    The radius depends on the size of the city: it is the side of a square
+    with the area of the city, in meters.
+
+    Returns
+    -------
+    dict
+        canonical city ID -> list of (state name, state code, radius) for the
+        cities of that name, largest city first
+    '''
+
+    conn = sqlite3.connect(DATABASE_FILENAME)
+    cur = conn.cursor()
+    query = '''
+    SELECT CityName, CityState, StateCode, CityArea FROM cities_by_area
+    LEFT JOIN states ON cities_by_area.CityState=states.StateName
+    ORDER BY CityArea DESC, Orders
+    '''
+    cur.execute(query)
+    table = {}
+    for city_name, state_name, state_code, city_area in cur:
+        search_radius = round(city_area**0.5, 3) * 1000
+        table.setdefault(normalize_city_name(city_name), []).append(
+            (state_name, state_code, search_radius))
+    conn.close()
+    return table
+
+
+def get_search_radius_table():
+    ''' get the search radius table, reloaded when the database is rebuilt or
+    refreshed
+
+    Returns
+    -------
+    dict
+        see load_search_radius_table
+    '''
+
+    global _search_radius_table, _search_radius_table_version
+    version = database_version()
+    with _search_radius_table_lock:
+        if _search_radius_table is None or version != _search_radius_table_version:
+            _search_radius_table = load_search_radius_table()
+            _search_radius_table_version = version
+        return _search_radius_table
+
+
+@metrics.timed('search_radius')
+def get_search_radius(city_id, state=None):
+    ''' get the radius to search for attractions around a city
+
+    Parameters
+    ----------
+    city_id: str
+        the canonical ID of the city
+
+    state: str
+        optional, the name or the code of the state of the city, to tell the
+        cities with the same name apart (eg. Springfield); without it, or if
+        it matches none of them, the largest city of that name is used
+
+    Returns
+    -------
+    float
+        the radius in meters
+    '''
+
+    candidates = get_search_radius_table().get(city_id)
+    if not candidates:
+        return DEFAULT_SEARCH_RADIUS
+    if state is not None:
+        state_id = normalize_city_name(state)
+        for state_name, state_code, search_radius in candidates:
+            if state_id in (normalize_city_name(state_name),
+                            normalize_city_name(state_code or '')):
+                return search_radius
+    return candidates[0][2]
+
+
+# the suggestions of the forms, from the place_suggestions full-text index
+# that construct_db.py builds over the airports and the cities
+SUGGEST_QUERY = '''
+SELECT Kind, Label, Value FROM place_suggestions
+WHERE place_suggestions MATCH ?{kind_filter}
+ORDER BY bm25(place_suggestions, 10.0, 1.0, 5.0)
+LIMIT ?
+'''
+SUGGEST_KINDS = ('city', 'airport')
+MAX_SUGGESTIONS = 20
+
+_suggest_connections = threading.local()
+
+
+def get_suggest_connection():
+    ''' a read-only connection to the database for this thread, reopened
+    when the database changes
+
+    Opening a connection and reading the schema costs more than a suggest
+    query, so each thread keeps its own.
+
+    Returns
+    -------
+    Connection
+    '''
+
+    version = database_version()
+    if getattr(_suggest_connections, 'version', None) != version:
+        if getattr(_suggest_connections, 'conn', None) is not None:
+            _suggest_connections.conn.close()
+        _suggest_connections.conn = sqlite3.connect(f'file:{DATABASE_FILENAME}?mode=ro', uri=True)
+        _suggest_connections.version = version
+    return _suggest_connections.conn
+
+
+def suggest_places(text, kind=None, limit=8):
+    ''' complete what the user typed to city and airport names
+
+    Every word typed is matched as the prefix of a word of the city name,
+    the airport name or the airport code, eg. "new yo", "det" or "jfk".
+
+    Parameters
+    ----------
+    text: str
+        what the user typed
+
+    kind: str
+        optional, 'city' or 'airport' to suggest only one kind of place
+
+    limit: int
+        the maximum number of suggestions
+
+    Returns
+    -------
+    list
+        dicts with the kind, the label to show and the value to put in the
+        form, best match first
+    '''
+
+    words = re.findall(r'[^\W_]+', text)
+    if not words:
+        return []
+    match = ' '.join(f'"{word}"*' for word in words)
+    query = SUGGEST_QUERY.format(kind_filter=' AND Kind = ?' if kind else '')
+    parameters = (match, kind, limit) if kind else (match, limit)
+    return [{'kind': place_kind, 'label': label, 'value': value}
+            for place_kind, label, value in get_suggest_connection().execute(query, parameters)]
+
+
+# how many airports near a city without its own airport are shown, the
+# nearest one is used for the tickets
+NEAREST_AIRPORTS = 3
+
+_airport_tree = None
+_airport_tree_version = None
+_airport_tree_lock = threading.Lock()
+
+
+def get_airport_tree():
+    ''' get the tree of the airports with coordinates, rebuilt when the
+    database changes
+
+    Returns
+    -------
+    AirportTree
+        see nearest_airports.py
+    '''
+
+    global _airport_tree, _airport_tree_version
+    version = database_version()
+    with _airport_tree_lock:
+        if _airport_tree is None or version != _airport_tree_version:
+            _airport_tree = load_airport_tree(DATABASE_FILENAME)
+            _airport_tree_version = version
+        return _airport_tree
+
+
+def find_nearest_airports(city_name, k=NEAREST_AIRPORTS):
+    ''' the airports nearest to a city, from its cached position
+
+    Only the cities in city_location.json have a position, no api is
+    called for the others.
+
+    Parameters
+    ----------
+    city_name: str
+        the name of the city, in any spelling
+
+    k: int
+        the number of airports
+
+    Returns
+    -------
+    list
+        (distance in km, (code, name, city, state name, latitude, longitude))
+        pairs, nearest first; empty if the city has no cached position or the
+        database has no airport locations
+    '''
+
+    location = lookup_cache('city_location.json', canonical_city_id(city_name))
+    if location is None:
+        return []
+    return get_airport_tree().nearest(location['position']['lat'],
+                                      location['position']['lon'], k)
+
+
+# conn = sqlite3.connect('../my_data_base/airport_database.sqlite')
+# cur = conn.cursor()
+
+@metrics.timed('city_location')
+def get_city_location_info(city_to_search):
+    ''' get the location of the city
+
+    This function takes in the name of a city, and uses OpenTripMap API (url:
+    https://opentripmap.io/product) to get the longitude and latitude of the
+    city
+
+    Parameters
+    ----------
+    city_to_search: str
+        the name of the city to search using OpenTripMap API
+
+    Returns
+    -------
+    dict
+
+    Raises
+    ------
+    UpstreamError
+        if OpenTripMap is unavailable and the city is not cached, even expired
+    '''
+
+    file_name = 'city_location.json'
+    cache_dict = open_cache(file_name)
+    city_id = canonical_city_id(city_to_search)
+    cached_location = cache_dict.get(city_id)
+    if cached_location is not None:
+        freshness = cache_entry_freshness('city_location', cached_location)
+        if freshness != 'expired':
+            #print('using cache to get the city location!')
+            count_cache_event('city_location', 'hit')
+            if freshness == 'stale':
+                schedule_refresh('city_location', file_name, city_id,
+                                 lambda: fetch_city_location_info(cached_location['name'],
+                                                                  city_id))
+            return cached_location
+    # a miss is remembered under the name searched, not its canonical ID:
+    # OpenTripMap may not know an alias (eg. 'philly') of a city it knows
+    if lookup_negative_result('city_location', normalize_city_name(city_to_search)) is not None:
+        return {}
+    #print('getting the data from api to get the cty location!')
+    count_cache_event('city_location', 'miss')
+    try:
+        return fetch_city_location_info(city_to_search, city_id)
+    except UpstreamError:
+        if cached_location is None:
+            raise
+        # the last known location is better than none
+        count_cache_event('city_location', 'stale_fallback')
+        return cached_location
+
+
+def fetch_city_location_info(city_to_search, city_id):
+    ''' get the location of the city from OpenTripMap, and cache it
+
+    Parameters
+    ----------
+    city_to_search: str
+        the name of the city to search using OpenTripMap API
+
+    city_id: str
+        the canonical ID of the name
+
+    Returns
+    -------
+    dict
+        the location, or {} if the city does not exist or is not in the US
+
+    Raises
+    ------
+    UpstreamError
+        if OpenTripMap is unavailable
+    '''
+
+    file_name = 'city_location.json'
+    base_url_for_geo_name = upstream.base_url('opentripmap') + '/geoname'
+    params = {'name': city_to_search,
+              'apikey': api_key('opentripmap_api_key')}
+    response = get_json('opentripmap', base_url_for_geo_name, params,
+                        validate=lambda body: isinstance(body, dict) and 'status' in body)
+    # the name searched, which is city_id when the canonical name missed
+    negative_key = normalize_city_name(city_to_search)
+    if response['status'] != 'OK':
+        #print('the city you input does not exist! please try another')
+        store_negative_result('city_location', negative_key, 'not_found')
+        return {}
+    else:
+        if response['country'] != 'US':
+            #print('the city you input do exist, but not in the US, try another!')
+            store_negative_result('city_location', negative_key, 'not_us')
+            return {}
+        else:
+            #print('this a valid US city, we can use it!')
+            temp_dict = {}
+            position_of_the_city = {'lat': round(response['lat'], 2),
+                                    'lon': round(response['lon'], 2)}
+            name_of_the_city = response['name']
+            temp_dict['position'] = position_of_the_city
+            temp_dict['name'] = name_of_the_city
+            stamp_fetch_time(temp_dict)
+            # cache under the ID of the resolved name, so that other
+            # spellings resolved to the same city share the entry
+            resolved_city_id = canonical_city_id(name_of_the_city)
+            update_cache(file_name, {resolved_city_id: temp_dict})
+            if resolved_city_id != city_id:
+                update_cache(CITY_ALIASES_FILENAME, {city_id: name_of_the_city})
+            return temp_dict
+
+
+# my_city = input('Which city is your destination?').strip().lower()
+# my_city_dict = get_city_location_info(my_city)
+# print(my_city_dict)
+
+
+def generate_unique_city_attraction_name(city_name, attraction_type):
+    ''' generate the unique key by city name and attraction type
+
+    this function generates a unique string given city name and attraction
+    type, the generated string takes the form:
+    <city_name>_<attraction_type>
+
+    Parameters
+    ----------
+    city_name:　str
+        the name of the city
+
+    attraction_type: str
+        the name of the attraction type
+
+    Returns
+    -------
+    str
+    '''
+
+    return city_name + '_' + attraction_type
+
+
+def generate_unique_city_attraction_page_name(city_name, attraction_type, page):
+    ''' generate the unique key of one page of attractions
+
+    the first page is cached under the key of generate_unique_city_attraction_name,
+    the later pages under <city_name>_<attraction_type>_page_<page>
+
+    Parameters
+    ----------
+    city_name: str
+        the name of the city
+
+    attraction_type: str
+        the name of the attraction type
+
+    page: int
+        the number of the page, from 0
+
+    Returns
+    -------
+    str
+    '''
+
+    unique_name = generate_unique_city_attraction_name(city_name, attraction_type)
+    if page == 0:
+        return unique_name
+    return f"{unique_name}_page_{page}"
+
+
+def generate_unique_hotel_name(lon, lat):
+    ''' generate the unique key by longitude and latitude
+
+    this function generates a unique string given longitude and latitude of the
+    attraction, the returned string takes the form of:
+    lon_<longitude>_and_lat_<latitude>
+
+    Parameters
+    ----------
+    lon: float
+        the longitude of the attraction
+
+    lat: float
+        the latitude of the attraction
+
+    Returns
+    -------
+    str
+    '''
+
+    return f"lon_{str(lon)}_and_lat_{str(lat)}"
+
+
+# the number of attractions of each type on a page
+ATTRACTIONS_PAGE_SIZE = 20
+# the number of pages of each type, from page 0; each page asks OpenTripMap
+# for all the pages before it too, see fetch_city_attractions
+MAX_ATTRACTION_PAGES = 10
+
+
+def fetch_city_attractions(city_position, attraction_type, search_radius, page=0):
+    ''' get one page of one type of attractions around a city from OpenTripMap
+
+    The radius search of OpenTripMap has a limit but no offset, so page n is
+    the last ATTRACTIONS_PAGE_SIZE places of a search limited to the first
+    (n + 1) pages.
+
+    Parameters
+    ----------
+    city_position: dict
+        the longitude and latitude of the center of the city
+
+    attraction_type: str
+        the attraction type to search for
+
+    search_radius: float
+        the radius to search in, in meters
+
+    page: int
+        the number of the page, from 0 to MAX_ATTRACTION_PAGES - 1
 
     Returns
     -------
-    The opened cache
-    '''
+    the projected response, see projection.py
 
-    try:
-        cache_file = open(cache_filename, 'r')
-        cache_contents = cache_file.read()
-        cache_dict = json.loads(cache_contents)
-        cache_file.close()
-    except:
-        cache_dict = {}
-    return cache_dict
+    Raises
+    ------
+    UpstreamError
+        if OpenTripMap is unavailable or returns an error body
 
+    ValueError
+        if the page is out of range
+    '''
+
+    if not 0 <= page < MAX_ATTRACTION_PAGES:
+        raise ValueError(f'page {page} is not between 0 and {MAX_ATTRACTION_PAGES - 1}')
+    base_url_for_city_attr = upstream.base_url('opentripmap') + '/radius'
+    params = {'radius': search_radius,
+              "lat": city_position['lat'],
+              "lon": city_position['lon'],
+              'format': 'json',
+              'apikey': api_key('opentripmap_api_key'),
+              'limit': ATTRACTIONS_PAGE_SIZE * (page + 1),
+              'kinds': attraction_type, }
+    rp_json = get_json('opentripmap', base_url_for_city_attr, params,
+                       validate=lambda body: isinstance(body, list))
+    rp_json = rp_json[ATTRACTIONS_PAGE_SIZE * page:]
+    # only keep the fields we use, see projection.py
+    return stamp_fetch_time(project_attractions_response(rp_json))
+
+
+def refresh_city_attractions(unique_name, city_position, attraction_type, search_radius, page):
+    ''' fetch a cached page of attractions again, keeping it if none are found
 
-def save_cache(cache_dict, cache_filename):
-    ''' saves the current state of the cache to disk
     Parameters
     ----------
-    cache_dict: dict
-        The dictionary to save
-    cache_filename: str
-        The name of the cache file
+    unique_name: str
+        the cache key of the page
+
+    city_position, attraction_type, search_radius, page:
+        see fetch_city_attractions
 
     Returns
     -------
     None
     '''
 
-    dumped_json_cache = json.dumps(cache_dict)
-    fw = open(cache_filename,"w")
-    fw.write(dumped_json_cache)
-    fw.close()
-
+    rp_json = fetch_city_attractions(city_position, attraction_type, search_radius, page)
+    if attractions_from_entry(rp_json) != []:
+        update_cache('city_location_attraction.json', {unique_name: rp_json},
+                     with_snapshot=True)
 
-# conn = sqlite3.connect('../my_data_base/airport_database.sqlite')
-# cur = conn.cursor()
 
-def get_city_location_info(city_to_search):
-    ''' get the location of the city
+def merge_attractions(attraction_lists):
+    ''' merge lists of attractions, dropping the places listed twice
 
-    This function takes in the name of a city, and uses OpenTripMap API (url:
-    https://opentripmap.io/product) to get the longitude and latitude of the
-    city
+    A place of several kinds (eg. a museum in a historic building) is returned
+    by the searches of each kind; it is kept once, by OpenTripMap xid.
 
     Parameters
     ----------
-    city_to_search: str
-        the name of the city to search using OpenTripMap API
+    attraction_lists: list
+        the lists of attractions, in the order to merge them
 
     Returns
     -------
-    dict
+    list
     '''
 
-    file_name = 'city_location.json'
-    cache_dict = open_cache(file_name)
-    if city_to_search in cache_dict:
-        #print('using cache to get the city location!')
-        return cache_dict[city_to_search]
-    else:
-        #print('getting the data from api to get the cty location!')
-        base_url_for_geo_name = 'https://api.opentripmap.com/0.1/en/places/geoname'
-        params = {'name': city_to_search,
-                  'apikey': secrets.opentripmap_api_key}
-        response = requests.get(base_url_for_geo_name, params).json()
-        if response['status'] != 'OK':
-            #print('the city you input does not exist! please try another')
-            return {}
-        else:
-            if response['country'] != 'US':
-                #print('the city you input do exist, but not in the US, try another!')
-                return {}
-            else:
-                #print('this a valid US city, we can use it!')
-                temp_dict = {}
-                position_of_the_city = {'lat': round(response['lat'], 2),
-                                        'lon': round(response['lon'], 2)}
-                name_of_the_city = response['name']
-                temp_dict['position'] = position_of_the_city
-                temp_dict['name'] = name_of_the_city
-                cache_dict[city_to_search] = temp_dict
-                save_cache(cache_dict, file_name)
-                return temp_dict
-
-
-# my_city = input('Which city is your destination?').strip().lower()
-# my_city_dict = get_city_location_info(my_city)
-# print(my_city_dict)
-
+    merged = []
+    seen_xids = set()
+    for attractions in attraction_lists:
+        for attraction in attractions:
+            xid = attraction.get('xid')
+            if xid is not None:
+                if xid in seen_xids:
+                    continue
+                seen_xids.add(xid)
+            merged.append(attraction)
+    return merged
 
-def generate_unique_city_attraction_name(city_name, attraction_type):
-    ''' generate the unique key by city name and attraction type
 
-    this function generates a unique string given city name and attraction
-    type, the generated string takes the form:
-    <city_name>_<attraction_type>
+def kinds_with_more_pages(attractions_by_type, page):
+    ''' the attraction types that may have another page after this one
 
     Parameters
     ----------
-    city_name:　str
-        the name of the city
+    attractions_by_type: dict
+        the attractions of each type on the page, see
+        get_city_attractions_by_type
 
-    attraction_type: str
-        the name of the attraction type
+    page: int
+        the number of the page, from 0
 
     Returns
     -------
-    str
+    list
+        the types whose page is full, in the order given
     '''
 
-    return city_name + '_' + attraction_type
-
+    if page + 1 >= MAX_ATTRACTION_PAGES:
+        return []
+    return [attraction_type for attraction_type, attractions in attractions_by_type.items()
+            if len(attractions) >= ATTRACTIONS_PAGE_SIZE]
 
-def generate_unique_hotel_name(lon, lat):
-    ''' generate the unique key by longitude and latitude
 
-    this function generates a unique string given longitude and latitude of the
-    attraction, the returned string takes the form of:
-    lon_<longitude>_and_lat_<latitude>
+def get_city_attractions_info(city_name, attraction_types, dict_for_location, state=None,
+                              page=0):
+    ''' get the attraction of the city, the attractions of all the types
+    merged without duplicates
 
     Parameters
     ----------
-    lon: float
-        the longitude of the attraction
-
-    lat: float
-        the latitude of the attraction
+    see get_city_attractions_by_type
 
     Returns
     -------
-    str
+    list
+
+    Raises
+    ------
+    UpstreamError
+        see get_city_attractions_by_type
     '''
 
-    return f"lon_{str(lon)}_and_lat_{str(lat)}"
+    return merge_attractions(list(get_city_attractions_by_type(
+        city_name, attraction_types, dict_for_location, state=state, page=page).values()))
 
 
-def get_city_attractions_info(city_name, attraction_type, dict_for_location):
-    ''' get the attraction of the city
+@metrics.timed('attractions')
+def get_city_attractions_by_type(city_name, attraction_types, dict_for_location, state=None,
+                                 page=0):
+    ''' get the attraction of the city, by type
 
-    This function takes in the city name, attraction type, and the pre-stored
+    This function takes in the city name, attraction types, and the pre-stored
     dictionary for location of the city. Then it uses OpenTripMap API (url:
-    https://opentripmap.io/product) to get the specific attraction type in the
-    specific city
+    https://opentripmap.io/product) to get the specific attraction types in
+    the specific city
+
+    Each attraction type is cached on its own: the types already cached are
+    read from the cache, the others are fetched concurrently. Up to
+    ATTRACTIONS_PAGE_SIZE attractions of each type are returned, later pages
+    are fetched (and cached) on demand.
 
     Parameters
     ----------
     city_name: str
         the name of the city
 
-    attraction_type: str
-        the attraction type interested in the given city
+    attraction_types: str or list
+        the attraction type, or the attraction types, interested in the given
+        city
 
     dict_for_location: dict
         the dictionary containing key as city names, and value as city locations
         this dictionary is constructed in advance
+
+    state: str
+        optional, the state of the city, used to pick the search radius of
+        the right city when several cities have the same name
+
+    page: int
+        the number of the page, from 0
     Returns
     -------
-    list
+    dict
+        the list of attractions of each type, in the order given; a place
+        of several of the types is in each of their lists
+
+    Raises
+    ------
+    UpstreamError
+        if OpenTripMap is unavailable and none of the types could be served
+        from the cache, even expired
     '''
 
     file_name = 'city_location_attraction.json'
-    cache_dict = open_cache(file_name)
-    unique_name = generate_unique_city_attraction_name(city_name, attraction_type)
-    if unique_name in cache_dict:
-        #print('using cache to get city attractions!')
-        return cache_dict[unique_name]
-    else:
-        #print('getting the data from api to get city attraction!')
-        # firstly, get the radians for search from database, this parameter
-        # depends on the size of the city interested, so we scraped the city data
-        # if the city size is smaller than the smallest city in our database
-        # we will use the data of the smallest city, 196, to determine the
-        # characteristic searching radius
-        conn = sqlite3.connect('./database/airport_database.sqlite')
-        cur = conn.cursor()
-        name_use = city_name.strip().lower().title()
-        query = f'SELECT * FROM cities_by_area WHERE CityName = "{name_use}"'
-        cur.execute(query)
-        cur_list = list(cur)
-        #print(cur_list)
-        if len(cur_list) > 0:
-            search_radius = round((cur_list[0][3])**0.5, 3) * 1000
-            # print('xx')
-        else:
-            search_radius = 14 * 1000
-        conn.close()
-        if city_name in dict_for_location:
-            base_url_for_city_attr = 'https://api.opentripmap.com/0.1/en/places/radius'
-            params = {'radius': search_radius,
-                      "lat": dict_for_location[city_name]['position']['lat'],
-                      "lon": dict_for_location[city_name]['position']['lon'],
-                      'format': 'json',
-                      'apikey': secrets.opentripmap_api_key,
-                      'limit': 20,
-                      'kinds': attraction_type, }
-            print(search_radius)
-            rp = requests.get(base_url_for_city_attr, params)
-            rp_json = rp.json()
-            cache_dict[unique_name] = rp_json
-            save_cache(cache_dict, file_name)
-            return rp_json
+    city_name = canonical_city_id(city_name)
+    if isinstance(attraction_types, str):
+        attraction_types = [attraction_types]
+    # without duplicates, in the order given
+    attraction_types = list(dict.fromkeys(attraction_types))
+    attractions_by_type = {}
+    types_to_fetch = []
+    stale_types = []
+    # the expired entries, served when the api is unavailable
+    expired_entries = {}
+    for attraction_type in attraction_types:
+        unique_name = generate_unique_city_attraction_page_name(city_name, attraction_type, page)
+        cached_attractions = lookup_cache(file_name, unique_name)
+        if cached_attractions is not None and attractions_from_entry(cached_attractions) is None:
+            # eg. an error body cached by an older version, fetched again
+            cached_attractions = None
+        if cached_attractions is not None:
+            freshness = cache_entry_freshness('city_attractions', cached_attractions)
+        if cached_attractions is not None and freshness != 'expired':
+            #print('using cache to get city attractions!')
+            count_cache_event('city_attractions', 'hit')
+            attractions_by_type[attraction_type] = attractions_from_entry(cached_attractions)
+            if freshness == 'stale':
+                stale_types.append(attraction_type)
+        elif lookup_negative_result('city_attractions', unique_name) is not None:
+            attractions_by_type[attraction_type] = []
         else:
-            #print("your input is not a valid US city!")
-            return []
+            count_cache_event('city_attractions', 'miss')
+            types_to_fetch.append(attraction_type)
+            if cached_attractions is not None:
+                expired_entries[attraction_type] = cached_attractions
+
+    if (types_to_fetch or stale_types) and city_name in dict_for_location:
+        # firstly, get the radians for search, this parameter depends on the
+        # size of the city interested, so we scraped the city data; if the city
+        # size is smaller than the smallest city in our database we will use
+        # the data of the smallest city, 196, to determine the characteristic
+        # searching radius (the table is loaded from the database once)
+        search_radius = get_search_radius(city_name, state)
+        city_position = dict_for_location[city_name]['position']
+        for attraction_type in stale_types:
+            unique_name = generate_unique_city_attraction_page_name(city_name, attraction_type,
+                                                                    page)
+            schedule_refresh('city_attractions', file_name, unique_name,
+                             lambda unique_name=unique_name, attraction_type=attraction_type:
+                             refresh_city_attractions(unique_name, city_position,
+                                                      attraction_type, search_radius, page))
+
+    if types_to_fetch and city_name in dict_for_location:
+        #print('getting the data from api to get city attraction!')
+        def fetch_or_error(attraction_type):
+            try:
+                return fetch_city_attractions(city_position, attraction_type, search_radius,
+                                              page)
+            except UpstreamError as error:
+                return error
+
+        with ThreadPoolExecutor(max_workers=len(types_to_fetch)) as executor:
+            fetched = dict(zip(types_to_fetch, executor.map(fetch_or_error, types_to_fetch)))
+        new_entries = {}
+        upstream_errors = []
+        for attraction_type, rp_json in fetched.items():
+            unique_name = generate_unique_city_attraction_page_name(city_name, attraction_type,
+                                                                    page)
+            if isinstance(rp_json, UpstreamError):
+                upstream_errors.append(rp_json)
+                if attraction_type in expired_entries:
+                    # the last known attractions are better than none
+                    count_cache_event('city_attractions', 'stale_fallback')
+                    attractions_by_type[attraction_type] = attractions_from_entry(
+                        expired_entries[attraction_type])
+                continue
+            attractions = attractions_from_entry(rp_json)
+            if attractions == []:
+                # the city may get such attractions later, so an empty result
+                # is not kept for good
+                store_negative_result('city_attractions', unique_name, 'no_attractions')
+            else:
+                new_entries[unique_name] = rp_json
+            attractions_by_type[attraction_type] = attractions
+        if new_entries:
+            update_cache(file_name, new_entries, with_snapshot=True)
+        if upstream_errors and not any(attractions_by_type.values()):
+            # nothing to show, and not because there is nothing to find
+            raise upstream_errors[0]
+
+    return {attraction_type: attractions_by_type.get(attraction_type, [])
+            for attraction_type in attraction_types}
 
 
+@metrics.timed('weather')
 def get_weather_prediction(city_name, dict_for_location):
     ''' get the weather prediction of the given city
 
@@ -348,27 +1431,76 @@ def get_weather_prediction(city_name, dict_for_location):
     Returns
     -------
     list
+        the forecast of each day, empty if the city is unknown or the api is
+        unavailable
     '''
 
-    # dynamic, we will not use cache
+    # dynamic, the forecasts are only cached for a few hours, see CACHE_EXPIRY
+    city_name = canonical_city_id(city_name)
     if city_name in dict_for_location:
-        base_url = 'http://api.weatherunlocked.com/api'
-        use_type = '/forecast'
-        temp_lon = dict_for_location[city_name]['position']['lon']
-        temp_lat = dict_for_location[city_name]['position']['lat']
-        location = f'/{temp_lat},{temp_lon}'
-        paras = {
-            'app_id': secrets.weatherunlocked_api_id,
-            'app_key': secrets.weatherunlocked_api_key,
-        }
-        url = base_url + use_type + location
-        rep = requests.get(url, paras)
-        rep_json = rep.json()
-        return rep_json['Days']
+        city_position = dict_for_location[city_name]['position']
+        cached_weather = open_cache(WEATHER_CACHE_FILENAME).get(city_name)
+        if cached_weather is not None:
+            freshness = cache_entry_freshness('weather', cached_weather)
+            if freshness != 'expired':
+                count_cache_event('weather', 'hit')
+                if freshness == 'stale':
+                    schedule_refresh('weather', WEATHER_CACHE_FILENAME, city_name,
+                                     lambda: fetch_weather_prediction(city_name, city_position))
+                return cached_weather['Days']
+        count_cache_event('weather', 'miss')
+        try:
+            return fetch_weather_prediction(city_name, city_position)['Days']
+        except UpstreamError:
+            # an old forecast is not worth showing, the page goes without
+            count_cache_event('weather', 'unavailable')
+            return []
     else:
+        # unknown or non-US city, answered without calling the api
+        count_cache_event('weather', 'negative_hit')
         return []
 
 
+def fetch_weather_prediction(city_name, city_position):
+    ''' get the weather prediction of a city from Weather Unlocked, and cache it
+
+    Parameters
+    ----------
+    city_name: str
+        the canonical ID of the city
+
+    city_position: dict
+        the longitude and latitude of the city
+
+    Returns
+    -------
+    dict
+        the cached entry, with the forecast of each day under 'Days'
+
+    Raises
+    ------
+    UpstreamError
+        if Weather Unlocked is unavailable or returns an error body
+    '''
+
+    base_url = upstream.base_url('weatherunlocked')
+    use_type = '/forecast'
+    temp_lon = city_position['lon']
+    temp_lat = city_position['lat']
+    location = f'/{temp_lat},{temp_lon}'
+    paras = {
+        'app_id': api_key('weatherunlocked_api_id'),
+        'app_key': api_key('weatherunlocked_api_key'),
+    }
+    url = base_url + use_type + location
+    rep_json = get_json('weatherunlocked', url, paras,
+                        validate=lambda body: isinstance(body, dict) and 'Days' in body)
+    weather_entry = stamp_fetch_time({'Days': rep_json['Days']})
+    update_cache(WEATHER_CACHE_FILENAME, {city_name: weather_entry})
+    return weather_entry
+
+
+@metrics.timed('hotels')
 def get_hotels(attr_lon, attr_lat):
     ''' get the hotel given the longitude and the latitude
 
@@ -387,34 +1519,200 @@ def get_hotels(attr_lon, attr_lat):
     Returns
     -------
     dict
+
+    Raises
+    ------
+    UpstreamError
+        if Yelp is unavailable and the hotels are not cached, even expired
     '''
 
     filename = 'hotels_cache.json'
-    cache_dict = open_cache(filename)
     unique_name = generate_unique_hotel_name(attr_lon, attr_lat)
-    if unique_name in cache_dict:
+    cached_hotels = lookup_cache(filename, unique_name)
+    if cached_hotels is not None:
+        freshness = cache_entry_freshness('hotels', cached_hotels)
+    if cached_hotels is not None and freshness != 'expired':
         print('cache')
-        return cache_dict[unique_name]
+        count_cache_event('hotels', 'hit')
+        if freshness == 'stale':
+            schedule_refresh('hotels', filename, unique_name,
+                             lambda: fetch_hotels(attr_lon, attr_lat))
+        return cached_hotels
     else:
         print('fetch')
-        base_url = 'https://api.yelp.com/v3/businesses/search'
-        params = {'latitude': attr_lat,
-                  "longitude": attr_lon,
-                  'radius': 3000,
-                  'categories': 'hotels'}
-        headers = {'Authorization': f'Bearer {secrets.yelp_api_key}'}
-        rep = requests.get(url=base_url, headers=headers, params=params).json()
-        cache_dict[unique_name] = rep
-        save_cache(cache_dict, filename)
-        return rep
-
-
-def plot_attractions_on_map(center, attrs_to_plot):
+        count_cache_event('hotels', 'miss')
+        try:
+            return fetch_hotels(attr_lon, attr_lat)
+        except UpstreamError:
+            if cached_hotels is None:
+                raise
+            # the last known hotels are better than none
+            count_cache_event('hotels', 'stale_fallback')
+            return cached_hotels
+
+
+def fetch_hotels(attr_lon, attr_lat):
+    ''' get the hotels near a location from Yelp Fusion, and cache them
+
+    Parameters
+    ----------
+    attr_lon: float
+        longitude of the location
+
+    attr_lat: float
+        latitude of the location
+
+    Returns
+    -------
+    dict
+
+    Raises
+    ------
+    UpstreamError
+        if Yelp is unavailable or returns an error body
+    '''
+
+    filename = 'hotels_cache.json'
+    unique_name = generate_unique_hotel_name(attr_lon, attr_lat)
+    base_url = upstream.base_url('yelp') + '/businesses/search'
+    params = {'latitude': attr_lat,
+              "longitude": attr_lon,
+              'radius': 3000,
+              'categories': 'hotels'}
+    headers = {'Authorization': f"Bearer {api_key('yelp_api_key')}"}
+    # only keep the fields we use, see projection.py
+    rep = stamp_fetch_time(project_hotels_response(
+        get_json('yelp', base_url, params, headers=headers,
+                 validate=lambda body: isinstance(body, dict) and 'businesses' in body)))
+    update_cache(filename, {unique_name: rep}, with_snapshot=True)
+    return rep
+
+
+@metrics.timed('describe')
+def format_weather_timeframes(city_weather_list):
+    ''' get the forecast ready to show: the time of each timeframe as "h:mm"
+    and its icon as the path of our picture
+
+    The forecast is copied, not changed in place, as it may be a cached entry.
+
+    Parameters
+    ----------
+    city_weather_list: list
+        the forecast of each day, as returned by get_weather_prediction
+
+    Returns
+    -------
+    list
+    '''
+
+    formatted_days = []
+    for element in city_weather_list:
+        formatted_day = dict(element)
+        formatted_day['Timeframes'] = []
+        for time_point in element['Timeframes']:
+            time_str = str(time_point['time'])
+            icon_str = time_point['wx_icon']
+            formatted_time_point = dict(time_point)
+            formatted_time_point['time'] = time_str[0:-2] + ':' + time_str[-2:]
+            formatted_time_point['wx_icon'] = 'static/pictures/' + icon_str.replace('gif', 'png')
+            formatted_day['Timeframes'].append(formatted_time_point)
+        formatted_days.append(formatted_day)
+    return formatted_days
+
+
+@metrics.timed('describe')
+def describe_attractions(city_attractions):
+    ''' get the text and the position of each attraction to show
+
+    Parameters
+    ----------
+    city_attractions: list
+        the attractions returned by get_city_attractions_info
+
+    Returns
+    -------
+    tuple
+        the list of descriptions, and the list of dictionaries with the
+        name, longitude, latitude and xid of each attraction
+    '''
+
+    attractions_str = []
+    attractions_position = []
+    for city_attraction in city_attractions:
+        name_to_modify_list = re.split(''''|"''', city_attraction['name'])
+        name_modified = ' '.join(name_to_modify_list)
+        temp_attraction = Attraction(name_modified,
+                                     city_attraction['point']['lon'],
+                                     city_attraction['point']['lat'],
+                                     city_attraction['rate'])
+        attractions_str.append(temp_attraction.info())
+        attractions_position.append({'lat': temp_attraction.attr_lat,
+                                     'lon': temp_attraction.attr_lon,
+                                     'attr_name': temp_attraction.attr_name,
+                                     'xid': city_attraction.get('xid')})
+    return attractions_str, attractions_position
+
+
+# the visiting orders of the attractions shown on the map, by city and
+# attraction types, for the last ITINERARY_CACHE_SIZE of them
+ITINERARY_CACHE_SIZE = 256
+
+_itineraries = OrderedDict()
+_itineraries_lock = threading.Lock()
+
+
+@metrics.timed('itinerary')
+def get_itinerary(city_name, attraction_type, attractions_position):
+    ''' get a short order to visit the attractions in, see itinerary.py
+
+    The order is cached by city and attraction types, and found again when
+    the attractions of the city change.
+
+    Parameters
+    ----------
+    city_name: str
+        the canonical ID of the city
+
+    attraction_type: str
+        the attraction types, eg. 'bridges, skyscrapers'
+
+    attractions_position: list
+        the attractions, as describe_attractions returns them
+
+    Returns
+    -------
+    dict
+        the order (indexes into attractions_position), its length in km and
+        whether it is 2-optimal
+    '''
+
+    key = generate_unique_city_attraction_name(city_name, attraction_type)
+    points = tuple((attraction['lat'], attraction['lon']) for attraction in attractions_position)
+    with _itineraries_lock:
+        cached = _itineraries.get(key)
+        if cached is not None and cached[0] == points:
+            _itineraries.move_to_end(key)
+    if cached is not None and cached[0] == points:
+        count_cache_event('itinerary', 'hit')
+        return cached[1]
+    count_cache_event('itinerary', 'miss')
+    itinerary = order_attractions([lat for lat, _ in points], [lon for _, lon in points])
+    with _itineraries_lock:
+        _itineraries[key] = (points, itinerary)
+        _itineraries.move_to_end(key)
+        while len(_itineraries) > ITINERARY_CACHE_SIZE:
+            _itineraries.popitem(last=False)
+    return itinerary
+
+
+@metrics.timed('plot')
+def plot_attractions_on_map(center, attrs_to_plot, itinerary=None):
     ''' plot the attractions around a specified center on map using plotly
 
     By applying package plotly, this function plots the attractions around the
     given center on map using mapbox. Token is required for this process and is
-    contained in the secrets.py file.
+    contained in the secrets.py file (without it, eg. in offline mode, the
+    OpenStreetMap tiles are used instead).
 
     Parameters
     ----------
@@ -427,6 +1725,10 @@ def plot_attractions_on_map(center, attrs_to_plot):
         is a dictionary, containing the longitude and latitude of the
         attraction
 
+    itinerary: dict
+        optional, the order to visit the attractions in (see get_itinerary),
+        drawn as a line through them
+
     Returns
     -------
         json form of the plot, for the template to render later
@@ -447,12 +1749,29 @@ def plot_attractions_on_map(center, attrs_to_plot):
         ),
         text=attractions.name,
         textfont={'size': 16},
+        showlegend=False,
     ))
-
+    # the markers stay the first trace, the attractions page adds the
+    # attractions of the next pages to it
+    if itinerary is not None and len(itinerary['order']) > 1:
+        order = itinerary['order']
+        fig.add_trace(go.Scattermapbox(
+            mode='lines',
+            lat=attractions.lat[order],
+            lon=attractions.lon[order],
+            line={'width': 3, 'color': 'blue'},
+            text=[f'{number}. {name}' for number, name in enumerate(attractions.name[order], 1)],
+            hoverinfo='text',
+            name=f"visiting order, {itinerary['distance_km']:.1f} km",
+        ))
+
+    mapbox_token = getattr(upstream.secrets, 'mapbox_token', None)
     fig.update_layout(
         hovermode='closest',
         mapbox=dict(
-            accesstoken=secrets.mapbox_token,
+            accesstoken=mapbox_token,
+            # the OpenStreetMap tiles need no token
+            style='basic' if mapbox_token else 'open-street-map',
             bearing=0,
             center=go.layout.mapbox.Center(
                 lat=center['lat'],
@@ -465,6 +1784,7 @@ def plot_attractions_on_map(center, attrs_to_plot):
     return fig.to_json()
 
 
+@metrics.timed('plot')
 def plot_hotels_price_and_rating(hotel_list):
     ''' plot the hotels information on a bar plot using plotly
 
@@ -522,10 +1842,222 @@ def plot_hotels_price_and_rating(hotel_list):
 
 
 app = Flask(__name__)
+# time the requests and their stages when TRAVEL_METRICS=1, see metrics.py
+metrics.init_app(app)
+
+
+def upstream_unavailable_page(what):
+    ''' the page shown when an api we depend on is down and nothing is cached
+
+    Parameters
+    ----------
+    what: str
+        the feature that is unavailable, eg. 'the search for hotels'
+
+    Returns
+    -------
+    tuple
+        the page and the 503 status
+    '''
+
+    return f"<h2>Sorry, {what} is temporarily unavailable, please try again in a minute.</h2>" \
+           f"<p>Return <a href='/'>Home Page</a></p>", 503
 
 @app.route('/')
 def my_index():
-    return render_template('index.html')
+    with metrics.stage('render'):
+        return render_template('index.html')
+
+
+@app.route('/readyz')
+def readiness():
+    ''' readiness probe, 200 once the caches are preloaded, 503 before
+    '''
+
+    preloaded = app.config.get('PRELOADED_CACHES')
+    if preloaded is None:
+        return {'ready': False}, 503
+    return {'ready': True, 'caches': preloaded}
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    ''' the metrics of this process in the Prometheus text format: the request
+    and stage histograms (with TRAVEL_METRICS=1), the upstream calls, the
+    cache events and the state of the circuit breakers
+    '''
+
+    lines = (metrics.request_seconds.exposition()
+             + metrics.stage_seconds.exposition()
+             + metrics.upstream_seconds.exposition())
+    with cache_counters_lock:
+        cache_events = {(namespace, event): count
+                        for namespace, counter in cache_counters.items()
+                        for event, count in counter.items()}
+    lines += metrics.counter_lines('travel_cache_events_total', 'cache hits, misses and refreshes',
+                                   ('namespace', 'event'), cache_events)
+    lines += ['# HELP travel_circuit_open whether the circuit of an upstream api is open',
+              '# TYPE travel_circuit_open gauge']
+    for name, breaker in sorted(upstream.circuit_breakers.items()):
+        lines.append(f'travel_circuit_open{{upstream="{name}"}} {int(breaker.state != "closed")}')
+    return '\n'.join(lines) + '\n', 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+
+def admin_authorized():
+    ''' whether the request may use the admin endpoints and be profiled: it
+    carries the TRAVEL_ADMIN_TOKEN in an X-Admin-Token header. Without a
+    token set, no request may: behind a reverse proxy every request comes
+    from this machine, so its address proves nothing.
+    '''
+
+    admin_token = os.environ.get('TRAVEL_ADMIN_TOKEN')
+    if not admin_token:
+        return False
+    return hmac.compare_digest(request.headers.get('X-Admin-Token', ''), admin_token)
+
+
+# profile the requests asking for it when TRAVEL_PROFILE_DIR is set, see
+# profiling.py
+profiling.init_app(app, admin_authorized)
+
+
+@app.route('/admin/cache_stats')
+def admin_cache_stats():
+    ''' the statistics of the caches, and the cache events of this process
+    since it started, see cache_stats.py. Query parameter: largest, the
+    number of largest entries to list (5 by default).
+    '''
+
+    if not admin_authorized():
+        return jsonify({'error': 'forbidden'}), 403
+    from cache_stats import cache_statistics
+    try:
+        largest = int(request.args.get('largest', '5'))
+    except ValueError:
+        return jsonify({'error': 'largest must be a number'}), 400
+    return jsonify(cache_statistics(largest))
+
+
+# the Skyscanner search of a one-way flight, in 2021 as the ticket form has
+# no year; build_ticket_url fills in the airports and the date
+TICKET_URL_PREFIX = 'https://www.skyscanner.com/transport/flights/'
+TICKET_URL_SUFFIX = '/?adults=1&adultsv2=1&cabinclass=economy&children=0&childrenv2=&destinationentityid=27539525&inboundaltsenabled=false&infants=0&originentityid=27536211&outboundaltsenabled=false&preferdirects=false&preferflexible=false&ref=home&rtn=0'
+
+
+def build_ticket_url(dep_airport_code, des_airport_code, month, day):
+    ''' the url of the tickets between two airports on a date
+
+    Parameters
+    ----------
+    dep_airport_code: str
+        the IATA code of the departure airport
+
+    des_airport_code: str
+        the IATA code of the destination airport
+
+    month: str
+        two digits, eg. '05'
+
+    day: str
+        two digits, eg. '01'
+
+    Returns
+    -------
+    str
+    '''
+
+    return (f'{TICKET_URL_PREFIX}{dep_airport_code.lower()}/{des_airport_code.lower()}'
+            f'/21{month}{day}{TICKET_URL_SUFFIX}')
+
+
+def airport_city_name(place):
+    ''' the AirportCity a city typed in the ticket form is looked up as
+    '''
+
+    return place.strip().lower().title()
+
+
+# the airport of each of a set of cities, the first one of the city like
+# the ticket form uses; the cities are passed as one json array, so the
+# query takes a single parameter however many cities there are
+AIRPORTS_OF_CITIES_QUERY = '''
+SELECT wanted.value, AirportCode, AirportName, AirportCity, StateName, MIN(Number)
+FROM json_each(?) AS wanted
+JOIN airports ON airports.AirportCity=wanted.value
+JOIN states ON airports.AirportState=states.StateCode
+GROUP BY wanted.value
+'''
+
+# the most city pairs of a request to /api/v1/ticket_urls
+MAX_TICKET_URL_PAIRS = 1000
+
+_month_or_day = re.compile(r'\d\d')
+
+
+def resolve_airports(places):
+    ''' the airport of each city typed, in one query, or the nearest
+    airport of the cities without one (see find_nearest_airports)
+
+    Parameters
+    ----------
+    places: iterable
+        the cities, as typed in the ticket form
+
+    Returns
+    -------
+    dict
+        city typed -> dict with the code, name, city and state of the
+        airport (and nearest_km when it is the nearest airport of a city
+        without one), or None when no airport is found
+    '''
+
+    city_names = {place: airport_city_name(place) for place in places}
+    with metrics.stage('sqlite'):
+        conn = sqlite3.connect(DATABASE_FILENAME)
+        rows = conn.execute(AIRPORTS_OF_CITIES_QUERY,
+                            (json.dumps(sorted(set(city_names.values()))),)).fetchall()
+        conn.close()
+    airports = {city_name: {'code': airport_code, 'name': airport_name, 'city': airport_city,
+                            'state': state_name}
+                for city_name, airport_code, airport_name, airport_city, state_name, _ in rows}
+    resolved = {}
+    for place, city_name in city_names.items():
+        airport = airports.get(city_name)
+        if airport is None:
+            nearest = find_nearest_airports(place, 1)
+            if nearest:
+                distance_km, (airport_code, airport_name, airport_city, state_name, *_) = nearest[0]
+                airport = {'code': airport_code, 'name': airport_name, 'city': airport_city,
+                           'state': state_name, 'nearest_km': round(distance_km, 1)}
+        resolved[place] = airport
+    return resolved
+
+
+def nearest_airport_row(cur, nearest_airports):
+    ''' the row of the nearest of the airports, as the ticket queries
+    return it (airports JOIN states)
+    '''
+
+    _, (airport_code, *_) = nearest_airports[0]
+    cur.execute('''
+    SELECT * FROM airports JOIN states on airports.AirportState=states.StateCode
+    WHERE AirportCode=?
+    ''', (airport_code,))
+    return cur.fetchone()
+
+
+def describe_nearest_airports(city_name, nearest_airports):
+    ''' what the ticket page says about the airports near a city without
+    its own airport, or None if the city has one
+    '''
+
+    if not nearest_airports:
+        return None
+    return {'city': city_name.strip().title(),
+            'airports': [{'code': airport_code, 'name': airport_name, 'city': airport_city,
+                          'distance_km': round(distance_km)}
+                         for distance_km, (airport_code, airport_name, airport_city, *_)
+                         in nearest_airports]}
 
 
 @app.route('/buying_air_tickets', methods=['POST'])
@@ -534,24 +2066,29 @@ def get_air_tickets():
     place_of_destination = request.form["des_city_name"]
     date_of_flight = request.form['day']
     month_of_flight = request.form['month']
-    conn = sqlite3.connect('./database/airport_database.sqlite')
-    cur = conn.cursor()
-
-    name_use = place_of_departure.strip().lower().title()
-    query = f'''
-    SELECT * FROM airports JOIN states on airports.AirportState=states.StateCode 
-    WHERE AirportCity="{name_use}"
-    '''
-    cur.execute(query)
-    dep_airport = list(cur)
+    with metrics.stage('sqlite'):
+        conn = sqlite3.connect(DATABASE_FILENAME)
+        cur = conn.cursor()
 
-    name_use = place_of_destination.strip().lower().title()
-    query = f'''
-    SELECT * FROM airports JOIN states on airports.AirportState=states.StateCode 
-    WHERE AirportCity="{name_use}"
-    '''
-    cur.execute(query)
-    des_airport = list(cur)
+        cur.execute('''
+        SELECT * FROM airports JOIN states on airports.AirportState=states.StateCode
+        WHERE AirportCity=?
+        ''', (airport_city_name(place_of_departure),))
+        dep_airport = list(cur)
+
+        cur.execute('''
+        SELECT * FROM airports JOIN states on airports.AirportState=states.StateCode
+        WHERE AirportCity=?
+        ''', (airport_city_name(place_of_destination),))
+        des_airport = list(cur)
+
+        # a city without an airport row flies from the nearest airport
+        dep_nearest = find_nearest_airports(place_of_departure) if dep_airport == [] else []
+        if dep_nearest:
+            dep_airport = [nearest_airport_row(cur, dep_nearest)]
+        des_nearest = find_nearest_airports(place_of_destination) if des_airport == [] else []
+        if des_nearest:
+            des_airport = [nearest_airport_row(cur, des_nearest)]
 
     if dep_airport == [] or des_airport == []:
         return f"<h2>Either the departure place or the destination place does not have airport in our database</h2>" \
@@ -567,41 +2104,113 @@ def get_air_tickets():
         des_airport_state = des_airport[0][6]
         des_airport_name = des_airport[0][2]
         des_airport_code = des_airport[0][1]
-        base_url_1 = 'https://www.skyscanner.com/transport/flights/'
-        url_modified = dep_airport_code.lower()+'/'+des_airport_code.lower()+'/'+'21'+month+day
-        base_url_2 = '/?adults=1&adultsv2=1&cabinclass=economy&children=0&childrenv2=&destinationentityid=27539525&inboundaltsenabled=false&infants=0&originentityid=27536211&outboundaltsenabled=false&preferdirects=false&preferflexible=false&ref=home&rtn=0'
-        ticket_url= base_url_1 + url_modified + base_url_2
-        return render_template('buy_tickets_having_both_airports.html',
-                               ticket_month=month,
-                               ticket_date=day,
-                               dep_city=dep_airport_city,
-                               dep_state=dep_airport_state,
-                               dep_airport_name=dep_airport_name,
-                               dep_airport_code=dep_airport_code,
-                               des_city=des_airport_city,
-                               des_state=des_airport_state,
-                               des_airport_name=des_airport_name,
-                               des_airport_code=des_airport_code,
-                               ticket_url=ticket_url)
+        ticket_url = build_ticket_url(dep_airport_code, des_airport_code, month, day)
+        with metrics.stage('render'):
+            return render_template('buy_tickets_having_both_airports.html',
+                                   ticket_month=month,
+                                   ticket_date=day,
+                                   dep_city=dep_airport_city,
+                                   dep_state=dep_airport_state,
+                                   dep_airport_name=dep_airport_name,
+                                   dep_airport_code=dep_airport_code,
+                                   des_city=des_airport_city,
+                                   des_state=des_airport_state,
+                                   des_airport_name=des_airport_name,
+                                   des_airport_code=des_airport_code,
+                                   dep_nearest=describe_nearest_airports(place_of_departure,
+                                                                         dep_nearest),
+                                   des_nearest=describe_nearest_airports(place_of_destination,
+                                                                         des_nearest),
+                                   ticket_url=ticket_url)
+
+
+@app.route('/api/v1/ticket_urls', methods=['POST'])
+def ticket_urls():
+    ''' the ticket urls of many city pairs at once, as json lines
+
+    The body is a json object: {"pairs": [{"dep_city_name": ...,
+    "des_city_name": ..., "month": ..., "day": ...}, ...]}, where month and
+    day (two digits) may be given once for all the pairs next to "pairs".
+    All the cities are resolved in one query, then one line is streamed per
+    pair, in order: the pair's index, its cities, the airports and the
+    ticket_url, or an error.
+    '''
+
+    body = request.get_json(silent=True)
+    pairs = body.get('pairs') if isinstance(body, dict) else None
+    if not isinstance(pairs, list) or not 1 <= len(pairs) <= MAX_TICKET_URL_PAIRS:
+        return jsonify({'error': f'pairs must be a list of 1 to {MAX_TICKET_URL_PAIRS} city pairs'}), 400
+    default_date = {'month': body.get('month'), 'day': body.get('day')}
+    places = set()
+    for pair in pairs:
+        if isinstance(pair, dict):
+            for key in ('dep_city_name', 'des_city_name'):
+                if isinstance(pair.get(key), str):
+                    places.add(pair[key])
+    airports = resolve_airports(places)
+
+    def pair_lines():
+        for index, pair in enumerate(pairs):
+            if not isinstance(pair, dict) or not isinstance(pair.get('dep_city_name'), str) \
+                    or not isinstance(pair.get('des_city_name'), str):
+                result = {'index': index, 'error': 'dep_city_name and des_city_name are required'}
+                yield json.dumps(result) + '\n'
+                continue
+            month = pair.get('month', default_date['month'])
+            day = pair.get('day', default_date['day'])
+            dep_airport = airports[pair['dep_city_name']]
+            des_airport = airports[pair['des_city_name']]
+            result = {'index': index, 'dep_city_name': pair['dep_city_name'],
+                      'des_city_name': pair['des_city_name'],
+                      'dep_airport': dep_airport, 'des_airport': des_airport}
+            if not (isinstance(month, str) and _month_or_day.fullmatch(month)
+                    and isinstance(day, str) and _month_or_day.fullmatch(day)):
+                result['error'] = 'month and day must be two digits'
+            elif dep_airport is None or des_airport is None:
+                result['error'] = 'no airport found for the departure or the destination city'
+            else:
+                result['ticket_url'] = build_ticket_url(dep_airport['code'], des_airport['code'],
+                                                        month, day)
+            yield json.dumps(result) + '\n'
+
+    return Response(pair_lines(), mimetype='application/x-ndjson')
 
 
 @app.route('/attractions_and_weathers_city_exist_attractions_not_empty', methods=['GET', 'POST'])
 def show_attractions_and_weathers():
-    my_city = request.form['city_name'].strip().lower()
-    attraction = request.form['attraction_type']
+    # eg. "Springfield, IL", the state is only used for the search radius
+    my_city, my_state = split_state_suffix(request.form['city_name'])
+    my_city = my_city.strip().lower()
+    attraction_types = request.form.getlist('attraction_type')
+    attraction = ', '.join(attraction_types)
     show_type = request.form['presentation_type']
     if my_city == '':
         return f"<h1>The city you input is empty!!</h1>" \
                f"<p>Return <a href='/'>Home Page</a></p>"
+    elif attraction_types == []:
+        return f"<h1>Please select at least one type of attractions!!</h1>" \
+               f"<p>Return <a href='/'>Home Page</a></p>"
     else:
-        my_city_loc_dict = get_city_location_info(my_city)
+        try:
+            my_city_loc_dict = get_city_location_info(my_city)
+        except UpstreamError:
+            return upstream_unavailable_page('the search for attractions')
         if my_city_loc_dict == {}:
             return f"<h1>we cannot find '{my_city}' in the US</h1>" \
                    f"<p>Return <a href='/'>Home Page</a></p>"
         else:
-            my_city_attr_list = get_city_attractions_info(my_city,
-                                                          attraction,
-                                                          open_cache('city_location.json'))
+            # after the lookup, which may have learned a new alias
+            my_city = canonical_city_id(my_city)
+            try:
+                my_city_attr_by_type = get_city_attractions_by_type(my_city,
+                                                                    attraction_types,
+                                                                    open_cache('city_location.json'),
+                                                                    state=my_state)
+            except UpstreamError:
+                return upstream_unavailable_page('the search for attractions')
+            my_city_attr_list = merge_attractions(list(my_city_attr_by_type.values()))
+            # only the types whose own first page is full have a second one
+            more_kinds = kinds_with_more_pages(my_city_attr_by_type, 0)
             if my_city_attr_list == []:
                 return f"<h1> city '{my_city}' does not contain any {attraction}," \
                        f"please try another attraction in '{my_city}'</h1>"\
@@ -609,47 +2218,96 @@ def show_attractions_and_weathers():
             else:
                 # get the weather
                 my_city_weather = get_weather_prediction(my_city, open_cache('city_location.json'))
-                temp_city_weather = CityWeather(my_city, my_city_weather)
-                for element in temp_city_weather.city_weather_list:
-                    sub_elements = element['Timeframes']
-                    for time_point in sub_elements:
-                        time_str = str(time_point['time'])
-                        time_point['time'] = time_str[0:-2] + ':' + time_str[-2:]
-                        icon_str = time_point['wx_icon']
-                        time_point['wx_icon'] = 'static/pictures/' + icon_str.replace('gif', 'png')
+                temp_city_weather = CityWeather(my_city, format_weather_timeframes(my_city_weather))
                 # get the attractions
                 temp_city = CityAttrInfo(my_city,
                                          attraction,
                                          my_city_attr_list)
-                num_of_attr = len(temp_city.attractions)
-                attractions_list = []
-                attractions_str = []
-                attractions_position = []
-                for i in range(num_of_attr):
-                    name_to_modify_list = re.split(''''|"''',temp_city.attractions[i]['name'])
-                    name_modified = ' '.join(name_to_modify_list)
-                    temp_attraction = Attraction(name_modified,
-                                                 temp_city.attractions[i]['point']['lon'],
-                                                 temp_city.attractions[i]['point']['lat'],
-                                                 temp_city.attractions[i]['rate'])
-                    # print(('[' + str(i+1) + ']').ljust(5), end='')
-                    # print(temp_attraction.info())
-                    attractions_list.append(temp_attraction)
-                    attractions_str.append(temp_attraction.info())
-                    attractions_position.append({'lat': temp_attraction.attr_lat,
-                                                 'lon': temp_attraction.attr_lon,
-                                                 'attr_name': temp_attraction.attr_name})
+                attractions_str, attractions_position = describe_attractions(temp_city.attractions)
 
                 city_center = open_cache('city_location.json')[my_city]['position']
-                figure_json = plot_attractions_on_map(center=city_center, attrs_to_plot=attractions_position)
-                return render_template('attractions_and_weathers_city_exist_attractions_not_empty.html',
-                                       my_list=temp_city_weather.city_weather_list,
-                                       cityname=temp_city_weather.name,
-                                       attraction_type=attraction,
-                                       attractions_str=attractions_str,
-                                       attractions_position=attractions_position,
-                                       plot_content=figure_json,
-                                       presentation_type=show_type)
+                itinerary = None
+                if show_type != 'in_table':
+                    itinerary = get_itinerary(my_city, attraction, attractions_position)
+                figure_json = plot_attractions_on_map(center=city_center, attrs_to_plot=attractions_position,
+                                                      itinerary=itinerary)
+                with metrics.stage('render'):
+                    return render_template('attractions_and_weathers_city_exist_attractions_not_empty.html',
+                                           my_list=temp_city_weather.city_weather_list,
+                                           cityname=temp_city_weather.name,
+                                           attraction_type=attraction,
+                                           attractions_str=attractions_str,
+                                           attractions_position=attractions_position,
+                                           plot_content=figure_json,
+                                           presentation_type=show_type,
+                                           page_query={'city': my_city,
+                                                       'kind': more_kinds,
+                                                       'state': my_state or ''},
+                                           has_more_pages=more_kinds != [])
+
+
+@app.route('/api/v1/attractions_page')
+def attractions_page():
+    ''' one more page of attractions, fetched by the attractions page as the
+    user scrolls down or pans the map
+
+    Query parameters: city (canonical city ID), kind (repeated), page (1 to
+    MAX_ATTRACTION_PAGES - 1), and optionally state. The response lists the
+    kinds with another page in kinds_with_more.
+    '''
+
+    my_city = canonical_city_id(request.args.get('city', ''))
+    attraction_types = request.args.getlist('kind')
+    try:
+        page = int(request.args.get('page', '1'))
+    except ValueError:
+        page = -1
+    if my_city == '' or attraction_types == [] or not 1 <= page < MAX_ATTRACTION_PAGES:
+        return jsonify({'error': f'city, kind and page from 1 to {MAX_ATTRACTION_PAGES - 1} '
+                                 f'are required'}), 400
+    try:
+        attractions_by_type = get_city_attractions_by_type(my_city,
+                                                           attraction_types,
+                                                           open_cache('city_location.json'),
+                                                           state=request.args.get('state') or None,
+                                                           page=page)
+    except UpstreamError:
+        return jsonify({'error': 'the search for attractions is unavailable'}), 503
+    _, attractions_position = describe_attractions(
+        merge_attractions(list(attractions_by_type.values())))
+    more_kinds = kinds_with_more_pages(attractions_by_type, page)
+    return jsonify({'page': page,
+                    'attractions': attractions_position,
+                    'kinds_with_more': more_kinds,
+                    'has_more': more_kinds != []})
+
+
+@app.route('/api/v1/suggest')
+def suggest():
+    ''' the city and airport names completing what the user typed, for the
+    forms of the index page
+
+    Query parameters: q (the text typed), optionally kind ('city' or
+    'airport') and limit (8 by default, at most MAX_SUGGESTIONS).
+    '''
+
+    kind = request.args.get('kind') or None
+    try:
+        limit = int(request.args.get('limit', '8'))
+    except ValueError:
+        limit = 0
+    if kind not in SUGGEST_KINDS + (None,) or not 1 <= limit <= MAX_SUGGESTIONS:
+        return jsonify({'error': f'kind must be city or airport, and limit 1 to {MAX_SUGGESTIONS}'}), 400
+    text = request.args.get('q', '')
+    try:
+        suggestions = suggest_places(text, kind, limit)
+    except sqlite3.OperationalError:
+        # a database built before the index, see construct_db.py
+        return jsonify({'error': 'suggestions are unavailable'}), 503
+    response = jsonify({'query': text, 'suggestions': suggestions})
+    # the suggestions only change when the database is rebuilt
+    response.headers['Cache-Control'] = 'public, max-age=300'
+    return response
 
 
 @app.route('/find_hotels_exists', methods=['POST'])
@@ -663,7 +2321,13 @@ def show_hotels():
     attr_lat = float(new_list[0].strip())
     attr_lon = float(new_list[1].strip())
     attr_name = new_list[2].strip()
-    hotels_response = get_hotels(attr_lon, attr_lat)
+    try:
+        hotels_response = get_hotels(attr_lon, attr_lat)
+    except UpstreamError:
+        return upstream_unavailable_page('the search for hotels')
+    if 'businesses' not in hotels_response:
+        # an error body cached by an older version
+        return upstream_unavailable_page('the search for hotels')
     total_hotels = len(hotels_response['businesses'])
     if total_hotels == 0:
         return f"<h2>We cannot find any hotels near the attraction you picked," \
@@ -698,14 +2362,16 @@ def show_hotels():
                                     'hotel_reviews': temp_hotel.review_count,
                                     'hotel_number': i + 1})
         figure_json = plot_hotels_price_and_rating(hotel_info_list)
-        return render_template('show_hotels.html',
-                               hotels=hotel_info_list,
-                               num_hotels=len(hotel_info_list),
-                               attraction_name=attr_name,
-                               plot_content=figure_json,
-                               plot_type=hotel_present_type)
+        with metrics.stage('render'):
+            return render_template('show_hotels.html',
+                                   hotels=hotel_info_list,
+                                   num_hotels=len(hotel_info_list),
+                                   attraction_name=attr_name,
+                                   plot_content=figure_json,
+                                   plot_type=hotel_present_type)
 
 
 if __name__ == '__main__':
     print('starting Flaks app!', app.name)
+    preload_caches()
     app.run(debug=True)
\ No newline at end of file
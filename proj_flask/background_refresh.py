@@ -0,0 +1,93 @@
+import os
+import queue
+import threading
+import time
+
+
+class BackgroundRefresher:
+    '''refreshes cache entries on a background thread
+
+    A refresh is identified by a key (eg. the cache namespace and the cache
+    key); a refresh that is already waiting or running is not scheduled again,
+    and refreshes are started at most max_per_second times a second, so a
+    burst of stale hits turns into a bounded trickle of upstream calls.
+
+    The thread is started on first use in each process, so a refresher
+    created before the server forks its workers works in every worker.
+
+    Instance Attributes
+    -------------------
+    max_per_second: float
+        the maximum number of refreshes started per second
+
+    max_pending: int
+        the maximum number of refreshes waiting, more are dropped
+    '''
+
+    def __init__(self, max_per_second=2.0, max_pending=256):
+        self.max_per_second = max_per_second
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._pid = None
+        self._thread = None
+        self._queue = None
+        self._pending = set()
+
+    def _start_if_needed(self):
+        # called with the lock held
+        if self._thread is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._queue = queue.Queue(maxsize=self.max_pending)
+            self._pending = set()
+            self._thread = threading.Thread(target=self._run, name='cache-refresher',
+                                            daemon=True)
+            self._thread.start()
+
+    def schedule(self, refresh_key, refresh_function):
+        ''' refresh in the background, unless the same refresh is pending
+
+        Parameters
+        ----------
+        refresh_key: hashable
+            identifies the refresh, eg. ('hotels', key)
+
+        refresh_function: function
+            called without arguments on the background thread
+
+        Returns
+        -------
+        bool
+            whether the refresh was scheduled
+        '''
+
+        with self._lock:
+            self._start_if_needed()
+            if refresh_key in self._pending:
+                return False
+            try:
+                self._queue.put_nowait((refresh_key, refresh_function))
+            except queue.Full:
+                return False
+            self._pending.add(refresh_key)
+            return True
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+    def _run(self):
+        min_interval = 1.0 / self.max_per_second
+        last_start = 0.0
+        while True:
+            refresh_key, refresh_function = self._queue.get()
+            wait = last_start + min_interval - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            last_start = time.monotonic()
+            try:
+                refresh_function()
+            except Exception as error:
+                print(f'background refresh of {refresh_key} failed: {error!r}')
+            finally:
+                with self._lock:
+                    self._pending.discard(refresh_key)
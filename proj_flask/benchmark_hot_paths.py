@@ -0,0 +1,276 @@
+import argparse
+import contextlib
+import datetime
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# the routes are benchmarked against the checked-in cache files as they are,
+# see the offline mode in README.txt; set before app_main is imported
+os.environ['TRAVEL_OFFLINE'] = '1'
+
+import upstream
+from app_main import app, open_cache, save_cache, preload_caches, update_cache, \
+    plot_attractions_on_map, plot_hotels_price_and_rating, format_weather_timeframes, \
+    describe_attractions, WEATHER_CACHE_FILENAME
+from itinerary import order_attractions
+from projection import attractions_from_entry
+from stub_upstreams import fake_forecast
+
+
+# run from the proj_flask directory, eg.
+#     python benchmark_hot_paths.py --output before.json
+#     python benchmark_hot_paths.py --compare before.json
+# prints (or writes) one json document with the timings of each benchmark,
+# in milliseconds, so two versions of the app can be compared
+
+# the number of entries of the cache files timed by open_cache/save_cache
+CACHE_SIZES = (10, 100, 1000)
+# the numbers of attractions the visiting order is timed for
+ITINERARY_SIZES = (20, 100, 500)
+
+# the city, attraction types and attraction the route benchmarks ask for;
+# all of them are in the checked-in cache files
+CITY = 'detroit'
+ATTRACTION_TYPES = ['bridges', 'skyscrapers']
+ATTRACTION = {'lat': 42.344677, 'lon': -83.034279, 'name': 'Chestnut Street'}
+# the city pairs of the batch ticket url request, 100 pairs of 20 cities
+TICKET_CITIES = ['Detroit', 'Chicago', 'New York', 'Los Angeles', 'Boston', 'Seattle', 'Denver',
+                 'Atlanta', 'Dallas', 'Houston', 'Phoenix', 'Miami', 'Portland', 'Las Vegas',
+                 'Orlando', 'Nashville', 'Anchorage', 'Honolulu', 'Scottsdale', 'Nowhere']
+TICKET_PAIRS = [{'dep_city_name': TICKET_CITIES[i % 20], 'des_city_name': TICKET_CITIES[i * 7 % 20]}
+                for i in range(100)]
+# a text in the response of each route benchmark that only the intended
+# page has, eg. the attractions table and not the map
+ROUTE_MARKERS = {
+    'GET /': '<select name="presentation_type">',
+    'POST attractions (table)': 'id="attractions_table"',
+    'POST attractions (map)': "Plotly.newPlot('myDiv1'",
+    'POST hotels (plot)': "Plotly.newPlot('myDiv1'",
+    'GET suggest': '"suggestions"',
+    'POST tickets': 'skyscanner.com/transport/flights/',
+    'POST ticket urls (100 pairs)': f'"index": {len(TICKET_PAIRS) - 1},',
+}
+
+
+def time_function(function, repeat, warmup=2):
+    ''' time the calls of a function
+
+    Parameters
+    ----------
+    function: function
+        called without arguments
+
+    repeat: int
+        the number of timed calls
+
+    warmup: int
+        the number of calls made before timing
+
+    Returns
+    -------
+    dict
+        the number of calls, and the min, median, mean, p95 and max time of
+        a call in milliseconds
+    '''
+
+    for _ in range(warmup):
+        function()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {'runs': repeat,
+            'min_ms': round(timings[0], 4),
+            'median_ms': round(statistics.median(timings), 4),
+            'mean_ms': round(statistics.mean(timings), 4),
+            'p95_ms': round(timings[min(len(timings) - 1, int(0.95 * len(timings)))], 4),
+            'max_ms': round(timings[-1], 4)}
+
+
+def build_cache_fixture(source_filename, size):
+    ''' a cache of the given size, made of the entries of a checked-in cache
+    file repeated under new keys
+
+    Returns
+    -------
+    dict
+    '''
+
+    source = open_cache(source_filename)
+    entries = itertools.cycle(source.values())
+    return {f'fixture_{i}': next(entries) for i in range(size)}
+
+
+def benchmark_cache_files(repeat):
+    results = {}
+    work_dir = tempfile.mkdtemp(prefix='benchmark_cache_')
+    # the real file i/o, not the in-memory caches of offline mode
+    upstream.OFFLINE = False
+    try:
+        for source_filename in ('city_location_attraction.json', 'hotels_cache.json'):
+            for size in CACHE_SIZES:
+                fixture = build_cache_fixture(source_filename, size)
+                filename = os.path.join(work_dir, f'{size}_{source_filename}')
+                save_cache(fixture, filename)
+                label = f'{os.path.splitext(source_filename)[0]}[{size}]'
+                results[f'open_cache {label}'] = time_function(lambda: open_cache(filename), repeat)
+                results[f'save_cache {label}'] = time_function(lambda: save_cache(fixture, filename),
+                                                               repeat)
+                results[f'open_cache {label}']['bytes'] = os.path.getsize(filename)
+    finally:
+        upstream.OFFLINE = True
+        shutil.rmtree(work_dir)
+    return results
+
+
+def benchmark_rendering(repeat):
+    results = {}
+    attractions = attractions_from_entry(open_cache('city_location_attraction.json')[f'{CITY}_bridges'])
+    _, attractions_position = describe_attractions(attractions)
+    center = open_cache('city_location.json')[CITY]['position']
+    results[f'plot_attractions_on_map [{len(attractions_position)}]'] = time_function(
+        lambda: plot_attractions_on_map(center, attractions_position), repeat)
+
+    hotels_cache = open_cache('hotels_cache.json')
+    businesses = max((entry.get('businesses', []) for entry in hotels_cache.values()), key=len)
+    hotel_list = [{'hotel_name': business['name'],
+                   'hotel_price': business.get('price', 'not provided'),
+                   'hotel_rating': business['rating']} for business in businesses]
+    results[f'plot_hotels_price_and_rating [{len(hotel_list)}]'] = time_function(
+        lambda: plot_hotels_price_and_rating(hotel_list), repeat)
+
+    forecast = fake_forecast(center['lat'], center['lon'])['Days']
+    results['format_weather_timeframes [7 days]'] = time_function(
+        lambda: format_weather_timeframes(forecast), repeat)
+
+    # the visiting order of the attractions, for the page size and for the
+    # larger limits, on points spread over the city
+    for size in ITINERARY_SIZES:
+        points = random.Random(size)
+        lats = [center['lat'] + points.uniform(-0.2, 0.2) for _ in range(size)]
+        lons = [center['lon'] + points.uniform(-0.2, 0.2) for _ in range(size)]
+        results[f'order_attractions [{size}]'] = time_function(
+            lambda: order_attractions(lats, lons), repeat)
+    return results
+
+
+def route_requests(client):
+    ''' the requests of the route benchmarks, also used by memory_budget.py
+
+    Parameters
+    ----------
+    client: FlaskClient
+        the test client of the app
+
+    Returns
+    -------
+    dict
+        name -> function sending the request and returning the response
+    '''
+
+    # the forecast is not in the checked-in caches, give it one
+    center = open_cache('city_location.json')[CITY]['position']
+    update_cache(WEATHER_CACHE_FILENAME, {CITY: fake_forecast(center['lat'], center['lon'])})
+    return {
+        'GET /': lambda: client.get('/'),
+        'POST attractions (table)': lambda: client.post(
+            '/attractions_and_weathers_city_exist_attractions_not_empty',
+            data={'city_name': CITY, 'attraction_type': ATTRACTION_TYPES,
+                  'presentation_type': 'in_table'}),
+        'POST attractions (map)': lambda: client.post(
+            '/attractions_and_weathers_city_exist_attractions_not_empty',
+            data={'city_name': CITY, 'attraction_type': ATTRACTION_TYPES,
+                  'presentation_type': 'on_map'}),
+        'POST hotels (plot)': lambda: client.post(
+            '/find_hotels_exists',
+            data={'attr_choice': f"{ATTRACTION['lat']}, {ATTRACTION['lon']}, {ATTRACTION['name']}",
+                  'hotel_presentation_type': 'in_bar_plot'}),
+        'GET suggest': lambda: client.get('/api/v1/suggest', query_string={'q': 'new yo'}),
+        'POST tickets': lambda: client.post(
+            '/buying_air_tickets',
+            data={'dep_city_name': 'Detroit', 'des_city_name': 'Chicago', 'month': '05',
+                  'day': '01'}),
+        # buffered, so the streamed lines are generated within the timing
+        'POST ticket urls (100 pairs)': lambda: client.post(
+            '/api/v1/ticket_urls', json={'month': '05', 'day': '01', 'pairs': TICKET_PAIRS},
+            buffered=True),
+    }
+
+
+def check_response(name, response):
+    if response.status_code != 200:
+        raise RuntimeError(f'{name} returned {response.status_code}')
+    if ROUTE_MARKERS[name] not in response.get_data(as_text=True):
+        raise RuntimeError(f'{name} did not return {ROUTE_MARKERS[name]!r}')
+
+
+def benchmark_routes(repeat):
+    results = {}
+    for name, make_request in route_requests(app.test_client()).items():
+        check_response(name, make_request())
+        results[name] = time_function(make_request, repeat)
+    return results
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': datetime.datetime.now().isoformat(timespec='seconds')}
+
+
+def compare(before, after):
+    ''' print the change of the median time of each benchmark
+    '''
+
+    for name, timing in after['benchmarks'].items():
+        if name in before['benchmarks']:
+            old = before['benchmarks'][name]['median_ms']
+            change = (timing['median_ms'] - old) / old * 100 if old else 0.0
+            print(f"{name:<55} {old:>10.3f} -> {timing['median_ms']:>10.3f} ms ({change:+.1f}%)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='time the data access and rendering hot paths')
+    parser.add_argument('--repeat', type=int, default=20, help='timed calls per benchmark')
+    parser.add_argument('--only', choices=['cache_files', 'rendering', 'routes'], action='append',
+                        help='run only these groups of benchmarks')
+    parser.add_argument('--output', help='write the results to this file instead of stdout')
+    parser.add_argument('--compare', help='compare with the results of an earlier run')
+    args = parser.parse_args()
+
+    preload_caches()
+    groups = {'cache_files': benchmark_cache_files,
+              'rendering': benchmark_rendering,
+              'routes': benchmark_routes}
+    report = {'environment': environment(), 'repeat': args.repeat, 'benchmarks': {}}
+    # the app prints 'cache'/'fetch' on every lookup, keep stdout for the report
+    with contextlib.redirect_stdout(sys.stderr):
+        for group in args.only or groups:
+            report['benchmarks'].update(groups[group](args.repeat))
+
+    if args.output:
+        with open(args.output, 'w') as fw:
+            json.dump(report, fw, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    if args.compare:
+        with open(args.compare, 'r') as fr:
+            compare(json.load(fr), report)
@@ -0,0 +1,258 @@
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import zlib
+
+
+# layout of a binary cache file
+# -----------------------------
+# header: magic, format version, number of entries, and the mtime/size/inode
+#         of the json cache file it was built from (used to detect a stale
+#         snapshot; the inode changes when save_cache renames a new file in,
+#         even with the same size within the mtime granularity)
+# index:  one fixed-size record per entry, sorted by the utf-8 bytes of the key,
+#         holding the offset and length of the key and the offset of the value
+# keys:   the utf-8 encoded keys, back to back
+# values: for each entry a 4-byte length followed by the zlib-compressed json
+MAGIC = b'SICB'
+FORMAT_VERSION = 2
+HEADER = struct.Struct('<4sHHIqqQ')
+INDEX_RECORD = struct.Struct('<QIQ')
+VALUE_LENGTH = struct.Struct('<I')
+
+# binary caches opened by this process, keyed by the binary file name
+_open_binary_caches = {}
+_open_binary_caches_lock = threading.Lock()
+
+
+class BinaryCache:
+    '''a read-only cache file read through mmap
+
+    Only the header is parsed when the file is opened, a lookup does a binary
+    search over the sorted index and decompresses the one value it needs. All
+    the processes mapping the same file share the pages in the page cache.
+
+    Instance Attributes
+    -------------------
+    filename: str
+        the name of the binary cache file
+
+    source_mtime_ns: int
+        the mtime (in ns) of the json cache file this file was built from
+
+    source_size: int
+        the size (in bytes) of the json cache file this file was built from
+
+    source_inode: int
+        the inode of the json cache file this file was built from
+    '''
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as fr:
+            self._stat = os.fstat(fr.fileno())
+            self._map = mmap.mmap(fr.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version = struct.unpack_from('<4sH', self._map, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self._map.close()
+            raise ValueError(f'{filename} is not a binary cache file')
+        _, _, _, count, mtime_ns, size, inode = HEADER.unpack_from(self._map, 0)
+        self._count = count
+        self.source_mtime_ns = mtime_ns
+        self.source_size = size
+        self.source_inode = inode
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, key):
+        return self._find(key) is not None
+
+    def _key_at(self, position):
+        key_offset, key_length, _ = INDEX_RECORD.unpack_from(
+            self._map, HEADER.size + position * INDEX_RECORD.size)
+        return self._map[key_offset:key_offset + key_length]
+
+    def _find(self, key):
+        target = key.encode('utf-8')
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._key_at(middle) < target:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self._count and self._key_at(low) == target:
+            return low
+        return None
+
+    def get(self, key, default=None):
+        ''' decode the value stored under the key
+
+        Parameters
+        ----------
+        key: str
+            the key to look up
+
+        default:
+            returned when the key is not in the file
+
+        Returns
+        -------
+        the decoded json value, or default
+        '''
+
+        position = self._find(key)
+        if position is None:
+            return default
+        _, _, value_offset = INDEX_RECORD.unpack_from(
+            self._map, HEADER.size + position * INDEX_RECORD.size)
+        (value_length,) = VALUE_LENGTH.unpack_from(self._map, value_offset)
+        start = value_offset + VALUE_LENGTH.size
+        return json.loads(zlib.decompress(self._map[start:start + value_length]))
+
+    def warm(self):
+        ''' ask the kernel to read the whole file into the page cache
+        '''
+
+        if hasattr(self._map, 'madvise') and hasattr(mmap, 'MADV_WILLNEED'):
+            self._map.madvise(mmap.MADV_WILLNEED)
+
+    def keys(self):
+        return [self._key_at(i).decode('utf-8') for i in range(self._count)]
+
+    def is_built_from(self, source_filename):
+        ''' check whether this file is a snapshot of the current json cache
+        '''
+
+        try:
+            source_stat = os.stat(source_filename)
+        except OSError:
+            return False
+        return (source_stat.st_ino == self.source_inode
+                and source_stat.st_mtime_ns == self.source_mtime_ns
+                and source_stat.st_size == self.source_size)
+
+    def is_current_file(self):
+        ''' check whether the file on disk is still the one that was mapped
+        '''
+
+        try:
+            disk_stat = os.stat(self.filename)
+        except OSError:
+            return False
+        return (disk_stat.st_ino == self._stat.st_ino
+                and disk_stat.st_mtime_ns == self._stat.st_mtime_ns)
+
+    def close(self):
+        self._map.close()
+
+
+def binary_cache_filename(cache_filename):
+    ''' the name of the binary cache file kept next to a json cache file
+    '''
+
+    return os.path.splitext(cache_filename)[0] + '.bin'
+
+
+def build_binary_cache(cache_dict, cache_filename):
+    ''' write the binary snapshot of a json cache file
+
+    The file is written to a temporary name and renamed into place, so a
+    process that has the previous file mapped keeps reading consistent data.
+
+    Parameters
+    ----------
+    cache_dict: dict
+        the contents of the json cache file
+
+    cache_filename: str
+        the name of the json cache file the dictionary was read from
+
+    Returns
+    -------
+    str
+        the name of the binary cache file
+    '''
+
+    source_stat = os.stat(cache_filename)
+    encoded = sorted((key.encode('utf-8'), value) for key, value in cache_dict.items())
+    count = len(encoded)
+    key_offset = HEADER.size + count * INDEX_RECORD.size
+    value_offset = key_offset + sum(len(key) for key, _ in encoded)
+
+    index_part = []
+    key_part = []
+    value_part = []
+    for key, value in encoded:
+        compressed = zlib.compress(json.dumps(value).encode('utf-8'))
+        index_part.append(INDEX_RECORD.pack(key_offset, len(key), value_offset))
+        key_part.append(key)
+        value_part.append(VALUE_LENGTH.pack(len(compressed)))
+        value_part.append(compressed)
+        key_offset += len(key)
+        value_offset += VALUE_LENGTH.size + len(compressed)
+
+    filename = binary_cache_filename(cache_filename)
+    temp_filename = f'{filename}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(temp_filename, 'wb') as fw:
+        fw.write(HEADER.pack(MAGIC, FORMAT_VERSION, 0, count,
+                             source_stat.st_mtime_ns, source_stat.st_size, source_stat.st_ino))
+        fw.write(b''.join(index_part))
+        fw.write(b''.join(key_part))
+        fw.write(b''.join(value_part))
+    os.replace(temp_filename, filename)
+    return filename
+
+
+def open_binary_cache(cache_filename):
+    ''' get the mapped binary snapshot of a json cache file
+
+    The mapping is kept open for the life of the process and is re-opened
+    when the binary file is replaced. None is returned when there is no
+    binary file, or when it was built from an older version of the json file.
+
+    Parameters
+    ----------
+    cache_filename: str
+        the name of the json cache file
+
+    Returns
+    -------
+    BinaryCache or None
+    '''
+
+    filename = binary_cache_filename(cache_filename)
+    with _open_binary_caches_lock:
+        binary_cache = _open_binary_caches.get(filename)
+        if binary_cache is not None and not binary_cache.is_current_file():
+            # not closed here, another thread may still be reading it; the
+            # mapping is released once the last reference is dropped
+            binary_cache = None
+            del _open_binary_caches[filename]
+        if binary_cache is None:
+            try:
+                binary_cache = BinaryCache(filename)
+            except (OSError, ValueError, struct.error):
+                return None
+            _open_binary_caches[filename] = binary_cache
+    if not binary_cache.is_built_from(cache_filename):
+        return None
+    return binary_cache
+
+
+if __name__ == '__main__':
+    # rebuild the binary snapshots, eg. python binary_cache.py hotels_cache.json
+    from app_main import locked_cache_file
+
+    for name in sys.argv[1:] or ['city_location_attraction.json', 'hotels_cache.json']:
+        # under the write lock, so that no update lands between the read and
+        # the stat stamping the snapshot, see update_cache in app_main.py
+        with locked_cache_file(name):
+            with open(name, 'r') as fr:
+                contents = json.load(fr)
+            snapshot_filename = build_binary_cache(contents, name)
+        print(f'{name} -> {snapshot_filename} ({len(contents)} entries)')
@@ -0,0 +1,213 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+from app_main import open_cache, cache_entry_freshness, cache_counters, cache_counters_lock, \
+    NEGATIVE_CACHE_FILENAME, NEGATIVE_RESULT_TTL, WEATHER_CACHE_FILENAME, CITY_ALIASES_FILENAME
+from projection import attractions_from_entry
+
+
+# run from the proj_flask directory, eg.
+#     python cache_stats.py
+#     python cache_stats.py --json --largest 10
+# the same report, with the hit/miss counters of the serving process, is on
+# /admin/cache_stats
+
+
+def check_city_location(entry):
+    if not isinstance(entry, dict) or 'name' not in entry:
+        return 'not a location'
+    position = entry.get('position')
+    if not isinstance(position, dict) or 'lat' not in position or 'lon' not in position:
+        return 'no position'
+    return None
+
+
+def check_city_attractions(entry):
+    attractions = attractions_from_entry(entry)
+    if attractions is None:
+        # eg. an OpenTripMap error body cached as attractions
+        return f'not a list of attractions: {json.dumps(entry)[:80]}'
+    for attraction in attractions:
+        if not isinstance(attraction, dict) or 'point' not in attraction or 'name' not in attraction:
+            return 'attraction without a name or a point'
+    return None
+
+
+def check_hotels(entry):
+    if not isinstance(entry, dict) or not isinstance(entry.get('businesses'), list):
+        # eg. a Yelp error body
+        return f'no businesses: {json.dumps(entry)[:80]}'
+    return None
+
+
+def check_weather(entry):
+    if not isinstance(entry, dict) or not isinstance(entry.get('Days'), list):
+        return 'no forecast days'
+    return None
+
+
+def check_negative_result(entry):
+    if not isinstance(entry, dict) or entry.get('reason') not in NEGATIVE_RESULT_TTL:
+        return 'unknown reason'
+    if time.time() - entry.get('cached_at', 0) > NEGATIVE_RESULT_TTL[entry['reason']]:
+        return 'expired, evicted on the next store'
+    return None
+
+
+def check_city_alias(entry):
+    if not isinstance(entry, str):
+        return 'not a city name'
+    return None
+
+
+def is_empty(entry):
+    if isinstance(entry, dict) and 'businesses' in entry:
+        return entry['businesses'] == []
+    return attractions_from_entry(entry) == []
+
+
+# namespace -> (cache file, check of an entry returning what is wrong with
+# it or None, whether entries are stamped with their fetch time)
+CACHE_NAMESPACES = {
+    'city_location': ('city_location.json', check_city_location, True),
+    'city_attractions': ('city_location_attraction.json', check_city_attractions, True),
+    'hotels': ('hotels_cache.json', check_hotels, True),
+    'weather': (WEATHER_CACHE_FILENAME, check_weather, True),
+    'negative_results': (NEGATIVE_CACHE_FILENAME, check_negative_result, False),
+    'city_aliases': (CITY_ALIASES_FILENAME, check_city_alias, False),
+}
+
+# upper bounds of the age buckets, in seconds
+AGE_BUCKETS = (('< 1 hour', 60 * 60), ('< 1 day', 24 * 60 * 60), ('< 1 week', 7 * 24 * 60 * 60),
+               ('< 30 days', 30 * 24 * 60 * 60), ('< 1 year', 365 * 24 * 60 * 60))
+
+
+def age_bucket(age):
+    for name, upper_bound in AGE_BUCKETS:
+        if age < upper_bound:
+            return name
+    return '>= 1 year'
+
+
+def namespace_statistics(namespace, largest=5):
+    ''' the statistics of the cache file of a namespace
+
+    Parameters
+    ----------
+    namespace: str
+        a key of CACHE_NAMESPACES
+
+    largest: int
+        the number of largest entries to list
+
+    Returns
+    -------
+    dict
+        the number of entries, the size of the file and of the entries, the
+        age and freshness of the entries, the largest entries, and the
+        invalid and empty entries
+    '''
+
+    cache_filename, check_entry, stamped = CACHE_NAMESPACES[namespace]
+    cache_dict = open_cache(cache_filename)
+    now = time.time()
+    entry_sizes = {key: len(json.dumps(entry)) for key, entry in cache_dict.items()}
+    ages = {name: 0 for name, _ in AGE_BUCKETS}
+    ages['>= 1 year'] = 0
+    ages['unknown'] = 0
+    freshness = {'fresh': 0, 'stale': 0, 'expired': 0}
+    invalid = []
+    empty = 0
+    for key, entry in cache_dict.items():
+        problem = check_entry(entry)
+        if problem is not None:
+            invalid.append({'key': key, 'problem': problem})
+            continue
+        if stamped:
+            fetched_at = entry.get('_fetched_at') if isinstance(entry, dict) else None
+            ages['unknown' if fetched_at is None else age_bucket(now - fetched_at)] += 1
+            freshness[cache_entry_freshness(namespace, entry)] += 1
+            if namespace in ('city_attractions', 'hotels') and is_empty(entry):
+                empty += 1
+    statistics = {'file': cache_filename,
+                  'entries': len(cache_dict),
+                  'file_bytes': os.path.getsize(cache_filename) if os.path.exists(cache_filename) else 0,
+                  'entry_bytes': sum(entry_sizes.values()),
+                  'largest': [{'key': key, 'bytes': size}
+                              for key, size in sorted(entry_sizes.items(),
+                                                      key=lambda item: item[1],
+                                                      reverse=True)[:largest]],
+                  'invalid': invalid}
+    if stamped:
+        statistics['ages'] = ages
+        statistics['freshness'] = freshness
+    if namespace in ('city_attractions', 'hotels'):
+        statistics['empty'] = empty
+    return statistics
+
+
+def counter_statistics():
+    ''' the cache events counted by this process since it started, with the
+    hit rate of each namespace
+
+    Returns
+    -------
+    dict
+    '''
+
+    with cache_counters_lock:
+        counters = {namespace: dict(counter) for namespace, counter in cache_counters.items()}
+    for counter in counters.values():
+        lookups = counter.get('hit', 0) + counter.get('miss', 0)
+        if lookups:
+            counter['hit_rate'] = round(counter.get('hit', 0) / lookups, 4)
+    return counters
+
+
+def cache_statistics(largest=5):
+    ''' the statistics of every cache, see namespace_statistics
+
+    Returns
+    -------
+    dict
+    '''
+
+    return {'namespaces': {namespace: namespace_statistics(namespace, largest)
+                           for namespace in CACHE_NAMESPACES},
+            'counters': counter_statistics()}
+
+
+def print_statistics(report):
+    for namespace, statistics in report['namespaces'].items():
+        print('+--------------------------------+')
+        print(f"{namespace} ({statistics['file']}): {statistics['entries']} entries, "
+              f"{statistics['file_bytes']} bytes")
+        if statistics.get('ages') and statistics['entries']:
+            print('    age:       ' + ', '.join(f'{name}: {count}'
+                                                for name, count in statistics['ages'].items() if count))
+            print('    freshness: ' + ', '.join(f'{name}: {count}'
+                                                for name, count in statistics['freshness'].items()))
+        if 'empty' in statistics:
+            print(f"    empty results: {statistics['empty']}")
+        for entry in statistics['largest']:
+            print(f"    largest: {entry['key']} ({entry['bytes']} bytes)")
+        for entry in statistics['invalid']:
+            print(f"    INVALID: {entry['key']}: {entry['problem']}")
+    print('+--------------------------------+')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='report the size, age and validity of the caches')
+    parser.add_argument('--largest', type=int, default=5, help='the number of largest entries to list')
+    parser.add_argument('--json', action='store_true', help='print the report as json')
+    args = parser.parse_args()
+    report = cache_statistics(args.largest)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_statistics(report)
+    if any(statistics['invalid'] for statistics in report['namespaces'].values()):
+        sys.exit(1)
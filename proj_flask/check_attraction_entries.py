@@ -0,0 +1,54 @@
+import os
+import sys
+
+# the cache files are not written to in offline mode, see README.txt; set
+# before app_main is imported
+os.environ['TRAVEL_OFFLINE'] = '1'
+
+from stub_upstreams import start_stub_upstreams
+from app_main import app, update_cache, lookup_cache, generate_unique_city_attraction_page_name
+from projection import attractions_from_entry
+
+
+# run from the proj_flask directory, eg.
+#     python check_attraction_entries.py
+# caches an OpenTripMap error body as the attractions of a city, as versions
+# before the projection did, then asks for them against the stub apis; fails
+# if the error body is served instead of being fetched again
+
+CITY, ATTRACTION_TYPE = 'detroit', 'bridges'
+ERROR_BODY = {'error': 'Unknown category name: bridges'}
+
+
+def check(failures, condition, message):
+    if not condition:
+        failures.append(message)
+
+
+if __name__ == '__main__':
+    servers = start_stub_upstreams(ports={'opentripmap': 0, 'weatherunlocked': 0})
+    for upstream, path in (('opentripmap', '/0.1/en/places'), ('weatherunlocked', '/api')):
+        os.environ[f'TRAVEL_{upstream.upper()}_URL'] = (
+            f'http://127.0.0.1:{servers[upstream].server_address[1]}{path}')
+    unique_name = generate_unique_city_attraction_page_name(CITY, ATTRACTION_TYPE, 0)
+    update_cache('city_location_attraction.json', {unique_name: ERROR_BODY})
+    failures = []
+    try:
+        response = app.test_client().post(
+            '/attractions_and_weathers_city_exist_attractions_not_empty',
+            data={'city_name': CITY, 'attraction_type': ATTRACTION_TYPE,
+                  'presentation_type': 'in_table'})
+        check(failures, response.status_code == 200, f'the page returned {response.status_code}')
+        check(failures, 'id="attractions_table"' in response.get_data(as_text=True),
+              'the page has no attractions table')
+        attractions = attractions_from_entry(lookup_cache('city_location_attraction.json',
+                                                          unique_name))
+        check(failures, attractions is not None and len(attractions) > 0,
+              f'the error body was not replaced: {attractions}')
+    finally:
+        for server in servers.values():
+            server.shutdown()
+    for failure in failures:
+        print(f'FAIL {failure}')
+    print('ok' if not failures else f'{len(failures)} failed')
+    sys.exit(1 if failures else 0)
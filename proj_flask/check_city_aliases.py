@@ -0,0 +1,58 @@
+import os
+import sys
+
+# the cache files are not written to in offline mode, see README.txt; set
+# before app_main is imported
+os.environ['TRAVEL_OFFLINE'] = '1'
+
+from stub_upstreams import start_stub_upstreams
+from app_main import app, canonical_city_id, open_cache, CITY_ALIASES_FILENAME
+
+
+# run from the proj_flask directory, eg.
+#     python check_city_aliases.py
+# searches the attractions of a misspelled city against the stub apis, whose
+# geoname finds the city it stands for; fails if the page does not show the
+# attractions of the city, or the misspelling does not resolve to it after.
+# In offline mode the learned alias is only kept in memory, see
+# cache_file_version in app_main.py.
+
+# a misspelling of stub_upstreams.MISSPELLED_CITIES, and the city it stands
+# for, whose attractions are in the checked-in cache files
+MISSPELLING, CITY, ATTRACTION_TYPE = 'Detroitt', 'detroit', 'bridges'
+
+
+def check(failures, condition, message):
+    if not condition:
+        failures.append(message)
+
+
+if __name__ == '__main__':
+    if MISSPELLING.lower() in open_cache('city_location.json'):
+        sys.exit(f'{MISSPELLING} is cached, pick another misspelling')
+    servers = start_stub_upstreams(ports={'opentripmap': 0, 'weatherunlocked': 0})
+    for upstream, path in (('opentripmap', '/0.1/en/places'), ('weatherunlocked', '/api')):
+        os.environ[f'TRAVEL_{upstream.upper()}_URL'] = (
+            f'http://127.0.0.1:{servers[upstream].server_address[1]}{path}')
+    failures = []
+    try:
+        check(failures, canonical_city_id(MISSPELLING) != CITY,
+              f'{MISSPELLING!r} is resolved before it was searched')
+        response = app.test_client().post(
+            '/attractions_and_weathers_city_exist_attractions_not_empty',
+            data={'city_name': MISSPELLING, 'attraction_type': ATTRACTION_TYPE,
+                  'presentation_type': 'in_table'})
+        page = response.get_data(as_text=True)
+        check(failures, response.status_code == 200 and 'id="attractions_table"' in page,
+              f'the page of {MISSPELLING!r} has no attractions: {page[:120]!r}')
+        check(failures, open_cache(CITY_ALIASES_FILENAME).get(MISSPELLING.lower()) is not None,
+              f'the alias {MISSPELLING!r} was not learned')
+        check(failures, canonical_city_id(MISSPELLING) == CITY,
+              f'{MISSPELLING!r} resolves to {canonical_city_id(MISSPELLING)!r}, not {CITY!r}')
+    finally:
+        for server in servers.values():
+            server.shutdown()
+    for failure in failures:
+        print(f'FAIL {failure}')
+    print('ok' if not failures else f'{len(failures)} failed')
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,136 @@
+import html
+import math
+import os
+import re
+import shutil
+import sys
+import tempfile
+
+# the cache files are not written to in offline mode, see README.txt; set
+# before app_main is imported
+os.environ['TRAVEL_OFFLINE'] = '1'
+
+sys.path.insert(0, os.path.join('..', 'data_access_code', 'my_data_base'))
+import construct_db
+import app_main
+from nearest_airports import load_airport_tree, EARTH_RADIUS_KM
+
+
+# run from the proj_flask directory, eg.
+#     python check_nearest_airports.py
+# builds a database with construct_db.py from the few airports below, then
+# checks the nearest airports found by the tree against every airport, and
+# the ticket page of a city without an airport, which flies from the nearest
+# one and lists the airports near the city. The checked-in
+# database has no airport locations (see 5.p in README.txt), so the app alone
+# never takes this path.
+
+FIXTURE_SOURCES = {
+    'states': [{'state': 'Michigan', 'state_code': 'MI'},
+               {'state': 'Illinois', 'state_code': 'IL'},
+               {'state': 'Alaska', 'state_code': 'AK'}],
+    'airports': [
+        {'airport_code': 'DTW', 'airport_name': 'Detroit Metropolitan Wayne County',
+         'airport_city': 'Detroit', 'airport_state_code': 'MI'},
+        {'airport_code': 'ORD', 'airport_name': "Chicago O'Hare International",
+         'airport_city': 'Chicago', 'airport_state_code': 'IL'},
+        {'airport_code': 'MDW', 'airport_name': 'Chicago Midway International',
+         'airport_city': 'Chicago', 'airport_state_code': 'IL'},
+        {'airport_code': 'ANC', 'airport_name': 'Ted Stevens Anchorage International',
+         'airport_city': 'Anchorage', 'airport_state_code': 'AK'},
+        {'airport_code': 'ADK', 'airport_name': 'Adak',
+         'airport_city': 'Adak Island', 'airport_state_code': 'AK'},
+        {'airport_code': 'SYA', 'airport_name': 'Eareckson Air Station',
+         'airport_city': 'Shemya', 'airport_state_code': 'AK'},
+        # an airport without a location, left out of the tree
+        {'airport_code': 'LAN', 'airport_name': 'Capital Region International',
+         'airport_city': 'Lansing', 'airport_state_code': 'MI'},
+    ],
+    'cities_by_area': [{'city_name': 'Anchorage', 'city_state': 'Alaska', 'city_area': 1706}],
+    'airport_locations': [
+        {'airport_code': 'DTW', 'latitude': 42.2124, 'longitude': -83.3534},
+        {'airport_code': 'ORD', 'latitude': 41.9786, 'longitude': -87.9048},
+        {'airport_code': 'MDW', 'latitude': 41.7860, 'longitude': -87.7524},
+        {'airport_code': 'ANC', 'latitude': 61.1744, 'longitude': -149.9964},
+        {'airport_code': 'ADK', 'latitude': 51.8780, 'longitude': -176.6460},
+        {'airport_code': 'SYA', 'latitude': 52.7123, 'longitude': 174.1140},
+    ],
+}
+
+# positions to look the nearest airports up from, with the nearest one; the
+# last is west of the 180th meridian, nearer to Adak than to Shemya
+POSITIONS = [(43.07, -89.4, 'ORD'), (42.33, -83.05, 'DTW'), (61.2, -149.9, 'ANC'),
+             (52.0, 179.5, 'ADK')]
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    h = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(h))
+
+
+def check(failures, condition, message):
+    if not condition:
+        failures.append(message)
+
+
+if __name__ == '__main__':
+    work_dir = tempfile.mkdtemp(prefix='check_airports_')
+    database_filename = os.path.join(work_dir, 'airport_database.sqlite')
+    failures = []
+    try:
+        construct_db.build_database(database_filename, FIXTURE_SOURCES)
+        tree = load_airport_tree(database_filename)
+        check(failures, len(tree) == len(FIXTURE_SOURCES['airport_locations']),
+              f'the tree has {len(tree)} airports')
+
+        for lat, lon, expected_code in POSITIONS:
+            nearest = tree.nearest(lat, lon, k=app_main.NEAREST_AIRPORTS)
+            codes = [airport[0] for _, airport in nearest]
+            by_distance = sorted(tree.airports,
+                                 key=lambda airport: haversine_km(lat, lon, airport[4], airport[5]))
+            by_distance = by_distance[:app_main.NEAREST_AIRPORTS]
+            check(failures, codes[0] == expected_code,
+                  f'the nearest airport of ({lat}, {lon}) is {codes[0]}, not {expected_code}')
+            check(failures, codes == [airport[0] for airport in by_distance],
+                  f'the nearest airports of ({lat}, {lon}) are {codes}')
+            distance_km, airport = nearest[0]
+            check(failures, abs(distance_km - haversine_km(lat, lon, airport[4], airport[5])) < 0.01,
+                  f'the distance to {airport[0]} is {distance_km} km')
+
+        # the ticket form on the fixture database: Madison (in the checked-in
+        # city_location.json) has no airport of its own
+        app_main.DATABASE_FILENAME = database_filename
+        resolved = app_main.resolve_airports(['Detroit', 'Madison', 'Atlantis'])
+        check(failures, resolved['Detroit'] is not None and resolved['Detroit']['code'] == 'DTW'
+              and 'nearest_km' not in resolved['Detroit'],
+              f"Detroit resolved to {resolved['Detroit']}")
+        check(failures, resolved['Madison'] is not None and resolved['Madison']['code'] == 'ORD'
+              and resolved['Madison'].get('nearest_km', 0) > 0,
+              f"Madison resolved to {resolved['Madison']}")
+        check(failures, resolved['Atlantis'] is None, f"Atlantis resolved to {resolved['Atlantis']}")
+
+        # the ticket form, through nearest_airport_row and nearest_airports.html
+        response = app_main.app.test_client().post(
+            '/buying_air_tickets',
+            data={'dep_city_name': 'Madison', 'des_city_name': 'Detroit', 'month': '05',
+                  'day': '01'})
+        page = html.unescape(response.get_data(as_text=True))
+        check(failures, response.status_code == 200, f'the ticket page returned {response.status_code}')
+        check(failures, 'Airport IATA code: ORD' in page and 'Airport IATA code: DTW' in page,
+              'the ticket page does not fly from ORD to DTW')
+        check(failures, page.count('has no airport in our database') == 1
+              and 'Madison has no airport in our database' in page,
+              'the ticket page does not list the airports near Madison only')
+        listed = re.findall(r'<li>.*? \((\w+)\) in .*?, ([\d.]+) km away</li>', page)
+        check(failures, [code for code, _ in listed] == ['ORD', 'MDW', 'DTW'],
+              f'the ticket page lists the airports near Madison as {listed}')
+        check(failures, '/ord/dtw/' in page,
+              'the ticket url does not fly from the nearest airport')
+    finally:
+        shutil.rmtree(work_dir)
+    for failure in failures:
+        print(f'FAIL {failure}')
+    print('ok' if not failures else f'{len(failures)} failed')
+    sys.exit(1 if failures else 0)
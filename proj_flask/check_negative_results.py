@@ -0,0 +1,68 @@
+import os
+import sys
+
+# the cache files are not written to in offline mode, see README.txt; set
+# before app_main is imported
+os.environ['TRAVEL_OFFLINE'] = '1'
+
+import stub_upstreams
+from stub_upstreams import start_stub_upstreams
+from app_main import get_city_location_info, lookup_negative_result, cache_counters, \
+    open_cache
+
+
+# run from the proj_flask directory, eg.
+#     python check_negative_results.py
+# looks up an alias that OpenTripMap does not know, then the city it stands
+# for, against the stub apis; fails if the miss of the alias is remembered
+# for the city, or if a miss is not remembered at all
+
+# an alias of city_names.BUILTIN_ALIASES, and the city it stands for, which
+# must not be in the checked-in city_location.json
+ALIAS, CITY = 'philly', 'Philadelphia'
+# a city the geoname stub does not know
+MISSING_CITY = 'Atlantis'
+
+
+def upstream_calls():
+    return cache_counters.get('city_location', {}).get('miss', 0)
+
+
+def check(failures, condition, message):
+    if not condition:
+        failures.append(message)
+
+
+if __name__ == '__main__':
+    if CITY.lower() in open_cache('city_location.json'):
+        sys.exit(f'{CITY} is cached, pick another alias')
+    # OpenTripMap knows the city by its name only
+    stub_upstreams.NOT_FOUND_CITIES.add(ALIAS)
+    servers = start_stub_upstreams(ports={'opentripmap': 0})
+    os.environ['TRAVEL_OPENTRIPMAP_URL'] = (
+        f"http://127.0.0.1:{servers['opentripmap'].server_address[1]}/0.1/en/places")
+    failures = []
+    try:
+        calls = upstream_calls()
+        check(failures, get_city_location_info(ALIAS) == {}, f'{ALIAS!r} was found')
+        check(failures, lookup_negative_result('city_location', ALIAS) == 'not_found',
+              f'the miss of {ALIAS!r} was not remembered')
+        check(failures, get_city_location_info(ALIAS) == {} and upstream_calls() == calls + 1,
+              f'{ALIAS!r} was searched again after missing')
+
+        location = get_city_location_info(CITY)
+        check(failures, location.get('name') == CITY,
+              f'{CITY!r} was not found after {ALIAS!r} missed: {location}')
+        check(failures, upstream_calls() == calls + 2, f'{CITY!r} was not searched')
+
+        calls = upstream_calls()
+        get_city_location_info(MISSING_CITY)
+        check(failures, get_city_location_info(MISSING_CITY) == {} and upstream_calls() == calls + 1,
+              f'the miss of {MISSING_CITY!r} was not remembered')
+    finally:
+        for server in servers.values():
+            server.shutdown()
+    for failure in failures:
+        print(f'FAIL {failure}')
+    print('ok' if not failures else f'{len(failures)} failed')
+    sys.exit(1 if failures else 0)
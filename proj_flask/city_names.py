@@ -0,0 +1,180 @@
+import re
+import sqlite3
+import unicodedata
+
+
+# abbreviations spelled out in canonical names, so "St. Louis", "st louis"
+# and "Saint Louis" are the same city
+WORD_ABBREVIATIONS = {'st': 'saint', 'ste': 'sainte', 'ft': 'fort', 'mt': 'mount',
+                      'pt': 'point'}
+
+# common names that none of our data sources spells out
+BUILTIN_ALIASES = {
+    'nyc': 'new york city',
+    'new york': 'new york city',
+    'ny': 'new york city',
+    'la': 'los angeles',
+    'sf': 'san francisco',
+    'san fran': 'san francisco',
+    'philly': 'philadelphia',
+    'vegas': 'las vegas',
+    'nola': 'new orleans',
+    'slc': 'salt lake city',
+    'okc': 'oklahoma city',
+    'kc': 'kansas city',
+    'dc': 'washington',
+    'washington dc': 'washington',
+}
+
+_possessive = re.compile(r"['\u2019]s\b")
+_punctuation = re.compile(r"[^\w\s]|_")
+_whitespace = re.compile(r'\s+')
+
+
+def normalize_city_name(city_name):
+    ''' fold a city name to its canonical form
+
+    Diacritics are removed, the name is lowercased, "'s" becomes "s", other
+    punctuation becomes spaces, runs of whitespace are collapsed and the
+    abbreviations in WORD_ABBREVIATIONS are spelled out, eg. "  Port St. Lucie"
+    and "port saint lucie" both become "port saint lucie".
+
+    Parameters
+    ----------
+    city_name: str
+        the name of the city as typed or as returned by an api
+
+    Returns
+    -------
+    str
+    '''
+
+    decomposed = unicodedata.normalize('NFKD', city_name)
+    without_marks = ''.join(c for c in decomposed if not unicodedata.combining(c))
+    without_possessive = _possessive.sub('s', without_marks.lower())
+    words = _whitespace.split(_punctuation.sub(' ', without_possessive).strip())
+    return ' '.join(WORD_ABBREVIATIONS.get(word, word) for word in words if word)
+
+
+def split_state_suffix(city_name):
+    ''' split a trailing state off a city name, eg. "Springfield, IL"
+
+    Parameters
+    ----------
+    city_name: str
+        the name of the city, optionally followed by a comma and a state name
+        or code
+
+    Returns
+    -------
+    tuple
+        the name of the city, and the state (None when there is none)
+    '''
+
+    name, comma, state = city_name.rpartition(',')
+    if comma and name.strip() and state.strip():
+        return name.strip(), state.strip()
+    return city_name, None
+
+
+class CityAliasIndex:
+    '''the canonical city ID of every known spelling of a city
+
+    Instance Attributes
+    -------------------
+    aliases: dict
+        normalized name -> canonical city ID, for the names whose ID differs
+        from their normalized form
+
+    known_cities: set
+        the canonical IDs of the cities in our database and caches
+    '''
+
+    def __init__(self):
+        self.aliases = {}
+        self.known_cities = set()
+
+    def __len__(self):
+        return len(self.aliases)
+
+    def add_city(self, city_name):
+        self.known_cities.add(normalize_city_name(city_name))
+
+    def add_alias(self, alias, city_name):
+        ''' make an alias resolve to the canonical ID of a city
+
+        Parameters
+        ----------
+        alias: str
+            another name of the city
+
+        city_name: str
+            the name of the city
+        '''
+
+        alias_id = normalize_city_name(alias)
+        city_id = self.resolve(city_name)
+        if alias_id and alias_id != city_id:
+            self.aliases[alias_id] = city_id
+
+    def resolve(self, city_name):
+        ''' get the canonical ID of a city name
+
+        Parameters
+        ----------
+        city_name: str
+            the name of the city, in any spelling
+
+        Returns
+        -------
+        str
+        '''
+
+        city_id = normalize_city_name(city_name)
+        return self.aliases.get(city_id, city_id)
+
+
+def build_city_alias_index(database_filename, city_locations, learned_aliases):
+    ''' build the alias index of all the cities we know about
+
+    Parameters
+    ----------
+    database_filename: str
+        the database with the cities_by_area and airports tables
+
+    city_locations: dict
+        the city location cache, whose entries hold the name of the city as
+        resolved by OpenTripMap
+
+    learned_aliases: dict
+        alias -> city name pairs learned from earlier OpenTripMap lookups
+
+    Returns
+    -------
+    CityAliasIndex
+    '''
+
+    index = CityAliasIndex()
+    for alias, city_name in BUILTIN_ALIASES.items():
+        index.add_alias(alias, city_name)
+    conn = sqlite3.connect(database_filename)
+    cur = conn.cursor()
+    cur.execute('SELECT CityName FROM cities_by_area')
+    for (city_name,) in cur:
+        index.add_city(city_name)
+    cur.execute('SELECT AirportCity FROM airports')
+    for (airport_city,) in cur:
+        # eg. "Fort Collins / Loveland", "Pullman / Moscow, ID"
+        for city_name in airport_city.split('/'):
+            index.add_city(city_name.split(',')[0])
+    conn.close()
+    for key, entry in city_locations.items():
+        if not isinstance(entry, dict) or not isinstance(entry.get('name'), str):
+            # an invalid entry, see cache_stats.py
+            continue
+        index.add_city(entry['name'])
+        index.add_alias(key, entry['name'])
+    for alias, city_name in learned_aliases.items():
+        if isinstance(city_name, str):
+            index.add_alias(alias, city_name)
+    return index
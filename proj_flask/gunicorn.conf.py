@@ -0,0 +1,28 @@
+import multiprocessing
+import os
+
+
+# production settings, run from this directory with:
+#     gunicorn -c gunicorn.conf.py
+# every setting can be overridden with an environment variable
+wsgi_app = 'wsgi:create_app()'
+chdir = os.path.dirname(os.path.abspath(__file__))
+bind = os.environ.get('TRAVEL_BIND', '127.0.0.1:8000')
+workers = int(os.environ.get('TRAVEL_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gthread'
+threads = int(os.environ.get('TRAVEL_THREADS', 4))
+# load the app and the caches once, before forking the workers
+preload_app = True
+pidfile = 'gunicorn.pid'
+# old workers get this long to finish in-flight requests on reload/shutdown
+graceful_timeout = int(os.environ.get('TRAVEL_GRACEFUL_TIMEOUT', 30))
+timeout = int(os.environ.get('TRAVEL_TIMEOUT', 60))
+max_requests = int(os.environ.get('TRAVEL_MAX_REQUESTS', 0))
+max_requests_jitter = max_requests // 10
+
+
+def post_worker_init(worker):
+    # the workers started by a reload (SIGHUP) are forked from the master
+    # loaded at start-up, pick up the caches rebuilt since then
+    from app_main import preload_caches
+    preload_caches()
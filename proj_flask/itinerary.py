@@ -0,0 +1,158 @@
+import time
+
+import numpy as np
+
+
+# the mean radius of the earth, in km, as in nearest_airports.py
+EARTH_RADIUS_KM = 6371.0088
+
+# the longest time spent improving a visiting order, in seconds; the best
+# order found by then is used
+TIME_BUDGET = 0.05
+
+
+def haversine_matrix(lats, lons):
+    ''' the great-circle distance between every two points
+
+    Parameters
+    ----------
+    lats: sequence
+        the latitudes of the points, in degrees
+
+    lons: sequence
+        the longitudes of the points, in degrees
+
+    Returns
+    -------
+    ndarray
+        n x n distances in km
+    '''
+
+    lats = np.radians(np.asarray(lats, dtype=float))
+    lons = np.radians(np.asarray(lons, dtype=float))
+    half_dlat = (lats[:, None] - lats[None, :]) / 2
+    half_dlon = (lons[:, None] - lons[None, :]) / 2
+    h = np.sin(half_dlat) ** 2 + np.cos(lats)[:, None] * np.cos(lats)[None, :] * np.sin(half_dlon) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(h, 0, 1)))
+
+
+def nearest_neighbor_tour(distances, start):
+    ''' a closed tour going from each point to the nearest one not visited
+
+    Parameters
+    ----------
+    distances: ndarray
+        n x n distances
+
+    start: int
+        the first point
+
+    Returns
+    -------
+    ndarray
+        the points in the order of the tour
+    '''
+
+    n = len(distances)
+    tour = np.empty(n, dtype=int)
+    visited = np.zeros(n, dtype=bool)
+    current = start
+    for position in range(n):
+        tour[position] = current
+        visited[current] = True
+        if position < n - 1:
+            current = int(np.argmin(np.where(visited, np.inf, distances[current])))
+    return tour
+
+
+def two_opt(tour, distances, deadline):
+    ''' shorten a closed tour by reversing the segments whose reversal
+    removes two crossing edges, until none is left or the deadline passes
+
+    For each first edge, every second edge is tried at once with numpy, and
+    the best reversal is made.
+
+    Parameters
+    ----------
+    tour: ndarray
+        the points in the order of the tour, changed in place
+
+    distances: ndarray
+        n x n distances
+
+    deadline: float
+        the time.perf_counter() to stop at
+
+    Returns
+    -------
+    bool
+        whether the tour is 2-optimal, False if the deadline stopped it
+    '''
+
+    n = len(tour)
+    improved = True
+    while improved:
+        improved = False
+        for i in range(n - 2):
+            if time.perf_counter() > deadline:
+                return False
+            a, b = tour[i], tour[i + 1]
+            # the edge after the last point is the one back to the first,
+            # which touches the edge (a, b) when i is 0
+            j = np.arange(i + 2, n if i > 0 else n - 1)
+            if len(j) == 0:
+                continue
+            c, d = tour[j], tour[(j + 1) % n]
+            gains = distances[a, b] + distances[c, d] - distances[a, c] - distances[b, d]
+            best = int(np.argmax(gains))
+            if gains[best] > 1e-9:
+                tour[i + 1:j[best] + 1] = tour[i + 1:j[best] + 1][::-1]
+                improved = True
+    return True
+
+
+def order_attractions(lats, lons, time_budget=TIME_BUDGET):
+    ''' a short order to visit the attractions in, starting and ending at
+    any of them
+
+    The path is found as a closed tour through the attractions and one more
+    point at distance 0 from all of them, which is then taken out: the
+    nearest-neighbor tour, improved by 2-opt within the time budget.
+
+    Parameters
+    ----------
+    lats: sequence
+        the latitudes of the attractions
+
+    lons: sequence
+        the longitudes of the attractions
+
+    time_budget: float
+        the longest time spent improving the order, in seconds
+
+    Returns
+    -------
+    dict
+        the order (indexes of the attractions), its length in km, and
+        whether it is 2-optimal or was stopped by the time budget
+    '''
+
+    deadline = time.perf_counter() + time_budget
+    n = len(lats)
+    if n < 3:
+        order = list(range(n))
+        length = float(haversine_matrix(lats, lons)[0, 1]) if n == 2 else 0.0
+        return {'order': order, 'distance_km': length, 'complete': True}
+    distances = np.zeros((n + 1, n + 1))
+    distances[:n, :n] = haversine_matrix(lats, lons)
+    # the tour starts at the extra point, whose nearest attraction (all at
+    # distance 0) is replaced by the one farthest from the others, a likely
+    # end of the path
+    tour = np.empty(n + 1, dtype=int)
+    tour[0] = n
+    tour[1:] = nearest_neighbor_tour(distances[:n, :n], int(np.argmax(distances[:n, :n].sum(axis=1))))
+    complete = two_opt(tour, distances, deadline)
+    start = int(np.flatnonzero(tour == n)[0])
+    order = np.concatenate((tour[start + 1:], tour[:start]))
+    length = float(distances[order[:-1], order[1:]].sum())
+    return {'order': order.tolist(), 'distance_km': length, 'complete': complete}
@@ -0,0 +1,356 @@
+import argparse
+import json
+import os
+import random
+import shutil
+import signal
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+import requests
+
+from stub_upstreams import start_stub_upstreams
+from upstream import STUB_PORTS
+
+
+# run from the proj_flask directory, eg.
+#     python load_test.py --workers 1,2,4 --duration 30 --concurrency 16
+#     python load_test.py --mix index=1,attractions=4,hotels=3,tickets=2 --latency-ms 150
+# starts the stub apis, then for each worker count starts the app in offline
+# mode (gunicorn if installed), sends the request mix to it from concurrent
+# clients, and reports the throughput and the latency of each route
+
+# the routes of the mix, and the weight of each by default
+DEFAULT_MIX = {'index': 1, 'attractions': 4, 'hotels': 3, 'tickets': 2}
+
+DATABASE_FILENAME = './database/airport_database.sqlite'
+
+
+class Workload:
+    '''random requests drawn from what the cache files and the database hold
+
+    The cities are drawn as often as they appear in the attraction cache,
+    each with one or two of the attraction types cached for it, the hotel
+    searches from the attractions in the hotel cache, and the flights from
+    the cities of the airports table.
+
+    Instance Attributes
+    -------------------
+    mix: dict
+        route name -> weight
+
+    seed: int
+        the seed of the random generator of each client
+    '''
+
+    def __init__(self, mix, seed=0):
+        self.mix = mix
+        self.seed = seed
+        with open('city_location_attraction.json', 'r') as fr:
+            attraction_keys = list(json.load(fr))
+        self._city_types = defaultdict(list)
+        for key in attraction_keys:
+            city_name, attraction_type = key.split('_', 1)
+            if '_page_' not in attraction_type:
+                self._city_types[city_name].append(attraction_type)
+        # one entry per cached (city, type): the popular cities come up more
+        self._cities = [city for city, types in self._city_types.items() for _ in types]
+        with open('hotels_cache.json', 'r') as fr:
+            self._hotel_positions = []
+            for key in json.load(fr):
+                # lon_{lon}_and_lat_{lat}
+                _, lon, _, _, lat = key.split('_')
+                self._hotel_positions.append((float(lat), float(lon)))
+        conn = sqlite3.connect(DATABASE_FILENAME)
+        self._airport_cities = [city for (city,) in conn.execute('SELECT AirportCity FROM airports')]
+        conn.close()
+
+    def random_generator(self, client_number):
+        return random.Random(self.seed * 1000 + client_number)
+
+    def next_request(self, rng):
+        ''' draw the next request
+
+        Parameters
+        ----------
+        rng: random.Random
+            the random generator of the client
+
+        Returns
+        -------
+        tuple
+            the route name, the HTTP method, the path and the form data
+        '''
+
+        route = rng.choices(list(self.mix), weights=list(self.mix.values()))[0]
+        if route == 'index':
+            return route, 'GET', '/', None
+        if route == 'attractions':
+            city = rng.choice(self._cities)
+            types = self._city_types[city]
+            return route, 'POST', '/attractions_and_weathers_city_exist_attractions_not_empty', {
+                'city_name': city,
+                'attraction_type': rng.sample(types, min(len(types), rng.choice([1, 1, 2]))),
+                'presentation_type': rng.choice(['in_table', 'on_map'])}
+        if route == 'hotels':
+            lat, lon = rng.choice(self._hotel_positions)
+            return route, 'POST', '/find_hotels_exists', {
+                'attr_choice': f'{lat}, {lon}, attraction',
+                'hotel_presentation_type': rng.choice(['in_table', 'in_bar_plot'])}
+        return route, 'POST', '/buying_air_tickets', {
+            'dep_city_name': rng.choice(self._airport_cities),
+            'des_city_name': rng.choice(self._airport_cities),
+            'month': f'{rng.randint(1, 12):02d}',
+            'day': f'{rng.randint(1, 28):02d}'}
+
+
+def percentile(sorted_values, share):
+    ''' the nearest-rank percentile of sorted values, None if there are none
+    '''
+
+    if not sorted_values:
+        return None
+    position = max(0, min(len(sorted_values) - 1, int(round(share * len(sorted_values))) - 1))
+    return sorted_values[position]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def serve_prefork(port, workers):
+    ''' serve the app from several forked werkzeug servers sharing one socket,
+    like gunicorn does, for machines without gunicorn
+
+    Parameters
+    ----------
+    port: int
+        the port to listen on
+
+    workers: int
+        the number of worker processes
+
+    Returns
+    -------
+    None
+    '''
+
+    from werkzeug.serving import make_server
+    from wsgi import create_app
+
+    app = create_app()
+    listener = socket.socket()
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(('127.0.0.1', port))
+    listener.listen(128)
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            make_server('127.0.0.1', port, app, threaded=True, fd=listener.fileno()).serve_forever()
+            os._exit(0)
+        children.append(pid)
+    # terminating the server stops its workers too
+    signal.signal(signal.SIGTERM, lambda signal_number, frame: sys.exit(0))
+    try:
+        for pid in children:
+            os.waitpid(pid, 0)
+    finally:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+
+def start_app(workers, threads, port, stub_servers):
+    ''' start the app in offline mode, against the stub apis
+
+    Parameters
+    ----------
+    workers: int
+        the number of worker processes
+
+    threads: int
+        the number of threads of each gunicorn worker
+
+    port: int
+        the port to listen on
+
+    stub_servers: dict
+        the running stub server of each api
+
+    Returns
+    -------
+    tuple
+        the server process, and a description of the server
+    '''
+
+    environment = dict(os.environ, TRAVEL_OFFLINE='1', TRAVEL_WORKERS=str(workers),
+                       TRAVEL_THREADS=str(threads), TRAVEL_BIND=f'127.0.0.1:{port}')
+    for upstream, server in stub_servers.items():
+        stub_port = server.server_address[1]
+        path = {'opentripmap': '/0.1/en/places', 'weatherunlocked': '/api', 'yelp': '/v3'}[upstream]
+        environment[f'TRAVEL_{upstream.upper()}_URL'] = f'http://127.0.0.1:{stub_port}{path}'
+    if shutil.which('gunicorn'):
+        # a pid file of its own, not the one of a production server
+        pid_filename = os.path.join(tempfile.gettempdir(), f'load_test_{port}.pid')
+        command = ['gunicorn', '-c', 'gunicorn.conf.py', '--pid', pid_filename]
+        description = f'gunicorn, {workers} workers x {threads} threads'
+    else:
+        command = [sys.executable, '-c',
+                   f'import load_test; load_test.serve_prefork({port}, {workers})']
+        description = f'werkzeug pre-fork (gunicorn not installed), {workers} workers'
+    process = subprocess.Popen(command, env=environment, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'the app exited with {process.returncode}: {" ".join(command)}')
+        try:
+            if requests.get(f'http://127.0.0.1:{port}/readyz', timeout=1).status_code == 200:
+                return process, description
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError('the app was not ready after 60 seconds')
+
+
+def run_clients(base_url, workload, concurrency, duration, timeout):
+    ''' send requests from concurrent clients, each waiting for its response
+    before sending the next one
+
+    Returns
+    -------
+    dict
+        route name -> list of (latency in seconds, whether it failed)
+    '''
+
+    results = defaultdict(list)
+    results_lock = threading.Lock()
+    stop_at = time.monotonic() + duration
+
+    def client(client_number):
+        rng = workload.random_generator(client_number)
+        session = requests.Session()
+        own_results = []
+        while time.monotonic() < stop_at:
+            route, method, path, form = workload.next_request(rng)
+            start = time.perf_counter()
+            try:
+                response = session.request(method, base_url + path, data=form, timeout=timeout)
+                # the app answers "not found" pages with 200, failures with 5xx
+                failed = response.status_code >= 500
+            except requests.RequestException:
+                failed = True
+            own_results.append((route, time.perf_counter() - start, failed))
+        with results_lock:
+            for route, latency, failed in own_results:
+                results[route].append((latency, failed))
+
+    clients = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    return results
+
+
+def summarize(results, duration):
+    ''' the throughput, error rate and latency percentiles of each route
+
+    Returns
+    -------
+    dict
+        route name (and 'all') -> statistics, the latencies in milliseconds
+    '''
+
+    summary = {}
+    everything = [result for route_results in results.values() for result in route_results]
+    for route, route_results in sorted(results.items()) + [('all', everything)]:
+        latencies = sorted(latency * 1000 for latency, _ in route_results)
+        errors = sum(failed for _, failed in route_results)
+        summary[route] = {'requests': len(route_results),
+                          'throughput_rps': round(len(route_results) / duration, 2),
+                          'error_rate': round(errors / len(route_results), 4) if route_results else 0.0}
+        for name, share in (('p50_ms', 0.5), ('p95_ms', 0.95), ('p99_ms', 0.99), ('max_ms', 1.0)):
+            value = percentile(latencies, share)
+            summary[route][name] = None if value is None else round(value, 2)
+    return summary
+
+
+def print_summary(workers, description, summary):
+    print(f'\n{workers} workers ({description})')
+    print(f"{'route':<12}{'requests':>10}{'req/s':>10}{'errors':>9}{'p50 ms':>10}"
+          f"{'p95 ms':>10}{'p99 ms':>10}")
+    for route, stats in summary.items():
+        print(f"{route:<12}{stats['requests']:>10}{stats['throughput_rps']:>10}"
+              f"{stats['error_rate']:>9.2%}{stats['p50_ms'] or 0:>10}{stats['p95_ms'] or 0:>10}"
+              f"{stats['p99_ms'] or 0:>10}")
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        route, _, weight = part.partition('=')
+        if route.strip() not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f'unknown route {route!r}, one of {list(DEFAULT_MIX)}')
+        mix[route.strip()] = float(weight or 1)
+    return mix
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='load test the app against the stub apis')
+    parser.add_argument('--workers', default='1,2,4',
+                        help='comma separated worker counts to compare (default 1,2,4)')
+    parser.add_argument('--threads', type=int, default=4, help='threads per gunicorn worker')
+    parser.add_argument('--concurrency', type=int, default=16, help='concurrent clients')
+    parser.add_argument('--duration', type=float, default=20.0, help='seconds per worker count')
+    parser.add_argument('--warmup', type=float, default=3.0, help='seconds before measuring')
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                        help='route weights, eg. index=1,attractions=4,hotels=3,tickets=2')
+    parser.add_argument('--latency-ms', type=float, default=100.0, help='latency of the stub apis')
+    parser.add_argument('--jitter-ms', type=float, default=50.0)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='error rate of the stub apis')
+    parser.add_argument('--timeout', type=float, default=30.0, help='client timeout, in seconds')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the json report to this file')
+    args = parser.parse_args()
+
+    workload = Workload(args.mix, args.seed)
+    stub_servers = start_stub_upstreams(args.latency_ms, args.jitter_ms, args.error_rate,
+                                        ports={upstream: 0 for upstream in STUB_PORTS})
+    report = {'settings': {name: value for name, value in vars(args).items() if name != 'output'},
+              'runs': []}
+    for workers in [int(count) for count in args.workers.split(',')]:
+        port = free_port()
+        process, description = start_app(workers, args.threads, port, stub_servers)
+        try:
+            base_url = f'http://127.0.0.1:{port}'
+            if args.warmup > 0:
+                run_clients(base_url, workload, args.concurrency, args.warmup, args.timeout)
+            results = run_clients(base_url, workload, args.concurrency, args.duration, args.timeout)
+        finally:
+            process.terminate()
+            process.wait()
+        summary = summarize(results, args.duration)
+        print_summary(workers, description, summary)
+        report['runs'].append({'workers': workers, 'server': description, 'routes': summary})
+
+    if len(report['runs']) > 1:
+        base = report['runs'][0]['routes']['all']['throughput_rps']
+        print('\nscaling of the throughput: ' + ', '.join(
+            f"{run['workers']} workers x{run['routes']['all']['throughput_rps'] / base:.2f}"
+            for run in report['runs'] if base))
+    if args.output:
+        with open(args.output, 'w') as fw:
+            json.dump(report, fw, indent=2)
@@ -0,0 +1,143 @@
+import argparse
+import contextlib
+import gc
+import json
+import linecache
+import sys
+import tracemalloc
+
+# sets offline mode before app_main is imported, see benchmark_hot_paths.py
+from benchmark_hot_paths import route_requests, check_response
+from app_main import app, preload_caches
+
+
+# run from the proj_flask directory, eg.
+#     python memory_budget.py
+#     python memory_budget.py --top 10 --json
+# sends each request of the route benchmarks under tracemalloc and reports the
+# peak memory allocated while answering it, and the memory still allocated
+# after it, with the source lines allocating the most. Exits with 1 if a
+# route goes over its budget.
+
+# the budget of each route, in KiB: the peak allocated while answering the
+# request, and what is still allocated after ROUNDS more requests (a leak
+# grows with every request)
+ROUTE_BUDGETS = {
+    'GET /': {'peak_kib': 128, 'retained_kib': 32},
+    'POST attractions (table)': {'peak_kib': 1280, 'retained_kib': 64},
+    'POST attractions (map)': {'peak_kib': 1536, 'retained_kib': 64},
+    'POST hotels (plot)': {'peak_kib': 1024, 'retained_kib': 64},
+    'GET suggest': {'peak_kib': 64, 'retained_kib': 16},
+    'POST tickets': {'peak_kib': 384, 'retained_kib': 32},
+    'POST ticket urls (100 pairs)': {'peak_kib': 512, 'retained_kib': 32},
+}
+
+# the number of requests whose retained memory is measured
+ROUNDS = 5
+
+
+def format_line(statistic):
+    frame = statistic.traceback[0]
+    source = linecache.getline(frame.filename, frame.lineno).strip()
+    return {'line': f'{frame.filename}:{frame.lineno}', 'source': source,
+            'kib': round(statistic.size_diff / 1024, 1), 'count': statistic.count_diff}
+
+
+def measure_route(name, make_request, top):
+    ''' the peak and retained allocations of a request
+
+    Parameters
+    ----------
+    name: str
+        the name of the route benchmark, see route_requests
+
+    make_request: function
+        sends the request, returns the response
+
+    top: int
+        the number of source lines to report
+
+    Returns
+    -------
+    dict
+        the peak and retained KiB, and the source lines allocating the most
+        during one request and still holding the most after ROUNDS requests
+    '''
+
+    gc.collect()
+
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        baseline, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        response = make_request()
+        _, peak = tracemalloc.get_traced_memory()
+        during = tracemalloc.take_snapshot()
+        check_response(name, response)
+        del response
+        for _ in range(ROUNDS - 1):
+            make_request()
+        gc.collect()
+        retained, _ = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+
+    filters = [tracemalloc.Filter(False, tracemalloc.__file__),
+               tracemalloc.Filter(False, '<frozen importlib._bootstrap>')]
+    allocated_lines = during.filter_traces(filters).compare_to(before.filter_traces(filters), 'lineno')
+    retained_lines = after.filter_traces(filters).compare_to(before.filter_traces(filters), 'lineno')
+    return {'peak_kib': round((peak - baseline) / 1024, 1),
+            'retained_kib': round((retained - baseline) / 1024, 1),
+            'top_allocating_lines': [format_line(statistic)
+                                     for statistic in allocated_lines[:top] if statistic.size_diff > 0],
+            'top_retaining_lines': [format_line(statistic)
+                                    for statistic in retained_lines[:top] if statistic.size_diff > 0]}
+
+
+def print_report(report):
+    for name, result in report.items():
+        status = 'OVER BUDGET' if result['over_budget'] else 'ok'
+        print('+--------------------------------+')
+        print(f"{name}: peak {result['peak_kib']} KiB (budget {result['budget']['peak_kib']}), "
+              f"retained {result['retained_kib']} KiB (budget {result['budget']['retained_kib']})"
+              f" -- {status}")
+        for line in result['top_allocating_lines']:
+            print(f"    allocating {line['kib']:>8} KiB  {line['line']}  {line['source']}")
+        for line in result['top_retaining_lines']:
+            print(f"    retaining  {line['kib']:>8} KiB  {line['line']}  {line['source']}")
+    print('+--------------------------------+')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='check the memory allocated by each route')
+    parser.add_argument('--top', type=int, default=5, help='the number of source lines to report')
+    parser.add_argument('--json', action='store_true', help='print the report as json')
+    parser.add_argument('--budget-scale', type=float, default=1.0,
+                        help='multiply every budget, eg. 0.5 to tighten them')
+    args = parser.parse_args()
+
+    # the app prints 'cache'/'fetch' on every lookup, keep stdout for the report
+    with contextlib.redirect_stdout(sys.stderr):
+        preload_caches()
+        requests_to_measure = route_requests(app.test_client())
+        # the first requests fill the caches, compile the templates and let
+        # plotly create its classes, which is not the cost of a request
+        for _ in range(2):
+            for name, make_request in requests_to_measure.items():
+                check_response(name, make_request())
+        report = {}
+        for name, make_request in requests_to_measure.items():
+            result = measure_route(name, make_request, args.top)
+            budget = {kind: limit * args.budget_scale for kind, limit in ROUTE_BUDGETS[name].items()}
+            result['budget'] = budget
+            result['over_budget'] = (result['peak_kib'] > budget['peak_kib']
+                                     or result['retained_kib'] > budget['retained_kib'])
+            report[name] = result
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+    if any(result['over_budget'] for result in report.values()):
+        sys.exit(1)
@@ -0,0 +1,279 @@
+import bisect
+import functools
+import os
+import threading
+import time
+from contextlib import nullcontext
+
+from flask import g, has_request_context, request
+
+
+# TRAVEL_METRICS=1 times every request and each stage of it (cache loads,
+# database lookups, api calls, plots, templates) into the histograms below,
+# exported with the cache counters on /metrics. Otherwise stage() returns a
+# shared no-op context manager and only the upstream calls are counted.
+ENABLED = os.environ.get('TRAVEL_METRICS') == '1'
+
+# upper bounds of the latency buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_no_timing = nullcontext()
+
+
+class Histogram:
+    '''a Prometheus histogram with labels, kept in this process
+
+    Instance Attributes
+    -------------------
+    name: str
+        the metric name
+
+    documentation: str
+        the help text of the metric
+
+    label_names: tuple
+        the names of the labels, in the order of the label values
+
+    buckets: tuple
+        the upper bounds of the buckets, in increasing order
+    '''
+
+    def __init__(self, name, documentation, label_names, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        # label values -> [count per bucket (not cumulative), sum, count]
+        self._series = {}
+
+    def observe(self, label_values, value):
+        ''' add an observation
+
+        Parameters
+        ----------
+        label_values: tuple
+            the values of the labels
+
+        value: float
+            the observed value, eg. seconds
+
+        Returns
+        -------
+        None
+        '''
+
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][position] += 1
+            series[1] += value
+            series[2] += 1
+
+    def exposition(self):
+        ''' the lines of the metric in the Prometheus text format
+        '''
+
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted((labels, [list(counts), total, count])
+                            for labels, (counts, total, count) in self._series.items())
+        for label_values, (counts, total, count) in series:
+            labels = format_labels(self.label_names, label_values)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                bucket_labels = format_labels(self.label_names + ('le',),
+                                              label_values + (str(bound),))
+                lines.append(f'{self.name}_bucket{bucket_labels} {cumulative}')
+            lines.append(f'{self.name}_sum{labels} {total}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+def format_labels(label_names, label_values):
+    ''' the {name="value",...} part of a Prometheus sample
+    '''
+
+    if not label_names:
+        return ''
+    pairs = []
+    for name, value in zip(label_names, label_values):
+        escaped = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{escaped}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+def counter_lines(name, documentation, label_names, counts):
+    ''' the lines of a Prometheus counter
+
+    Parameters
+    ----------
+    name: str
+        the metric name
+
+    documentation: str
+        the help text
+
+    label_names: tuple
+        the names of the labels
+
+    counts: dict
+        label values (tuple) -> count
+
+    Returns
+    -------
+    list
+    '''
+
+    lines = [f'# HELP {name} {documentation}', f'# TYPE {name} counter']
+    for label_values, count in sorted(counts.items()):
+        lines.append(f'{name}{format_labels(label_names, label_values)} {count}')
+    return lines
+
+
+request_seconds = Histogram('travel_request_seconds', 'time to answer a request',
+                            ('route', 'status'))
+stage_seconds = Histogram('travel_stage_seconds', 'time spent in each stage of a request',
+                          ('route', 'stage'))
+upstream_seconds = Histogram('travel_upstream_seconds', 'time of the upstream api calls',
+                             ('upstream', 'outcome'))
+
+
+def current_route():
+    ''' the endpoint of the request being served, 'background' off requests
+    '''
+
+    if has_request_context():
+        return request.endpoint or 'unknown'
+    return 'background'
+
+
+class StageTimer:
+    '''times one stage of the current request into stage_seconds
+
+    Instance Attributes
+    -------------------
+    name: str
+        the name of the stage
+    '''
+
+    def __init__(self, name):
+        self.name = name
+        self._start = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        stage_seconds.observe((current_route(), self.name), time.perf_counter() - self._start)
+        return False
+
+
+def stage(name):
+    ''' a context manager timing a stage of the current request, eg.
+
+        with metrics.stage('render'):
+            html = render_template(...)
+
+    Parameters
+    ----------
+    name: str
+        the name of the stage
+
+    Returns
+    -------
+    a context manager, which does nothing when metrics are disabled
+    '''
+
+    if not ENABLED:
+        return _no_timing
+    return StageTimer(name)
+
+
+def timed(name):
+    ''' a decorator timing each call of a function as a stage, eg.
+
+        @metrics.timed('plot')
+        def plot_hotels_price_and_rating(hotel_list):
+
+    When metrics are disabled the function is returned as it is, so the
+    decorator costs nothing.
+
+    Parameters
+    ----------
+    name: str
+        the name of the stage
+
+    Returns
+    -------
+    function
+    '''
+
+    def decorate(function):
+        if not ENABLED:
+            return function
+
+        @functools.wraps(function)
+        def timed_function(*args, **kwargs):
+            with StageTimer(name):
+                return function(*args, **kwargs)
+        return timed_function
+    return decorate
+
+
+def observe_upstream_call(upstream, succeeded, elapsed):
+    ''' record an upstream api call, as a stage of the current request too
+
+    Parameters
+    ----------
+    upstream: str
+        the name of the upstream api
+
+    succeeded: bool
+        whether the call returned a valid response
+
+    elapsed: float
+        how long the call took, in seconds
+
+    Returns
+    -------
+    None
+    '''
+
+    # always counted, it is nothing next to the call itself
+    upstream_seconds.observe((upstream, 'ok' if succeeded else 'error'), elapsed)
+    if ENABLED:
+        stage_seconds.observe((current_route(), upstream), elapsed)
+
+
+def init_app(app):
+    ''' time every request of the app, if metrics are enabled
+
+    Parameters
+    ----------
+    app: Flask
+        the app
+
+    Returns
+    -------
+    None
+    '''
+
+    if not ENABLED:
+        return
+
+    @app.before_request
+    def start_request_timer():
+        g.request_started_at = time.perf_counter()
+
+    @app.after_request
+    def stop_request_timer(response):
+        started_at = g.pop('request_started_at', None)
+        if started_at is not None:
+            request_seconds.observe((current_route(), str(response.status_code)),
+                                    time.perf_counter() - started_at)
+        return response
@@ -0,0 +1,140 @@
+import heapq
+import math
+import sqlite3
+
+
+# the mean radius of the earth, in km
+EARTH_RADIUS_KM = 6371.0088
+
+# the most airports in a leaf of the tree, which are compared one by one
+LEAF_SIZE = 8
+
+# the airports with coordinates, see airport_locations in construct_db.py
+AIRPORT_LOCATIONS_QUERY = '''
+SELECT AirportCode, AirportName, AirportCity, StateName, Latitude, Longitude
+FROM airports
+JOIN airport_locations USING (AirportCode)
+JOIN states ON airports.AirportState=states.StateCode
+'''
+
+
+def unit_vector(lat, lon):
+    ''' the point of the unit sphere at a latitude and longitude, in degrees
+
+    The straight-line distance between two such points grows with their
+    great-circle distance, so the tree can search in 3-d without caring
+    where the longitudes wrap around (eg. the Aleutian Islands).
+    '''
+
+    lat, lon = math.radians(lat), math.radians(lon)
+    return (math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon), math.sin(lat))
+
+
+def chord_to_km(chord):
+    ''' the great-circle distance of two points of the unit sphere, in km,
+    from the straight-line distance between them
+    '''
+
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, chord / 2))
+
+
+class AirportTree:
+    '''a k-d tree of the airports on the unit sphere, to find the airports
+    nearest to a position
+
+    Instance Attributes
+    -------------------
+    airports: list
+        (code, name, city, state name, latitude, longitude) of each airport
+    '''
+
+    def __init__(self, airports):
+        self.airports = list(airports)
+        self._points = [unit_vector(airport[4], airport[5]) for airport in self.airports]
+        self._root = self._build(list(range(len(self.airports))))
+
+    def __len__(self):
+        return len(self.airports)
+
+    def _build(self, indexes):
+        # a leaf is a list of airport indexes, a node is (axis, split, left
+        # subtree, right subtree) with the points below split on the left.
+        # The airports lie on a small patch of the sphere, so the axis is the
+        # one they spread the most along.
+        if len(indexes) <= LEAF_SIZE:
+            return indexes
+        axis = max(range(3), key=lambda axis: (max(self._points[index][axis] for index in indexes)
+                                               - min(self._points[index][axis] for index in indexes)))
+        indexes.sort(key=lambda index: self._points[index][axis])
+        middle = len(indexes) // 2
+        return (axis, self._points[indexes[middle]][axis],
+                self._build(indexes[:middle]), self._build(indexes[middle:]))
+
+    def _search(self, node, target, k, heap):
+        # heap holds (-squared distance, airport index) of the k nearest so far
+        if isinstance(node, list):
+            for index in node:
+                point = self._points[index]
+                squared_distance = ((point[0] - target[0]) ** 2 + (point[1] - target[1]) ** 2
+                                    + (point[2] - target[2]) ** 2)
+                if len(heap) < k:
+                    heapq.heappush(heap, (-squared_distance, index))
+                elif squared_distance < -heap[0][0]:
+                    heapq.heapreplace(heap, (-squared_distance, index))
+            return
+        axis, split, left, right = node
+        difference = target[axis] - split
+        near, far = (left, right) if difference < 0 else (right, left)
+        self._search(near, target, k, heap)
+        if len(heap) < k or difference * difference < -heap[0][0]:
+            self._search(far, target, k, heap)
+
+    def nearest(self, lat, lon, k=3):
+        ''' the k airports nearest to a position
+
+        Parameters
+        ----------
+        lat: float
+            the latitude of the position
+
+        lon: float
+            the longitude of the position
+
+        k: int
+            the number of airports to return
+
+        Returns
+        -------
+        list
+            (distance in km, airport) pairs, nearest first, where airport is
+            an item of self.airports
+        '''
+
+        heap = []
+        self._search(self._root, unit_vector(lat, lon), k, heap)
+        return [(chord_to_km(math.sqrt(-negative_squared_distance)), self.airports[index])
+                for negative_squared_distance, index in sorted(heap, reverse=True)]
+
+
+def load_airport_tree(database_filename):
+    ''' build the tree of the airports with coordinates in the database
+
+    Parameters
+    ----------
+    database_filename: str
+        the database, with the airport_locations table of construct_db.py
+
+    Returns
+    -------
+    AirportTree
+        empty if the database has no airport locations
+    '''
+
+    conn = sqlite3.connect(database_filename)
+    try:
+        airports = conn.execute(AIRPORT_LOCATIONS_QUERY).fetchall()
+    except sqlite3.OperationalError:
+        # a database built before the airport locations
+        airports = []
+    conn.close()
+    return AirportTree(airports)
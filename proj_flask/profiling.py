@@ -0,0 +1,203 @@
+import collections
+import cProfile
+import glob
+import os
+import sys
+import threading
+import time
+
+from flask import g, request
+
+
+# profiling of single requests, off unless both TRAVEL_PROFILE_DIR and
+# TRAVEL_ADMIN_TOKEN are set. A request asks for it with an "X-Profile: 1"
+# header or a "profile=1" query parameter, and must carry the admin token (see
+# admin_authorized in app_main.py). Each profiled request writes two files to TRAVEL_PROFILE_DIR:
+#     <time>_<route>_<pid>.pstats     cProfile stats, eg. for snakeviz or pstats
+#     <time>_<route>_<pid>.collapsed  sampled stacks, one "a;b;c count" line per
+#                                     stack, for flamegraph.pl or speedscope
+PROFILE_DIR = os.environ.get('TRAVEL_PROFILE_DIR')
+# at most this many profiled requests per minute in each process, one at a
+# time, and this many profiles kept in the directory (the oldest are removed)
+MAX_PROFILES_PER_MINUTE = int(os.environ.get('TRAVEL_PROFILE_MAX_PER_MINUTE', 6))
+MAX_PROFILE_FILES = int(os.environ.get('TRAVEL_PROFILE_MAX_FILES', 100))
+# how often the stack of the profiled request is sampled, in seconds
+SAMPLE_INTERVAL = 0.002
+
+
+class StackSampler:
+    '''samples the stack of one thread on a background thread
+
+    Instance Attributes
+    -------------------
+    thread_id: int
+        the ident of the thread to sample
+
+    interval: float
+        the time between two samples, in seconds
+
+    stacks: Counter
+        collapsed stack ("outer;...;inner") -> number of samples
+    '''
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            if names:
+                self.stacks[';'.join(reversed(names))] += 1
+
+    def write_collapsed(self, filename):
+        with open(filename, 'w') as fw:
+            for stack, count in self.stacks.most_common():
+                fw.write(f'{stack} {count}\n')
+
+
+class ProfileLimiter:
+    '''lets at most max_per_minute profiles start in any minute, one at a time
+
+    Instance Attributes
+    -------------------
+    max_per_minute: int
+        the maximum number of profiles started in any 60 seconds
+    '''
+
+    def __init__(self, max_per_minute):
+        self.max_per_minute = max_per_minute
+        self._lock = threading.Lock()
+        self._started = collections.deque()
+        self._running = False
+
+    def acquire(self):
+        ''' take a profiling slot, if there is one
+
+        Returns
+        -------
+        bool
+        '''
+
+        now = time.monotonic()
+        with self._lock:
+            while self._started and now - self._started[0] > 60:
+                self._started.popleft()
+            if self._running or len(self._started) >= self.max_per_minute:
+                return False
+            self._started.append(now)
+            self._running = True
+            return True
+
+    def release(self):
+        with self._lock:
+            self._running = False
+
+
+limiter = ProfileLimiter(MAX_PROFILES_PER_MINUTE)
+
+
+def profile_requested():
+    return (request.headers.get('X-Profile') == '1'
+            or request.args.get('profile') == '1')
+
+
+def remove_old_profiles():
+    ''' keep the MAX_PROFILE_FILES newest profiles of PROFILE_DIR
+    '''
+
+    profiles = sorted(glob.glob(os.path.join(PROFILE_DIR, '*.pstats')), key=os.path.getmtime)
+    for filename in profiles[:max(0, len(profiles) - MAX_PROFILE_FILES)]:
+        for old_filename in (filename, os.path.splitext(filename)[0] + '.collapsed'):
+            try:
+                os.remove(old_filename)
+            except OSError:
+                pass
+
+
+def init_app(app, authorized):
+    ''' profile the requests that ask for it, if TRAVEL_PROFILE_DIR and
+    TRAVEL_ADMIN_TOKEN are set
+
+    Parameters
+    ----------
+    app: Flask
+        the app
+
+    authorized: function
+        called in the request context, returns whether the request may be
+        profiled
+
+    Returns
+    -------
+    None
+    '''
+
+    if not PROFILE_DIR:
+        return
+    if not os.environ.get('TRAVEL_ADMIN_TOKEN'):
+        # no request could be authorized, see admin_authorized in app_main.py
+        print('TRAVEL_PROFILE_DIR is ignored without TRAVEL_ADMIN_TOKEN', file=sys.stderr)
+        return
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+
+    @app.before_request
+    def start_profile():
+        if not profile_requested():
+            return
+        if not authorized():
+            g.profile_skipped = 'not authorized'
+            return
+        if not limiter.acquire():
+            g.profile_skipped = 'rate limited'
+            return
+        g.stack_sampler = StackSampler(threading.get_ident())
+        g.profiler = cProfile.Profile()
+        g.stack_sampler.start()
+        g.profiler.enable()
+
+    @app.after_request
+    def stop_profile(response):
+        if 'profile_skipped' in g:
+            response.headers['X-Profile-Skipped'] = g.profile_skipped
+        profiler = g.pop('profiler', None)
+        if profiler is None:
+            return response
+        profiler.disable()
+        stack_sampler = g.pop('stack_sampler')
+        stack_sampler.stop()
+        try:
+            now = time.time()
+            basename = (f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(now))}"
+                        f"-{int(now * 1000) % 1000:03d}_{request.endpoint}_{os.getpid()}")
+            profiler.dump_stats(os.path.join(PROFILE_DIR, basename + '.pstats'))
+            stack_sampler.write_collapsed(os.path.join(PROFILE_DIR, basename + '.collapsed'))
+            remove_old_profiles()
+        finally:
+            limiter.release()
+        response.headers['X-Profile-File'] = basename
+        return response
+
+    @app.teardown_request
+    def release_profile(exception):
+        # the request failed before after_request
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            g.pop('stack_sampler').stop()
+            limiter.release()
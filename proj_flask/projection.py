@@ -0,0 +1,147 @@
+import os
+import sys
+
+
+# version of the minimal schema the cached responses are projected to, stored
+# in every projected entry under '_schema'
+SCHEMA_VERSION = 1
+
+# the fields of a Yelp business read by show_hotels
+HOTEL_FIELDS = ('name', 'price', 'rating', 'url', 'review_count', 'display_phone')
+
+# the fields of an OpenTripMap place read by show_attractions_and_weathers
+ATTRACTION_FIELDS = ('xid', 'name', 'rate', 'point')
+
+
+def project_fields(record, fields):
+    ''' keep only the given fields of a record
+
+    Parameters
+    ----------
+    record: dict
+        a record from an api response
+
+    fields: tuple
+        the names of the fields to keep, missing fields stay missing
+
+    Returns
+    -------
+    dict
+    '''
+
+    return {field: record[field] for field in fields if field in record}
+
+
+def project_hotels_response(response):
+    ''' project a Yelp business search response to the fields we use
+
+    An error body (without 'businesses') is returned unchanged so that it is
+    not mistaken for an empty result.
+
+    Parameters
+    ----------
+    response: dict
+        the raw or already projected response
+
+    Returns
+    -------
+    dict
+    '''
+
+    if not isinstance(response, dict) or 'businesses' not in response:
+        return response
+    if response.get('_schema') == SCHEMA_VERSION:
+        # already projected, and maybe stamped with its '_fetched_at'
+        return response
+    return {'_schema': SCHEMA_VERSION,
+            'businesses': [project_fields(business, HOTEL_FIELDS)
+                           for business in response['businesses']]}
+
+
+def project_attractions_response(response):
+    ''' project an OpenTripMap radius response to the fields we use
+
+    Parameters
+    ----------
+    response: list or dict
+        the raw response (a list of places), or an already projected entry
+
+    Returns
+    -------
+    dict, or the response unchanged if it is an error body
+    '''
+
+    if isinstance(response, dict) and response.get('_schema') == SCHEMA_VERSION:
+        return response
+    if not isinstance(response, list):
+        return response
+    attractions = []
+    for place in response:
+        projected = project_fields(place, ATTRACTION_FIELDS)
+        if 'point' in projected:
+            projected['point'] = {'lon': projected['point']['lon'],
+                                  'lat': projected['point']['lat']}
+        attractions.append(projected)
+    return {'_schema': SCHEMA_VERSION, 'attractions': attractions}
+
+
+def attractions_from_entry(entry):
+    ''' get the list of attractions from a cached attraction entry
+
+    Parameters
+    ----------
+    entry: list or dict
+        a projected entry, or a raw response cached before the projection
+
+    Returns
+    -------
+    list
+        or None if the entry is not a list of attractions, eg. an OpenTripMap
+        error body cached before the projection
+    '''
+
+    if isinstance(entry, dict) and '_schema' in entry:
+        entry = entry.get('attractions')
+    if not isinstance(entry, list):
+        return None
+    return entry
+
+
+def compact_cache_file(cache_filename, project_function):
+    ''' project every entry of an existing cache file in place
+
+    Parameters
+    ----------
+    cache_filename: str
+        the name of the json cache file
+
+    project_function: function
+        the projection to apply to each entry
+
+    Returns
+    -------
+    tuple
+        the size of the file before and after, in bytes
+    '''
+
+    from app_main import locked_cache_file, open_cache, save_cache
+    from binary_cache import build_binary_cache
+
+    with locked_cache_file(cache_filename):
+        size_before = os.path.getsize(cache_filename)
+        cache_dict = open_cache(cache_filename)
+        for key in cache_dict:
+            cache_dict[key] = project_function(cache_dict[key])
+        save_cache(cache_dict, cache_filename)
+        build_binary_cache(cache_dict, cache_filename)
+    return size_before, os.path.getsize(cache_filename)
+
+
+if __name__ == '__main__':
+    # migrate the cache files written before the projection, eg.
+    # python projection.py
+    migrations = {'city_location_attraction.json': project_attractions_response,
+                  'hotels_cache.json': project_hotels_response}
+    for name in sys.argv[1:] or migrations:
+        before, after = compact_cache_file(name, migrations[name])
+        print(f'{name}: {before} -> {after} bytes')
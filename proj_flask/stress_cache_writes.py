@@ -0,0 +1,84 @@
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from app_main import open_cache, update_cache
+
+
+# run from the proj_flask directory, eg.
+#     python stress_cache_writes.py [writers] [entries per writer]
+# many processes add their own entries to one cache file at the same time
+# while another process keeps reading it; fails if an entry is lost or a
+# reader sees a half-written file
+
+
+def write_entries(cache_filename, writer_number, num_of_entries):
+    for i in range(num_of_entries):
+        key = f'writer_{writer_number}_entry_{i}'
+        update_cache(cache_filename, {key: {'writer': writer_number, 'entry': i}},
+                     with_snapshot=(i % 10 == 0))
+
+
+def read_entries(cache_filename, stop_event, failures):
+    largest_seen = 0
+    while not stop_event.is_set():
+        try:
+            with open(cache_filename, 'r') as fr:
+                contents = json.load(fr)
+        except FileNotFoundError:
+            continue
+        except ValueError:
+            failures.put('reader saw a half-written cache file')
+            return
+        if len(contents) < largest_seen:
+            failures.put(f'cache shrank from {largest_seen} to {len(contents)} entries')
+            return
+        largest_seen = len(contents)
+
+
+if __name__ == '__main__':
+    num_of_writers = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    num_of_entries = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    work_dir = tempfile.mkdtemp(prefix='stress_cache_')
+    cache_filename = os.path.join(work_dir, 'stress_cache.json')
+
+    stop_event = multiprocessing.Event()
+    failures = multiprocessing.Queue()
+    reader = multiprocessing.Process(target=read_entries,
+                                     args=(cache_filename, stop_event, failures))
+    reader.start()
+    start = time.perf_counter()
+    writers = [multiprocessing.Process(target=write_entries,
+                                       args=(cache_filename, i, num_of_entries))
+               for i in range(num_of_writers)]
+    for writer in writers:
+        writer.start()
+    for writer in writers:
+        writer.join()
+    elapsed = time.perf_counter() - start
+    stop_event.set()
+    reader.join()
+
+    cache_dict = open_cache(cache_filename)
+    expected = {f'writer_{w}_entry_{i}'
+                for w in range(num_of_writers) for i in range(num_of_entries)}
+    lost = expected - set(cache_dict)
+    shutil.rmtree(work_dir)
+    problems = []
+    while not failures.empty():
+        problems.append(failures.get())
+    if any(writer.exitcode != 0 for writer in writers):
+        problems.append('a writer process failed')
+    if lost:
+        problems.append(f'{len(lost)} of {len(expected)} entries were lost')
+
+    print(f'{num_of_writers} writers x {num_of_entries} entries in {elapsed:.2f}s')
+    if problems:
+        for problem in problems:
+            print('FAILED:', problem)
+        sys.exit(1)
+    print(f'OK: all {len(expected)} entries present')
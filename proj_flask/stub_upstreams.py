@@ -0,0 +1,278 @@
+import argparse
+import datetime
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from upstream import STUB_PORTS
+
+
+# the cities the geoname stub knows outside the US, everything else that is
+# not in NOT_FOUND_CITIES is a US city
+FOREIGN_CITIES = {'london': ('GB', 51.51, -0.13), 'paris': ('FR', 48.85, 2.35),
+                  'tokyo': ('JP', 35.69, 139.69), 'toronto': ('CA', 43.7, -79.42)}
+NOT_FOUND_CITIES = {'atlantis', 'gotham', 'nowhere'}
+# the misspelled names the geoname stub finds the city of, as OpenTripMap does
+MISSPELLED_CITIES = {'detroitt': 'detroit', 'chicagoo': 'chicago', 'pheonix': 'phoenix'}
+
+# the weather of the forecast stub, as (wx_desc, wx_icon); the icons are the
+# ones in static/pictures
+WEATHER_KINDS = [('Sunny', 'Sunny.gif'), ('Clear', 'Clear.gif'),
+                 ('Partly cloudy', 'PartlyCloudyDay.gif'), ('Cloudy', 'Cloudy.gif'),
+                 ('Overcast', 'Overcast.gif'), ('Mist', 'Mist.gif'),
+                 ('Light rain', 'OccLightRain.gif'), ('Moderate rain', 'ModRain.gif'),
+                 ('Heavy rain', 'HeavyRain.gif'), ('Light snow', 'OccLightSnow.gif'),
+                 ('Thunderstorm', 'CloudRainThunder.gif')]
+
+PLACE_WORDS = ['Old', 'Grand', 'North', 'Riverside', 'Memorial', 'Liberty', 'Union', 'Lake',
+               'Heritage', 'Pioneer', 'Central', 'Harbor']
+HOTEL_WORDS = ['Inn', 'Suites', 'Hotel', 'Lodge', 'Resort', 'Motel']
+
+
+def seeded_random(*parts):
+    ''' a random generator seeded by the request, so that the same request
+    always gets the same synthetic response
+
+    Parameters
+    ----------
+    parts: str
+        the parts of the request that make it unique
+
+    Returns
+    -------
+    random.Random
+    '''
+
+    digest = hashlib.sha1('|'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+    return random.Random(int(digest[:16], 16))
+
+
+def fake_geoname(name):
+    ''' the OpenTripMap geoname response for a city name
+    '''
+
+    city = name.strip().lower()
+    city = MISSPELLED_CITIES.get(city, city)
+    if city in NOT_FOUND_CITIES:
+        return {'error': 'Object not found', 'status': 'NOT_FOUND'}
+    if city in FOREIGN_CITIES:
+        country, lat, lon = FOREIGN_CITIES[city]
+    else:
+        rng = seeded_random('geoname', city)
+        # somewhere in the contiguous US
+        country, lat, lon = 'US', rng.uniform(26.0, 48.0), rng.uniform(-122.0, -71.0)
+    return {'name': city.title(), 'country': country, 'lat': lat, 'lon': lon,
+            'population': seeded_random('population', city).randint(10000, 2000000),
+            'timezone': 'America/New_York', 'status': 'OK'}
+
+
+def fake_places(lon, lat, radius, kinds, limit):
+    ''' the OpenTripMap radius response around a point
+    '''
+
+    rng = seeded_random('radius', round(lon, 4), round(lat, 4), kinds)
+    count = min(limit, rng.randint(limit // 2, limit * 2))
+    places = []
+    for number in range(count):
+        # uniform over the disc of the search radius
+        distance = radius * math.sqrt(rng.random())
+        angle = rng.uniform(0, 2 * math.pi)
+        place_lat = lat + distance * math.cos(angle) / 111320
+        place_lon = lon + distance * math.sin(angle) / (111320 * math.cos(math.radians(lat)))
+        xid = f'S{rng.randrange(10 ** 8):08d}'
+        places.append({'xid': xid,
+                       'name': f'{rng.choice(PLACE_WORDS)} {kinds.split(",")[0].replace("_", " ").title()} {number + 1}',
+                       'dist': distance, 'rate': rng.choice([1, 2, 3, 3, 7, 7]),
+                       'osm': f'node/{rng.randrange(10 ** 9)}', 'kinds': f'{kinds},interesting_places',
+                       'point': {'lon': round(place_lon, 6), 'lat': round(place_lat, 6)}})
+    return sorted(places, key=lambda place: place['dist'])
+
+
+def fake_forecast(lat, lon):
+    ''' the Weather Unlocked forecast response for a point, 7 days of 3-hour
+    timeframes
+    '''
+
+    rng = seeded_random('forecast', lat, lon, datetime.date.today())
+    days = []
+    for day_number in range(7):
+        date = datetime.date.today() + datetime.timedelta(days=day_number)
+        low = rng.randint(-10, 25)
+        high = low + rng.randint(3, 15)
+        timeframes = []
+        for hour in range(0, 2400, 300):
+            wx_desc, wx_icon = rng.choice(WEATHER_KINDS)
+            timeframes.append({'date': date.strftime('%d/%m/%Y'), 'time': hour,
+                               'wx_desc': wx_desc, 'wx_icon': wx_icon,
+                               'temp_c': rng.randint(low, high)})
+        days.append({'date': date.strftime('%d/%m/%Y'), 'temp_min_c': low, 'temp_max_c': high,
+                     'Timeframes': timeframes})
+    return {'Days': days}
+
+
+def fake_businesses(lat, lon):
+    ''' the Yelp business search response for hotels near a point
+    '''
+
+    rng = seeded_random('hotels', round(lat, 4), round(lon, 4))
+    businesses = []
+    for number in range(rng.randint(0, 20)):
+        name = f'{rng.choice(PLACE_WORDS)} {rng.choice(HOTEL_WORDS)} {number + 1}'
+        alias = name.lower().replace(' ', '-')
+        business = {'id': f'{rng.randrange(16 ** 12):012x}', 'alias': alias, 'name': name,
+                    'url': f'https://www.yelp.com/biz/{alias}',
+                    'review_count': rng.randint(0, 900),
+                    'rating': rng.choice([2.0, 2.5, 3.0, 3.5, 4.0, 4.5, 5.0]),
+                    'display_phone': f'({rng.randint(200, 999)}) 555-{rng.randint(0, 9999):04d}',
+                    'coordinates': {'latitude': lat + rng.uniform(-0.02, 0.02),
+                                    'longitude': lon + rng.uniform(-0.02, 0.02)},
+                    'distance': rng.uniform(50, 3000)}
+        # like Yelp, some hotels have no price
+        if rng.random() < 0.8:
+            business['price'] = '$' * rng.randint(1, 4)
+        businesses.append(business)
+    return {'businesses': businesses, 'total': len(businesses),
+            'region': {'center': {'latitude': lat, 'longitude': lon}}}
+
+
+def opentripmap_response(path, query):
+    if path.endswith('/geoname'):
+        return 200, fake_geoname(query.get('name', ''))
+    if path.endswith('/radius'):
+        return 200, fake_places(float(query['lon']), float(query['lat']),
+                                float(query.get('radius', 1000)), query.get('kinds', 'interesting_places'),
+                                int(query.get('limit', 20)))
+    return 404, {'error': 'Unknown method'}
+
+
+def weatherunlocked_response(path, query):
+    # /api/forecast/{lat},{lon}
+    lat, _, lon = path.rsplit('/', 1)[-1].partition(',')
+    return 200, fake_forecast(float(lat), float(lon))
+
+
+def yelp_response(path, query):
+    if path.endswith('/businesses/search'):
+        return 200, fake_businesses(float(query['latitude']), float(query['longitude']))
+    return 404, {'error': {'code': 'NOT_FOUND', 'description': 'Resource could not be found.'}}
+
+
+# the synthetic responses of each api, a function of the path and the query
+STUB_RESPONSES = {'opentripmap': opentripmap_response,
+                  'weatherunlocked': weatherunlocked_response,
+                  'yelp': yelp_response}
+
+
+def make_handler(upstream, latency_ms, jitter_ms, error_rate):
+    ''' the request handler class of one stub server
+
+    Parameters
+    ----------
+    upstream: str
+        the name of the api to imitate, a key of STUB_RESPONSES
+
+    latency_ms: float
+        the delay before each response, in milliseconds
+
+    jitter_ms: float
+        a random extra delay of up to this many milliseconds
+
+    error_rate: float
+        the share of the requests answered with an HTTP 500 error
+
+    Returns
+    -------
+    class
+    '''
+
+    respond = STUB_RESPONSES[upstream]
+    # not seeded by the request, so the errors and the jitter vary
+    rng = random.Random()
+    rng_lock = threading.Lock()
+
+    class StubHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            with rng_lock:
+                delay = latency_ms + rng.uniform(0, jitter_ms)
+                failing = rng.random() < error_rate
+            time.sleep(delay / 1000)
+            url = urlparse(self.path)
+            query = {name: values[0] for name, values in parse_qs(url.query).items()}
+            if failing:
+                status, body = 500, {'error': 'stub server error'}
+            else:
+                try:
+                    status, body = respond(url.path, query)
+                except (KeyError, ValueError) as error:
+                    status, body = 400, {'error': f'bad request: {error!r}'}
+            payload = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            # one line per request is too much for a load test
+            pass
+
+    return StubHandler
+
+
+def start_stub_upstreams(latency_ms=0.0, jitter_ms=0.0, error_rate=0.0, ports=None):
+    ''' start a stub server for each api, on background threads
+
+    Parameters
+    ----------
+    latency_ms: float
+        the delay before each response, in milliseconds
+
+    jitter_ms: float
+        a random extra delay of up to this many milliseconds
+
+    error_rate: float
+        the share of the requests answered with an HTTP 500 error
+
+    ports: dict
+        the port of each api, STUB_PORTS by default (0 picks a free port)
+
+    Returns
+    -------
+    dict
+        the running server of each api; call shutdown() on them to stop
+    '''
+
+    servers = {}
+    for upstream, port in (ports or STUB_PORTS).items():
+        server = ThreadingHTTPServer(('127.0.0.1', port),
+                                     make_handler(upstream, latency_ms, jitter_ms, error_rate))
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name=f'stub-{upstream}',
+                         daemon=True).start()
+        servers[upstream] = server
+    return servers
+
+
+if __name__ == '__main__':
+    # eg. python stub_upstreams.py --latency-ms 200 --jitter-ms 100 --error-rate 0.05
+    # and in another terminal: TRAVEL_OFFLINE=1 python app_main.py
+    parser = argparse.ArgumentParser(description='serve synthetic OpenTripMap, Weather '
+                                                 'Unlocked and Yelp responses locally')
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--jitter-ms', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+    servers = start_stub_upstreams(args.latency_ms, args.jitter_ms, args.error_rate)
+    for upstream, server in servers.items():
+        print(f'{upstream} stub on http://127.0.0.1:{server.server_address[1]}')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        for server in servers.values():
+            server.shutdown()
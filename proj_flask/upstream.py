@@ -0,0 +1,454 @@
+import collections
+import json
+import os
+import threading
+import time
+
+import requests
+
+import metrics
+# the api keys, from secrets.py next to app_main.py (see README.txt); without
+# that file this is the standard library module, which has none of them
+import secrets
+
+
+# TRAVEL_OFFLINE=1 serves everything from the cache files, and sends the
+# misses to the local stub servers of stub_upstreams.py instead of the apis;
+# no api key is needed then
+OFFLINE = os.environ.get('TRAVEL_OFFLINE') == '1'
+
+# the base url of each api, overridden by TRAVEL_<API>_URL (eg.
+# TRAVEL_YELP_URL=http://127.0.0.1:9000/v3)
+DEFAULT_BASE_URLS = {'opentripmap': 'https://api.opentripmap.com/0.1/en/places',
+                     'weatherunlocked': 'http://api.weatherunlocked.com/api',
+                     'yelp': 'https://api.yelp.com/v3'}
+
+# where stub_upstreams.py serves each api by default
+STUB_PORTS = {'opentripmap': 8701, 'weatherunlocked': 8702, 'yelp': 8703}
+STUB_BASE_URLS = {'opentripmap': f"http://127.0.0.1:{STUB_PORTS['opentripmap']}/0.1/en/places",
+                  'weatherunlocked': f"http://127.0.0.1:{STUB_PORTS['weatherunlocked']}/api",
+                  'yelp': f"http://127.0.0.1:{STUB_PORTS['yelp']}/v3"}
+
+
+# the query parameters that hold api keys, never written to a cassette
+SECRET_PARAMS = {'apikey', 'app_id', 'app_key'}
+
+
+class UpstreamError(Exception):
+    '''an upstream api call failed, timed out or returned an error body'''
+
+
+class CircuitOpenError(UpstreamError):
+    '''the circuit of an upstream api is open, the call was not made'''
+
+
+class CircuitBreaker:
+    '''tracks the recent calls to one upstream api and stops calling it
+    while it is failing or slow
+
+    The breaker is closed while fewer than failure_rate of the last
+    window_size calls failed; a call slower than slow_call_seconds counts as
+    failed. Once tripped, the breaker stays open for open_seconds, then lets
+    a single trial call through (half open): it closes again if that call
+    succeeds, and re-opens if it fails. The calls still running when the
+    breaker tripped do not count.
+
+    Instance Attributes
+    -------------------
+    name: str
+        the name of the upstream api
+
+    failure_rate: float
+        the share of failed calls that trips the breaker
+
+    slow_call_seconds: float
+        calls slower than this count as failed
+
+    window_size: int
+        the number of recent calls looked at
+
+    min_calls: int
+        the breaker does not trip before this many calls are recorded
+
+    open_seconds: float
+        how long the breaker stays open before the trial call
+    '''
+
+    def __init__(self, name, failure_rate=0.5, slow_call_seconds=5.0, window_size=20,
+                 min_calls=5, open_seconds=30.0):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.window_size = window_size
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self._lock = threading.Lock()
+        self._outcomes = collections.deque(maxlen=window_size)
+        self._opened_at = None
+        # the token of the calls made while closed, and of the trial call
+        # while half open
+        self._closed_token = object()
+        self._trial_token = None
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self._opened_at is None:
+            return 'closed'
+        if time.monotonic() - self._opened_at < self.open_seconds:
+            return 'open'
+        return 'half_open'
+
+    def allow_request(self):
+        ''' whether a call may be made now
+
+        Returns
+        -------
+        object
+            None if the call may not be made, else the token to pass to
+            record with the outcome of the call, whatever it is
+        '''
+
+        with self._lock:
+            state = self._state()
+            if state == 'closed':
+                return self._closed_token
+            if state == 'half_open' and self._trial_token is None:
+                self._trial_token = object()
+                return self._trial_token
+            return None
+
+    def record(self, token, succeeded, elapsed):
+        ''' record the outcome of a call
+
+        Parameters
+        ----------
+        token: object
+            what allow_request returned for the call; only the trial call
+            closes or re-opens a half-open breaker
+
+        succeeded: bool
+            whether the call returned a valid response
+
+        elapsed: float
+            how long the call took, in seconds
+
+        Returns
+        -------
+        None
+        '''
+
+        failed = not succeeded or elapsed > self.slow_call_seconds
+        with self._lock:
+            if token is self._trial_token:
+                self._trial_token = None
+                if failed:
+                    self._opened_at = time.monotonic()
+                else:
+                    self._opened_at = None
+                    self._outcomes.clear()
+                    # the calls of before the breaker tripped count no more
+                    self._closed_token = object()
+                return
+            if token is not self._closed_token or self._opened_at is not None:
+                # started before the breaker tripped
+                return
+            self._outcomes.append(failed)
+            if (len(self._outcomes) >= self.min_calls
+                    and sum(self._outcomes) >= self.failure_rate * len(self._outcomes)):
+                self._opened_at = time.monotonic()
+                self._outcomes.clear()
+
+
+class Cassette:
+    '''the upstream calls recorded to, or replayed from, a cassette file
+
+    A cassette file has one json line per call, with the api, the path below
+    its base url, the query parameters (without the api keys), the HTTP status,
+    the decoded body and how long the call took. A recording is appended to,
+    so several worker processes can record one session.
+
+    When replaying, the calls with the same api, path and parameters are
+    played back in the order they were recorded (the last one is repeated),
+    after their recorded latency multiplied by speed.
+
+    Instance Attributes
+    -------------------
+    filename: str
+        the name of the cassette file
+
+    mode: str
+        'record' or 'replay'
+
+    speed: float
+        the factor applied to the recorded latency when replaying, 0 replays
+        without any delay
+    '''
+
+    def __init__(self, filename, mode, speed=1.0):
+        if mode not in ('record', 'replay'):
+            raise ValueError(f'unknown cassette mode {mode!r}')
+        self.filename = filename
+        self.mode = mode
+        self.speed = speed
+        self._lock = threading.Lock()
+        self._interactions = {}
+        self._played = collections.Counter()
+        if mode == 'replay':
+            with open(filename, 'r') as fr:
+                for line in fr:
+                    if line.strip():
+                        interaction = json.loads(line)
+                        key = self.interaction_key(interaction['upstream'], interaction['path'],
+                                                   interaction['params'])
+                        self._interactions.setdefault(key, []).append(interaction)
+
+    def __len__(self):
+        return sum(len(interactions) for interactions in self._interactions.values())
+
+    @staticmethod
+    def interaction_key(upstream, path, params):
+        return upstream, path, json.dumps(params, sort_keys=True)
+
+    def record(self, upstream, path, params, status, body, elapsed):
+        ''' append a call to the cassette file
+
+        Parameters
+        ----------
+        upstream: str
+            the name of the upstream api
+
+        path: str
+            the url of the call, below the base url of the api
+
+        params: dict
+            the query parameters, without the api keys
+
+        status: int
+            the HTTP status of the response
+
+        body:
+            the decoded json body of the response
+
+        elapsed: float
+            how long the call took, in seconds
+
+        Returns
+        -------
+        None
+        '''
+
+        line = json.dumps({'upstream': upstream, 'path': path, 'params': params,
+                           'status': status, 'body': body, 'elapsed': elapsed,
+                           'recorded_at': time.time()}) + '\n'
+        with self._lock:
+            # a single append write, so concurrent recorders do not interleave
+            fd = os.open(self.filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line.encode('utf-8'))
+            finally:
+                os.close(fd)
+
+    def play(self, upstream, path, params):
+        ''' play back a recorded call, after its (scaled) latency
+
+        Parameters
+        ----------
+        upstream: str
+            the name of the upstream api
+
+        path: str
+            the url of the call, below the base url of the api
+
+        params: dict
+            the query parameters, without the api keys
+
+        Returns
+        -------
+        tuple
+            the HTTP status and the decoded body
+
+        Raises
+        ------
+        UpstreamError
+            if the call is not in the cassette
+        '''
+
+        key = self.interaction_key(upstream, path, params)
+        interactions = self._interactions.get(key)
+        if not interactions:
+            raise UpstreamError(f'{upstream} {path} {params} is not in {self.filename}')
+        with self._lock:
+            position = min(self._played[key], len(interactions) - 1)
+            self._played[key] += 1
+        interaction = interactions[position]
+        if self.speed > 0:
+            time.sleep(interaction['elapsed'] * self.speed)
+        return interaction['status'], interaction['body']
+
+
+def cassette_from_environment():
+    ''' the cassette set by TRAVEL_RECORD=<file> or TRAVEL_REPLAY=<file>, with
+    TRAVEL_REPLAY_SPEED scaling the replayed latency (1 by default)
+
+    Returns
+    -------
+    Cassette or None
+    '''
+
+    if os.environ.get('TRAVEL_RECORD'):
+        return Cassette(os.environ['TRAVEL_RECORD'], 'record')
+    if os.environ.get('TRAVEL_REPLAY'):
+        return Cassette(os.environ['TRAVEL_REPLAY'], 'replay',
+                        float(os.environ.get('TRAVEL_REPLAY_SPEED', '1')))
+    return None
+
+
+# the cassette the upstream calls are recorded to or replayed from, if any;
+# benchmarks can also set it directly
+cassette = cassette_from_environment()
+
+
+def base_url(upstream):
+    ''' the base url of an upstream api, see DEFAULT_BASE_URLS
+
+    Parameters
+    ----------
+    upstream: str
+        the name of the upstream api
+
+    Returns
+    -------
+    str
+    '''
+
+    override = os.environ.get(f'TRAVEL_{upstream.upper()}_URL')
+    if override:
+        return override.rstrip('/')
+    if OFFLINE:
+        return STUB_BASE_URLS[upstream]
+    return DEFAULT_BASE_URLS[upstream]
+
+
+def api_key(name):
+    ''' an api key or token from secrets.py
+
+    Parameters
+    ----------
+    name: str
+        the name of the key in secrets.py, eg. 'yelp_api_key'
+
+    Returns
+    -------
+    str
+
+    Raises
+    ------
+    UpstreamError
+        if the key is not set (and not in offline mode)
+    '''
+
+    if OFFLINE or (cassette is not None and cassette.mode == 'replay'):
+        return 'offline'
+    value = getattr(secrets, name, None)
+    if value is None:
+        raise UpstreamError(f'{name} is not set in secrets.py')
+    return value
+
+
+# one breaker per upstream api, in each process
+circuit_breakers = {'opentripmap': CircuitBreaker('opentripmap'),
+                    'weatherunlocked': CircuitBreaker('weatherunlocked'),
+                    'yelp': CircuitBreaker('yelp')}
+
+# (connect, read) timeouts of the upstream calls, in seconds
+UPSTREAM_TIMEOUT = (3.05, 10)
+
+
+def get_json(upstream, url, params=None, headers=None, validate=None):
+    ''' GET a json document from an upstream api, through its circuit breaker
+
+    Parameters
+    ----------
+    upstream: str
+        the name of the upstream api, a key of circuit_breakers
+
+    url: str
+        the url to get
+
+    params: dict
+        the query parameters
+
+    headers: dict
+        the request headers
+
+    validate: function
+        optional, takes the decoded body and returns whether it is a valid
+        response (eg. not an error body)
+
+    Returns
+    -------
+    the decoded json body
+
+    Raises
+    ------
+    CircuitOpenError
+        if the circuit of the upstream is open
+    UpstreamError
+        if the call failed, timed out, or returned an invalid body
+    '''
+
+    breaker = circuit_breakers[upstream]
+    token = breaker.allow_request()
+    if token is None:
+        raise CircuitOpenError(f'{upstream} is unavailable (circuit open)')
+    start = time.monotonic()
+    succeeded = False
+    try:
+        if cassette is None:
+            response = requests.get(url, params=params, headers=headers,
+                                    timeout=UPSTREAM_TIMEOUT)
+            status, body = response.status_code, response.json()
+        else:
+            status, body = cassette_call(upstream, url, params, headers)
+        if validate is not None and not validate(body):
+            raise UpstreamError(f'{upstream} returned an error body '
+                                f'(HTTP {status}): {str(body)[:200]}')
+        succeeded = True
+    except (requests.RequestException, ValueError) as error:
+        raise UpstreamError(f'{upstream} call failed: {error!r}') from error
+    finally:
+        # whatever was raised, even by validate, so that a trial call always
+        # closes or re-opens the breaker
+        elapsed = time.monotonic() - start
+        breaker.record(token, succeeded, elapsed)
+        metrics.observe_upstream_call(upstream, succeeded, elapsed)
+    return body
+
+
+def cassette_call(upstream, url, params, headers):
+    ''' make a call through the cassette: record it, or replay it
+
+    The calls are matched on the url below the base url of the api, so a
+    session recorded against the real apis can be replayed in offline mode.
+
+    Returns
+    -------
+    tuple
+        the HTTP status and the decoded body
+    '''
+
+    path = url[len(base_url(upstream)):] if url.startswith(base_url(upstream)) else url
+    public_params = {name: value for name, value in (params or {}).items()
+                     if name not in SECRET_PARAMS}
+    if cassette.mode == 'replay':
+        return cassette.play(upstream, path, public_params)
+    start = time.monotonic()
+    response = requests.get(url, params=params, headers=headers, timeout=UPSTREAM_TIMEOUT)
+    body = response.json()
+    cassette.record(upstream, path, public_params, response.status_code, body,
+                    time.monotonic() - start)
+    return response.status_code, body
@@ -0,0 +1,53 @@
+import os
+import signal
+import sys
+
+
+# the pid file of the gunicorn master process, see gunicorn.conf.py
+PID_FILENAME = 'gunicorn.pid'
+
+
+def create_app():
+    ''' the WSGI app factory used by the production server
+
+    The app is created once in the gunicorn master (preload_app), so the
+    database check and the cache snapshots are ready before the workers are
+    forked and /readyz answers 200 as soon as a worker accepts requests.
+
+    Returns
+    -------
+    the Flask app
+    '''
+
+    # the cache and database paths in app_main.py are relative to this
+    # directory
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    from app_main import app, preload_caches
+    app.config['DEBUG'] = False
+    app.config['PROPAGATE_EXCEPTIONS'] = False
+    preload_caches()
+    return app
+
+
+def reload_workers():
+    ''' gracefully replace the workers of the running server
+
+    Sends SIGHUP to the gunicorn master: new workers are started (and refresh
+    the cache snapshots in post_worker_init) before the old ones are told to
+    finish their in-flight requests and exit, so no request is dropped.
+    '''
+
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           PID_FILENAME)) as fr:
+        master_pid = int(fr.read().strip())
+    os.kill(master_pid, signal.SIGHUP)
+    print(f'sent SIGHUP to gunicorn master {master_pid}')
+
+
+if __name__ == '__main__':
+    # python wsgi.py reload   -- after rebuilding the caches or the database
+    if sys.argv[1:] == ['reload']:
+        reload_workers()
+    else:
+        print('usage: gunicorn -c gunicorn.conf.py\n'
+              '       python wsgi.py reload')